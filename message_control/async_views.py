@@ -0,0 +1,101 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from socialchat.async_views import async_api_view, get_view, render
+from .models import GenericFileUpload
+from .serializers import GenericFileUploadSerializer
+from .uploads import StorageUploadHandler, StoredUploadedFile
+from .views import ConversationView, MessageView, message_delivery, upload_name, upload_storage
+
+
+@async_api_view(("GET", "POST"))
+async def messages(request):
+    if request.method == "POST":
+        return await create_message(request)
+
+    # Conversation history, one short hop per query
+    view = get_view(MessageView, "list", request)
+    queryset = view.filter_queryset(view.get_queryset())
+    page = await sync_to_async(view.paginate_queryset)(queryset)
+    unseen_counts = await sync_to_async(view.get_unseen_counts)(page)
+    serializer = view.serializer_class(
+        page, many=True, context={**view.get_serializer_context(), "unseen_counts": unseen_counts})
+    data = await sync_to_async(lambda: serializer.data)()
+    return render(view.get_paginated_response(data))
+
+
+async def create_message(request):
+    view = get_view(MessageView, "create", request)
+    # Multipart bodies may spool to disk, parse them off the event loop
+    await sync_to_async(lambda: view.request.data, thread_sensitive=False)()
+    serializer, attachments = view.validate_message(view.request)
+    files = await sync_to_async(view.get_attachment_files)(attachments)
+    await sync_to_async(view.save_message)(serializer, attachments, files)
+
+    # The message is committed, rendering it reads the profile snapshots
+    deliver = await sync_to_async(message_delivery)(serializer)
+    # Publishing may write to the broker, the notification is queued for the dispatcher
+    await sync_to_async(deliver, thread_sensitive=False)()
+    return render(Response(serializer.data, status=201))
+
+
+@async_api_view(("GET",))
+async def conversations(request):
+    view = get_view(ConversationView, "list", request)
+    queryset = view.filter_queryset(view.get_queryset())
+    page = await sync_to_async(view.paginate_queryset)(queryset)
+    serializer = view.serializer_class(page, many=True, context=view.get_serializer_context())
+    data = await sync_to_async(lambda: serializer.data)()
+    return render(view.get_paginated_response(data))
+
+
+def parse_upload(request):
+    """The ``file_upload`` file of the body, parsed with the sync endpoint's upload handlers."""
+    if settings.UPLOAD_STREAMING:
+        request.upload_handlers = [StorageUploadHandler(request, upload_storage(), upload_name)]
+    return request.FILES.get("file_upload")
+
+
+@async_api_view(("POST",), authenticated=False)
+async def file_upload(request):
+    # The multipart parser blocks on the body, temp files and storage, so
+    # it runs on a worker thread rather than the event loop
+    upload = await sync_to_async(parse_upload, thread_sensitive=False)(request)
+    if upload is None:
+        return render(Response({"file_upload": ["No file was submitted."]}, status=400))
+
+    if isinstance(upload, StoredUploadedFile):
+        # Streamed to storage while the body was parsed
+        return await sync_to_async(create_file_upload)(request, upload.name, upload.content_hash)
+
+    content_hash = getattr(upload, "content_hash", None)
+    if content_hash is None:
+        content_hash = await sync_to_async(
+            GenericFileUpload.objects.hash_content, thread_sensitive=False)(upload)
+    instance = await sync_to_async(GenericFileUpload.objects.acquire)(content_hash, upload_owner(request))
+    if instance is not None:
+        return file_upload_response(request, instance)
+
+    # The storage round trip runs off the ORM thread, other requests keep
+    # using the database while the bytes are written
+    name = await sync_to_async(upload_storage().save, thread_sensitive=False)(
+        upload_name(upload.name), upload)
+    return await sync_to_async(create_file_upload)(request, name, content_hash)
+
+
+def upload_owner(request):
+    user = getattr(request, "user", None)
+    return user if user is not None and user.is_authenticated else None
+
+
+def create_file_upload(request, name, content_hash):
+    return file_upload_response(
+        request, GenericFileUpload.objects.store(name, content_hash, upload_owner(request)))
+
+
+def file_upload_response(request, instance):
+    serializer = GenericFileUploadSerializer(
+        instance, context={"request": Request(request)})
+    return render(Response(serializer.data, status=201))
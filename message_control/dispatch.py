@@ -0,0 +1,189 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationDispatcher:
+    """Delivers socket notifications from a bounded in-memory queue.
+
+    A small pool of worker threads drains the queue and retries failed
+    deliveries with exponential backoff, so the request cycle never waits on
+    the socket server. Each notification is POSTed as one JSON object. With
+    ``batched`` on, for socket servers that accept it, pending
+    notifications are coalesced into a single POST of a JSON array.
+    """
+
+    def __init__(self, url=None, workers=None, max_queue=None, batch_size=None,
+                 batch_wait=None, timeout=None, max_retries=None, backoff=None, batched=None):
+        self.url = url if url is not None else settings.SOCKET_SERVER
+        self.workers = workers or settings.NOTIFICATION_WORKERS
+        self.batch_size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+        self.batch_wait = settings.NOTIFICATION_BATCH_WAIT if batch_wait is None else batch_wait
+        self.timeout = timeout or settings.NOTIFICATION_TIMEOUT
+        self.max_retries = settings.NOTIFICATION_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.NOTIFICATION_RETRY_BACKOFF if backoff is None else backoff
+        self.batched = settings.NOTIFICATION_BATCHED if batched is None else batched
+
+        self.queue = queue.Queue(
+            maxsize=max_queue or settings.NOTIFICATION_QUEUE_SIZE)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stopping = threading.Event()
+        self._stats = {
+            "enqueued": 0,
+            "sent": 0,
+            "dropped": 0,
+            "failed": 0,
+            "batches": 0,
+            "retries": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._run, name=f"notification-dispatch-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """Stop the workers once everything already queued has been sent, or ``timeout`` passed."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        deadline = time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning("Stopping with %s notifications undelivered",
+                                   self.queue.unfinished_tasks)
+                    break
+                self.queue.all_tasks_done.wait(remaining)
+        self._stopping.set()
+        for thread in threads:
+            thread.join(timeout)
+
+    def enqueue(self, notification):
+        if not self.url:
+            return False
+        self.start()
+        try:
+            self.queue.put_nowait((time.monotonic(), notification))
+        except queue.Full:
+            self._incr("dropped")
+            logger.warning("Notification queue full, dropping notification")
+            return False
+        self._incr("enqueued")
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        delivered = stats.pop("latency_total")
+        stats["depth"] = self.queue.qsize()
+        stats["latency_avg"] = delivered / stats["sent"] if stats["sent"] else 0.0
+        return stats
+
+    def _incr(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._deliver(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _deliver(self, batch):
+        if self.batched:
+            self._post(json.dumps([notification for _, notification in batch]), batch)
+            return
+        for item in batch:
+            if self._stopping.is_set():
+                self._incr("failed")
+                continue
+            self._post(json.dumps(item[1]), [item])
+
+    def _post(self, payload, batch):
+        headers = {
+            "Content-Type": "application/json",
+        }
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._incr("retries")
+                # Wakes up early when stop() gives up on the queue
+                if self._stopping.wait(self.backoff * 2 ** (attempt - 1)):
+                    self._incr("failed", len(batch))
+                    return
+            try:
+                response = self.session.post(
+                    self.url, payload, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning("Notification batch failed: %s", e)
+                continue
+            if response.status_code < 400:
+                break
+            if response.status_code < 500:
+                logger.warning(
+                    "Notification batch rejected with status %s", response.status_code)
+                self._incr("failed", len(batch))
+                return
+        else:
+            self._incr("failed", len(batch))
+            return
+
+        now = time.monotonic()
+        latencies = [now - queued_at for queued_at, _ in batch]
+        with self._lock:
+            self._stats["sent"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["latency_total"] += sum(latencies)
+            self._stats["latency_max"] = max(
+                self._stats["latency_max"], *latencies)
+
+
+dispatcher = NotificationDispatcher()
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from message_control.models import UnreadCounter
+
+
+class Command(BaseCommand):
+    help = "Rebuild the unread counters from the message table and report any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check", action="store_true", help="Only report drift, do not rewrite the counters")
+
+    def handle(self, *args, **options):
+        drift = UnreadCounter.objects.rebuild(dry_run=options["check"])
+
+        for sender_id, receiver_id, stored, actual in drift:
+            self.stdout.write(
+                f"{sender_id} -> {receiver_id}: stored {stored}, actual {actual}")
+
+        if options["check"] and drift:
+            raise CommandError(f"{len(drift)} unread counters have drifted")
+
+        if options["check"]:
+            self.stdout.write(self.style.SUCCESS("Unread counters are in sync"))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Rebuilt unread counters, fixed {len(drift)} drifted rows"))
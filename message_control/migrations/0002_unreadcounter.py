@@ -0,0 +1,55 @@
+# Generated by Django 4.0.5 on 2026-10-18 11:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_unread_counters(apps, schema_editor):
+    Message = apps.get_model('message_control', 'Message')
+    UnreadCounter = apps.get_model('message_control', 'UnreadCounter')
+
+    unread = Message.objects.filter(is_read=False).order_by().values(
+        'sender_id', 'receiver_id').annotate(count=models.Count('id'))
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(**row) for row in unread], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('message_control', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='message',
+            options={'ordering': ('-created_at',)},
+        ),
+        migrations.AlterField(
+            model_name='messageattachment',
+            name='attachment',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_uploads', to='message_control.genericfileupload'),
+        ),
+        migrations.AlterField(
+            model_name='messageattachment',
+            name='message',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_attachments', to='message_control.message'),
+        ),
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('receiver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_counters', to=settings.AUTH_USER_MODEL)),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_counters_sent', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='unreadcounter',
+            constraint=models.UniqueConstraint(fields=('receiver', 'sender'), name='unique_unread_counter'),
+        ),
+        migrations.RunPython(populate_unread_counters,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.0.5 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+def populate_conversation_keys(apps, schema_editor):
+    Message = apps.get_model('message_control', 'Message')
+
+    pairs = Message.objects.order_by().values_list(
+        'sender_id', 'receiver_id').distinct()
+    for sender_id, receiver_id in pairs:
+        low, high = sorted((sender_id, receiver_id))
+        Message.objects.filter(sender_id=sender_id, receiver_id=receiver_id).update(
+            conversation_key=f'{low}:{high}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_control', '0002_unreadcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='conversation_key',
+            field=models.CharField(default='', editable=False, max_length=41),
+        ),
+        migrations.RunPython(populate_conversation_keys,
+                             migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation_key', 'created_at', 'id'], name='message_conversation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['receiver', 'sender'], name='message_unread_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.0.5 on 2026-10-18 11:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_conversations(apps, schema_editor):
+    Conversation = apps.get_model('message_control', 'Conversation')
+    Message = apps.get_model('message_control', 'Message')
+    UnreadCounter = apps.get_model('message_control', 'UnreadCounter')
+
+    unread = {(sender_id, receiver_id): count for sender_id, receiver_id, count
+              in UnreadCounter.objects.values_list('sender_id', 'receiver_id', 'count')}
+    keys = Message.objects.order_by().values_list(
+        'conversation_key', flat=True).distinct()
+
+    conversations = []
+    for key in keys:
+        latest = Message.objects.filter(conversation_key=key).order_by(
+            '-created_at', '-id').first()
+        for owner_id, peer_id in {(latest.sender_id, latest.receiver_id),
+                                  (latest.receiver_id, latest.sender_id)}:
+            conversations.append(Conversation(
+                owner_id=owner_id, peer_id=peer_id, last_message=latest,
+                last_activity=latest.created_at,
+                unread_count=unread.get((peer_id, owner_id), 0)))
+    Conversation.objects.bulk_create(conversations, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('message_control', '0003_message_conversation_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_activity', models.DateTimeField()),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_message', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='message_control.message')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL)),
+                ('peer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-last_activity',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['owner', 'last_activity', 'id'], name='conversation_inbox_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('owner', 'peer'), name='unique_conversation'),
+        ),
+        migrations.RunPython(populate_conversations,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.5 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_control', '0005_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genericfileupload',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='genericfileupload',
+            name='ref_count',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.5 on 2026-10-18 12:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_control', '0006_genericfileupload_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genericfileupload',
+            name='variants',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0.5 on 2026-10-18 12:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Counts do not say who uploaded what, existing uploads start without
+    # owners and are kept
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('message_control', '0007_genericfileupload_variants'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='genericfileupload',
+            name='ref_count',
+        ),
+        migrations.AddField(
+            model_name='genericfileupload',
+            name='owners',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='file_uploads', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
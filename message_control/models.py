@@ -1,12 +1,98 @@
-from django.db import models
+import hashlib
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 
 # Create your models here.
 
 
+class GenericFileUploadManager(models.Manager):
+
+    @staticmethod
+    def hash_content(content):
+        """SHA-256 hex digest of a File, read in chunks."""
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest()
+
+    def acquire(self, content_hash, owner=None):
+        """The upload holding ``content_hash`` with ``owner`` added to its owners, None when there is none."""
+        if not content_hash:
+            return None
+        with transaction.atomic():
+            # Locked so a concurrent release cannot delete it under us
+            upload = self.select_for_update().filter(content_hash=content_hash).first()
+            if upload is not None and owner is not None:
+                upload.owners.add(owner)
+        return upload
+
+    def store(self, content, content_hash=None, owner=None):
+        """Upload for ``content``, reusing the stored object when the same bytes were seen before.
+
+        ``content`` is an unsaved File or the name of an object already in
+        storage, which is deleted when an existing upload is reused.
+        ``owner``, when given, is added to the upload's owners.
+        """
+        if content_hash is None and not isinstance(content, str):
+            content_hash = self.hash_content(content)
+        storage = self.model._meta.get_field("file_upload").storage
+        while True:
+            upload = self.acquire(content_hash, owner)
+            if upload is not None:
+                if isinstance(content, str):
+                    storage.delete(content)
+                return upload
+
+            upload = self.model(file_upload=content, content_hash=content_hash)
+            try:
+                with transaction.atomic():
+                    upload.save()
+                    if owner is not None:
+                        upload.owners.add(owner)
+                return upload
+            except IntegrityError:
+                # A concurrent request stored the same bytes first, only our
+                # copy in storage is left to drop
+                content = upload.file_upload.name
+
+    def release(self, upload, owner):
+        """Drop ``owner`` from the upload's owners, deleting it once nobody owns or uses it.
+
+        Uploads still attached to a message or set as a profile picture are
+        kept, whoever uploaded them.
+        """
+        with transaction.atomic():
+            upload = self.select_for_update().filter(pk=upload.pk).first()
+            if upload is None:
+                return False
+            upload.owners.remove(owner)
+            deleted, _ = self.filter(
+                pk=upload.pk, owners=None, message_uploads=None, profile_picture=None).delete()
+        if deleted:
+            for variant in upload.variants.values():
+                upload.file_upload.storage.delete(variant["name"])
+            upload.file_upload.delete(save=False)
+        return bool(deleted)
+
+
 class GenericFileUpload(models.Model):
+    """A stored file, shared by every upload of the same content."""
     file_upload = models.FileField()
+    content_hash = models.CharField(
+        max_length=64, unique=True, null=True, editable=False)
+    owners = models.ManyToManyField(
+        "user_control.CustomUser", related_name="file_uploads", blank=True, editable=False)
+    variants = models.JSONField(default=dict, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = GenericFileUploadManager()
+
     def __str__(self):
         return f"{self.file_upload}"
 
@@ -18,14 +104,41 @@ class Message(models.Model):
         "user_control.CustomUser", related_name="message_receiver", on_delete=models.CASCADE)
     message = models.TextField(blank=True, null=True)
     is_read = models.BooleanField(default=False)
+    conversation_key = models.CharField(
+        max_length=41, default="", editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Message between {self.sender.username} and {self.receiver.username}"
 
+    def save(self, *args, **kwargs):
+        self.conversation_key = self.make_conversation_key(
+            self.sender_id, self.receiver_id)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "conversation_key"}
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def make_conversation_key(user_a, user_b):
+        """Same key for both directions of a conversation, e.g. "3:17"."""
+        low, high = sorted((int(user_a), int(user_b)))
+        return f"{low}:{high}"
+
+    @staticmethod
+    def unseen_counts(receiver_id, sender_ids):
+        """Unread message counts sent to receiver_id, keyed by sender id, in one query."""
+        return UnreadCounter.objects.counts_for(receiver_id, sender_ids)
+
     class Meta:
         ordering = ("-created_at",)
+        indexes = (
+            models.Index(fields=("conversation_key", "created_at", "id"),
+                         name="message_conversation_idx"),
+            models.Index(fields=("receiver", "sender"), condition=Q(is_read=False),
+                         name="message_unread_idx"),
+        )
 
 
 class MessageAttachment(models.Model):
@@ -38,3 +151,190 @@ class MessageAttachment(models.Model):
 
     class Meta:
         ordering = ("created_at",)
+
+
+class UnreadCounterManager(models.Manager):
+
+    @staticmethod
+    def state(message):
+        """The (sender_id, receiver_id) a message counts towards, or None once read."""
+        if message is None or message.is_read:
+            return None
+        return message.sender_id, message.receiver_id
+
+    def record_change(self, before, after):
+        """Move one unread message from state ``before`` to ``after``, as returned by state()."""
+        if before == after:
+            return
+        if before:
+            self.adjust(*before, -1)
+        if after:
+            self.adjust(*after, 1)
+
+    def adjust(self, sender_id, receiver_id, delta):
+        """Shift the counter by delta, mirrored on the receiver's conversation row."""
+        Conversation.objects.filter(owner_id=receiver_id, peer_id=sender_id).update(
+            unread_count=Greatest(F("unread_count") + delta, 0))
+
+        counter = self.filter(sender_id=sender_id, receiver_id=receiver_id)
+        if counter.update(count=Greatest(F("count") + delta, 0)) or delta < 0:
+            return
+        try:
+            with transaction.atomic():
+                self.create(sender_id=sender_id,
+                            receiver_id=receiver_id, count=delta)
+        except IntegrityError:
+            counter.update(count=F("count") + delta)
+
+    def rebuild(self, dry_run=False):
+        """Recount from the message table, returning drifted (sender_id, receiver_id, stored, actual) rows."""
+        with transaction.atomic():
+            unread = Message.objects.filter(is_read=False).order_by().values(
+                "sender_id", "receiver_id").annotate(count=Count("id"))
+            actual = {(row["sender_id"], row["receiver_id"]): row["count"]
+                      for row in unread}
+            stored = {(sender_id, receiver_id): (pk, count) for pk, sender_id, receiver_id, count
+                      in self.values_list("id", "sender_id", "receiver_id", "count")}
+
+            drift = []
+            for key in actual.keys() | stored.keys():
+                count = stored.get(key, (None, 0))[1]
+                if count != actual.get(key, 0):
+                    drift.append((*key, count, actual.get(key, 0)))
+
+            if drift and not dry_run:
+                self.filter(id__in=[stored[(sender_id, receiver_id)][0]
+                                    for sender_id, receiver_id, count, _ in drift
+                                    if (sender_id, receiver_id) in stored]).delete()
+                self.bulk_create([UnreadCounter(sender_id=sender_id, receiver_id=receiver_id, count=count)
+                                  for sender_id, receiver_id, _, count in drift if count],
+                                 batch_size=1000)
+            if not dry_run:
+                Conversation.objects.update(unread_count=Coalesce(Subquery(
+                    self.filter(sender_id=OuterRef("peer_id"), receiver_id=OuterRef("owner_id"))
+                    .values("count")[:1]), 0))
+        return sorted(drift)
+
+    def counts_for(self, receiver_id, sender_ids):
+        return dict(self.filter(receiver_id=receiver_id, sender_id__in=set(sender_ids), count__gt=0)
+                    .values_list("sender_id", "count"))
+
+
+class UnreadCounter(models.Model):
+    sender = models.ForeignKey(
+        "user_control.CustomUser", related_name="unread_counters_sent", on_delete=models.CASCADE)
+    receiver = models.ForeignKey(
+        "user_control.CustomUser", related_name="unread_counters", on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = UnreadCounterManager()
+
+    def __str__(self):
+        return f"{self.count} unread from {self.sender_id} to {self.receiver_id}"
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=("receiver", "sender"), name="unique_unread_counter"),
+        )
+
+
+class ConversationManager(models.Manager):
+
+    def record_message(self, message):
+        """Make message the latest activity on both participants' rows."""
+        participants = {(message.sender_id, message.receiver_id),
+                        (message.receiver_id, message.sender_id)}
+        for owner_id, peer_id in participants:
+            conversation = self.filter(owner_id=owner_id, peer_id=peer_id)
+            if conversation.update(last_message=message, last_activity=message.created_at):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(owner_id=owner_id, peer_id=peer_id,
+                                last_message=message, last_activity=message.created_at)
+            except IntegrityError:
+                conversation.update(last_message=message,
+                                    last_activity=message.created_at)
+
+    def refresh_last_message(self, conversation_key):
+        """Point both rows at the newest remaining message, or drop them when none is left."""
+        low, high = map(int, conversation_key.split(":"))
+        conversations = self.filter(
+            Q(owner_id=low, peer_id=high) | Q(owner_id=high, peer_id=low))
+        latest = Message.objects.filter(conversation_key=conversation_key).order_by(
+            "-created_at", "-id").first()
+        if latest is None:
+            conversations.delete()
+        else:
+            conversations.update(last_message=latest,
+                                 last_activity=latest.created_at)
+
+
+class Conversation(models.Model):
+    """One inbox row per participant, updated on every message write."""
+    owner = models.ForeignKey(
+        "user_control.CustomUser", related_name="conversations", on_delete=models.CASCADE)
+    peer = models.ForeignKey(
+        "user_control.CustomUser", related_name="+", on_delete=models.CASCADE)
+    last_message = models.ForeignKey(
+        Message, related_name="+", null=True, on_delete=models.SET_NULL)
+    last_activity = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
+
+    objects = ConversationManager()
+
+    def __str__(self):
+        return f"Conversation of {self.owner_id} with {self.peer_id}"
+
+    class Meta:
+        ordering = ("-last_activity",)
+        constraints = (
+            models.UniqueConstraint(
+                fields=("owner", "peer"), name="unique_conversation"),
+        )
+        indexes = (
+            models.Index(fields=("owner", "last_activity", "id"),
+                         name="conversation_inbox_idx"),
+        )
+
+
+class UploadSessionManager(models.Manager):
+
+    def purge_expired(self, max_age):
+        """Abort and delete unfinished sessions idle for more than max_age seconds."""
+        from django.core.files.storage import default_storage
+        from .uploads import get_chunk_writer
+
+        expired = self.filter(upload__isnull=True,
+                              updated_at__lt=timezone.now() - timedelta(seconds=max_age))
+        purged = 0
+        for session in expired.iterator():
+            get_chunk_writer(default_storage, session.name, session.state).abort()
+            session.delete()
+            purged += 1
+        return purged
+
+
+class UploadSession(models.Model):
+    """A resumable upload, chunks are appended at ``offset`` until ``size`` is reached."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(
+        "user_control.CustomUser", related_name="upload_sessions", on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    state = models.JSONField(default=dict)
+    upload = models.OneToOneField(
+        GenericFileUpload, related_name="+", null=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UploadSessionManager()
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+    class Meta:
+        ordering = ("created_at",)
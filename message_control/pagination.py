@@ -0,0 +1,113 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Newest-first pagination keyed on ``(ordering_field, id)``.
+
+    ``?before=<cursor>`` walks back in history and ``?after=<cursor>`` returns
+    the rows just newer than the cursor. Every page is a single range scan
+    with a LIMIT, there is no OFFSET and no ``COUNT(*)``.
+    """
+    ordering_field = "created_at"
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    before_query_param = "before"
+    after_query_param = "after"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        before = self.decode_cursor(
+            request.query_params.get(self.before_query_param))
+        after = self.decode_cursor(
+            request.query_params.get(self.after_query_param))
+        field = self.ordering_field
+
+        # The redundant __gte/__lte bound lets the index seek to the cursor
+        if after:
+            queryset = queryset.filter(
+                Q(**{f"{field}__gt": after[0]}) | Q(**{field: after[0], "id__gt": after[1]}),
+                **{f"{field}__gte": after[0]}
+            ).order_by(field, "id")
+        else:
+            if before:
+                queryset = queryset.filter(
+                    Q(**{f"{field}__lt": before[0]}) | Q(**{field: before[0], "id__lt": before[1]}),
+                    **{f"{field}__lte": before[0]})
+            queryset = queryset.order_by(f"-{field}", "-id")
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        if after:
+            rows.reverse()
+            self.has_older, self.has_newer = True, has_more
+        else:
+            self.has_older, self.has_newer = has_more, before is not None
+
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if not self.page or not self.has_older:
+            return None
+        return self.build_link(self.before_query_param, self.page[-1])
+
+    def get_previous_link(self):
+        if not self.page or not self.has_newer:
+            return None
+        return self.build_link(self.after_query_param, self.page[0])
+
+    def build_link(self, param, row):
+        url = self.request.build_absolute_uri()
+        for stale in (self.before_query_param, self.after_query_param, "page"):
+            url = remove_query_param(url, stale)
+        return replace_query_param(url, param, self.encode_cursor(row))
+
+    def encode_cursor(self, row):
+        value = getattr(row, self.ordering_field).isoformat()
+        return urlsafe_b64encode(f"{value}|{row.id}".encode()).decode()
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            value, pk = urlsafe_b64decode(
+                cursor.encode()).decode().rsplit("|", 1)
+            return datetime.fromisoformat(value), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class MessageHistoryPagination(KeysetPagination):
+    ordering_field = "created_at"
+
+
+class InboxPagination(KeysetPagination):
+    ordering_field = "last_activity"
@@ -1,12 +1,48 @@
+from django.core.exceptions import ObjectDoesNotExist
 from rest_framework import serializers
-from .models import GenericFileUpload, Message, MessageAttachment
+from socialchat.fastpath import SparseFieldsetMixin
+from socialchat.optimizer import optimize_queryset
+from user_control.snapshots import profile_snapshots
+from .models import Conversation, GenericFileUpload, Message, MessageAttachment, UploadSession
 
 
 class GenericFileUploadSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
 
     class Meta:
         model = GenericFileUpload
-        fields = '__all__'
+        fields = ("id", "file_upload", "variants", "created_at")
+
+    def get_variants(self, obj):
+        """URLs of the resized versions, empty until the variant pipeline has run."""
+        storage = obj.file_upload.storage
+        request = self.context.get("request")
+        variants = {}
+        for key, variant in obj.variants.items():
+            url = storage.url(variant["name"])
+            variants[key] = request.build_absolute_uri(url) if request is not None else url
+        return variants
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    upload_id = serializers.UUIDField(source="id", read_only=True)
+    size = serializers.IntegerField(min_value=1)
+    file = GenericFileUploadSerializer(source="upload", read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ("upload_id", "filename", "size", "offset", "file", "created_at")
+        read_only_fields = ("offset", "created_at")
+
+
+class PresignUploadSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=200)
+    size = serializers.IntegerField(min_value=1)
+    content_type = serializers.CharField(required=False)
+
+
+class CompleteUploadSerializer(serializers.Serializer):
+    upload_token = serializers.CharField()
 
 
 class MessageAttachmentSerializer(serializers.ModelSerializer):
@@ -17,22 +53,77 @@ class MessageAttachmentSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class SavedAttachmentsSerializer(serializers.ListSerializer):
+    """A message's attachments, taken from ``context["saved_attachments"]`` when the view just wrote them."""
+
+    def get_attribute(self, instance):
+        saved = self.context.get("saved_attachments", {})
+        if instance.id in saved:
+            return saved[instance.id]
+        return super().get_attribute(instance)
+
+
+def load_attachments(message_ids, context):
+    """Rendered attachments of ``message_ids`` keyed by message id, for the fast path."""
+    attachments = {message_id: [] for message_id in message_ids}
+    queryset = optimize_queryset(
+        MessageAttachment.objects.filter(message_id__in=message_ids), MessageAttachmentSerializer)
+    for attachment in MessageAttachmentSerializer(queryset, many=True, context=context).data:
+        attachments[attachment["message"]].append(attachment)
+    return attachments
+
+
+class MessageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     sender = serializers.SerializerMethodField("get_sender_data")
     sender_id = serializers.IntegerField(write_only=True)
     receiver = serializers.SerializerMethodField("get_receiver_data")
     receiver_id = serializers.IntegerField(write_only=True)
-    message_attachments = MessageAttachmentSerializer(
-        read_only=True, many=True)
+    message_attachments = SavedAttachmentsSerializer(
+        child=MessageAttachmentSerializer(), read_only=True)
 
     class Meta:
         model = Message
-        fields = "__all__"
+        # conversation_key is an index column, not part of the API
+        exclude = ("conversation_key",)
+        method_field_sources = {
+            "sender": ("sender.user_profile", "user_control.serializers.UserProfileSerializer"),
+            "receiver": ("receiver.user_profile", "user_control.serializers.UserProfileSerializer"),
+        }
+        fast_path_loaders = {
+            "sender": ("sender_id", profile_snapshots.render_many),
+            "receiver": ("receiver_id", profile_snapshots.render_many),
+            "message_attachments": ("id", load_attachments),
+        }
 
     def get_sender_data(self, obj):
-        from user_control.serializers import UserProfileSerializer
-        return UserProfileSerializer(obj.sender.user_profile).data
+        return profile_snapshots.render(obj.sender.user_profile, self.context)
 
     def get_receiver_data(self, obj):
-        from user_control.serializers import UserProfileSerializer
-        return UserProfileSerializer(obj.receiver.user_profile).data
+        return profile_snapshots.render(obj.receiver.user_profile, self.context)
+
+
+class LastMessageSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Message
+        fields = ("id", "sender", "receiver", "message", "is_read", "created_at")
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    peer = serializers.SerializerMethodField("get_peer_data")
+    last_message = LastMessageSerializer(read_only=True)
+
+    class Meta:
+        model = Conversation
+        fields = ("id", "peer", "last_message", "last_activity", "unread_count")
+        method_field_sources = {
+            "peer": ("peer.user_profile", "user_control.serializers.UserProfileSerializer"),
+        }
+
+    def get_peer_data(self, obj):
+        try:
+            profile = obj.peer.user_profile
+        except ObjectDoesNotExist:
+            return {"user": {"id": obj.peer_id}}
+        # The row carries the count, the snapshot is shared with the rest of the page
+        return profile_snapshots.render(profile, self.context, obj.unread_count)
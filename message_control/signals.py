@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import GenericFileUpload
+from .variants import variant_pipeline
+
+
+@receiver(post_save, sender=GenericFileUpload)
+def generate_variants(sender, instance, created, **kwargs):
+    if created and instance.file_upload:
+        upload_id, name = instance.id, instance.file_upload.name
+        transaction.on_commit(lambda: variant_pipeline.enqueue(upload_id, name))
@@ -1,10 +1,20 @@
 import json
+import os
+import threading
+from io import StringIO
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from rest_framework.test import APITestCase
 from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
 from six import BytesIO
 from PIL import Image
 
+from socialchat.testing import BufferedAsyncClient, UsersTestCase, create_user
+from .dispatch import NotificationDispatcher
+from .models import Conversation, GenericFileUpload, Message, MessageAttachment, UnreadCounter, UploadSession
+from django.core.management import call_command, CommandError
+
 # Create your tests here.
 
 
@@ -174,3 +184,1047 @@ class TestMessage(APITestCase):
         result = response.json()
 
         self.assertEqual(response.status_code, 200)
+
+    def test_get_message_query_count_is_constant(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        def fetch():
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(
+                    self.message_url+f"?user_id={self.receiver.id}", **self.bearer)
+            return len(context), response.json()["results"]
+
+        Message.objects.create(sender=self.receiver, receiver=self.sender, message="1")
+        UnreadCounter.objects.adjust(self.receiver.id, self.sender.id, 1)
+        fetch()
+        few, results = fetch()
+
+        for index in range(10):
+            Message.objects.create(
+                sender=self.sender, receiver=self.receiver, message=str(index))
+        many, results = fetch()
+
+        self.assertEqual(few, many)
+        self.assertEqual(len(results), 11)
+        self.assertEqual(results[-1]["sender"]["unseen"], 1)
+
+
+class TestAsyncMessageViews(UsersTestCase):
+    async_client_class = BufferedAsyncClient
+
+    async def test_message_history_matches_sync_view(self):
+        from unittest import mock
+        from asgiref.sync import sync_to_async
+        from user_control.presence import presence
+
+        upload = await sync_to_async(GenericFileUpload.objects.create)(file_upload="async.png")
+        payload = {"sender_id": self.sender.id, "receiver_id": self.receiver.id, "message": "async",
+                   "attachments": [{"attachment_id": upload.id, "caption": "one"}]}
+        with mock.patch("message_control.views.dispatcher") as dispatcher:
+            response = await self.async_client.post(
+                "/message/async/message", json.dumps(payload), content_type="application/json",
+                **self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["message"], "async")
+        self.assertEqual(response.json()["message_attachments"][0]["caption"], "one")
+        self.assertEqual(dispatcher.enqueue.call_args[0][0]["message"], "async")
+
+        # is_online moves with every request, the payloads are compared without it
+        with mock.patch.object(presence, "last_seen", return_value=None):
+            for path, params in (("message", {"user_id": self.receiver.id}), ("conversations", {})):
+                response = await self.async_client.get(f"/message/async/{path}", params, **self.headers)
+                expected = await sync_to_async(self.client.get)(f"/message/{path}", params, **self.bearer)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected.json())
+        self.assertEqual(response.json()["results"][0]["last_message"]["message"], "async")
+
+    async def test_message_create_reports_errors(self):
+        from asgiref.sync import sync_to_async
+
+        payload = {"sender_id": self.sender.id, "receiver_id": self.receiver.id, "message": "async",
+                   "attachments": [{"attachment_id": 999}]}
+        response = await self.async_client.post(
+            "/message/async/message", json.dumps(payload), content_type="application/json",
+            **self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("attachments", response.json())
+        self.assertFalse(await sync_to_async(Message.objects.exists)())
+
+    async def test_rejects_missing_token_and_wrong_method(self):
+        response = await self.async_client.get("/message/async/message")
+        self.assertEqual(response.status_code, 403)
+
+        response = await self.async_client.delete("/message/async/message", **self.headers)
+        self.assertEqual(response.status_code, 405)
+
+        response = await self.async_client.get("/message/async/file-upload", **self.headers)
+        self.assertEqual(response.status_code, 405)
+
+    async def test_file_upload_streams_large_files(self):
+        import tempfile
+        from asgiref.sync import sync_to_async
+        from django.test import override_settings
+
+        data = bytes(range(256)) * 64
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                DEFAULT_FILE_STORAGE="socialchat.storage_backends.LocalMediaStorage",
+                MEDIA_ROOT=media_root, UPLOAD_PART_SIZE=4096):
+            ids = []
+            for name in ("first.bin", "second.bin"):
+                response = await self.async_client.post("/message/async/file-upload", {
+                    "file_upload": SimpleUploadedFile(name, data)})
+                self.assertEqual(response.status_code, 201)
+                ids.append(response.json()["id"])
+
+            # The streamed copy of the duplicate is dropped
+            self.assertEqual(ids[0], ids[1])
+            upload = await sync_to_async(GenericFileUpload.objects.get)(id=ids[0])
+            with upload.file_upload.open() as stored:
+                self.assertEqual(stored.read(), data)
+            stored_files = [name for _, _, names in os.walk(media_root) for name in names]
+            self.assertEqual(stored_files, ["first.bin"])
+
+    async def test_file_upload_stores_off_the_orm_thread(self):
+        import tempfile
+        from asgiref.sync import sync_to_async
+        from django.test import override_settings
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                DEFAULT_FILE_STORAGE="socialchat.storage_backends.LocalMediaStorage",
+                MEDIA_ROOT=media_root):
+            response = await self.async_client.post("/message/async/file-upload", {
+                "file_upload": SimpleUploadedFile("async.txt", b"async")})
+
+            self.assertEqual(response.status_code, 201)
+            upload = await sync_to_async(GenericFileUpload.objects.get)(id=response.json()["id"])
+            with upload.file_upload.open() as stored:
+                self.assertEqual(stored.read(), b"async")
+
+
+class FakeS3Client:
+    """Records multipart uploads in memory, standing in for boto3's S3 client."""
+
+    def __init__(self):
+        self.uploads = {}
+        self.objects = {}
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentLength):
+        data = Body.read()
+        assert len(data) == ContentLength
+        self.uploads[UploadId][PartNumber] = data
+        return {"ETag": f'"etag-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(parts[part["PartNumber"]]
+                                     for part in MultipartUpload["Parts"])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+
+
+class TestChunkedUploads(UsersTestCase):
+    uploads_url = "/message/uploads"
+    file_upload_url = "/message/file-upload"
+
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        storage = override_settings(
+            DEFAULT_FILE_STORAGE="socialchat.storage_backends.LocalMediaStorage",
+            MEDIA_ROOT=media_root.name)
+        storage.enable()
+        self.addCleanup(storage.disable)
+
+    def put_chunk(self, upload_id, data, start, size):
+        return self.client.put(
+            f"{self.uploads_url}/{upload_id}", data, content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{start + len(data) - 1}/{size}", **self.bearer)
+
+    def test_resumable_upload(self):
+        content = b"0123456789" * 100
+        response = self.client.post(self.uploads_url, {
+            "filename": "notes.txt", "size": len(content)}, **self.bearer)
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.json()["upload_id"]
+
+        self.assertEqual(self.put_chunk(upload_id, content[:400], 0, 1000).json()["offset"], 400)
+
+        # A retried or skipped chunk is told where to resume
+        response = self.put_chunk(upload_id, content[:400], 0, 1000)
+        self.assertEqual((response.status_code, response.json()["offset"]), (409, 400))
+        response = self.client.get(f"{self.uploads_url}/{upload_id}", **self.bearer)
+        self.assertEqual(response.json()["offset"], 400)
+
+        response = self.put_chunk(upload_id, content[400:], 400, 1000)
+        self.assertEqual(response.status_code, 201)
+        upload = GenericFileUpload.objects.get(id=response.json()["file"]["id"])
+        with upload.file_upload.open() as stored:
+            self.assertEqual(stored.read(), content)
+
+    def test_abort_removes_staged_bytes(self):
+        import os
+
+        response = self.client.post(self.uploads_url, {
+            "filename": "notes.txt", "size": 10}, **self.bearer)
+        upload_id = response.json()["upload_id"]
+        self.put_chunk(upload_id, b"01234", 0, 10)
+        staging = UploadSession.objects.get(id=upload_id).state["staging"]
+        self.assertTrue(os.path.exists(staging))
+
+        response = self.client.delete(f"{self.uploads_url}/{upload_id}", **self.bearer)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(os.path.exists(staging))
+
+    def test_file_upload_streams_parts_to_storage(self):
+        from django.test import override_settings
+
+        content = bytes(range(256)) * 64
+        with override_settings(UPLOAD_PART_SIZE=4096):
+            response = self.client.post(self.file_upload_url, {
+                "file_upload": SimpleUploadedFile("big.bin", content)})
+            self.assertEqual(response.status_code, 201)
+
+        upload = GenericFileUpload.objects.get(id=response.json()["id"])
+        with upload.file_upload.open() as stored:
+            self.assertEqual(stored.read(), content)
+
+    def test_identical_uploads_share_one_stored_object(self):
+        import hashlib
+        import os
+        from django.conf import settings
+        from django.test import override_settings
+
+        content = bytes(range(256)) * 64
+        ids = set()
+        for name, part_size in (("a.bin", 1024 * 1024), ("b.bin", 1024 * 1024), ("c.bin", 4096)):
+            with override_settings(UPLOAD_PART_SIZE=part_size):
+                response = self.client.post(self.file_upload_url, {
+                    "file_upload": SimpleUploadedFile(name, content)}, **self.bearer)
+            self.assertEqual(response.status_code, 201)
+            self.assertNotIn("content_hash", response.json())
+            ids.add(response.json()["id"])
+
+        self.assertEqual(len(ids), 1)
+        upload = GenericFileUpload.objects.get()
+        self.assertEqual(upload.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(list(upload.owners.values_list("username", flat=True)), ["UserA"])
+        # The streamed copy of the last upload was dropped in favour of the first
+        stored = [name for _, _, files in os.walk(settings.MEDIA_ROOT) for name in files]
+        self.assertEqual(stored, ["a.bin"])
+
+        self.assertEqual(self.client.delete(f"{self.file_upload_url}/{upload.id}").status_code, 403)
+        self.assertEqual(
+            self.client.delete(f"{self.file_upload_url}/{upload.id}", **self.bearer).status_code, 204)
+        self.assertFalse(GenericFileUpload.objects.exists())
+        self.assertFalse(upload.file_upload.storage.exists(upload.file_upload.name))
+
+    def test_shared_upload_survives_repeated_deletes(self):
+        user_b, bearer_b = self.receiver, self.bearers["UserB"]
+        profile = user_b.user_profile
+
+        ids = {self.client.post(self.file_upload_url, {
+            "file_upload": SimpleUploadedFile(f"{index}.txt", b"shared")}, **bearer).json()["id"]
+            for index, bearer in enumerate((self.bearer, bearer_b))}
+        self.assertEqual(len(ids), 1)
+        upload = GenericFileUpload.objects.get()
+        profile.profile_picture = upload
+        profile.save()
+        message = Message.objects.create(sender=user_b, receiver=user_b, message="file")
+        MessageAttachment.objects.create(message=message, attachment=upload)
+
+        # The first delete drops UserA's ownership, repeating it finds nothing
+        self.assertEqual(self.client.delete(f"{self.file_upload_url}/{upload.id}", **self.bearer).status_code, 204)
+        self.assertEqual(self.client.delete(f"{self.file_upload_url}/{upload.id}", **self.bearer).status_code, 404)
+        self.assertEqual(list(upload.owners.all()), [user_b])
+
+        # Without owners the upload is still kept while it is in use
+        self.assertEqual(self.client.delete(f"{self.file_upload_url}/{upload.id}", **bearer_b).status_code, 204)
+        self.assertTrue(GenericFileUpload.objects.filter(id=upload.id).exists())
+        self.assertTrue(upload.file_upload.storage.exists(upload.file_upload.name))
+        self.assertEqual(MessageAttachment.objects.get().attachment_id, upload.id)
+        profile.refresh_from_db()
+        self.assertEqual(profile.profile_picture_id, upload.id)
+
+    def test_uploads_cannot_be_replaced(self):
+        response = self.client.post(self.file_upload_url, {
+            "file_upload": SimpleUploadedFile("a.txt", b"original")}, **self.bearer)
+        url = f"{self.file_upload_url}/{response.json()['id']}"
+        replacement = {"file_upload": SimpleUploadedFile("b.txt", b"replaced")}
+        for method in (self.client.put, self.client.patch):
+            self.assertEqual(method(url, replacement, format="multipart", **self.bearer).status_code, 405)
+            self.assertEqual(method(url, replacement, format="multipart").status_code, 405)
+
+        upload = GenericFileUpload.objects.get()
+        with upload.file_upload.open() as stored:
+            self.assertEqual(stored.read(), b"original")
+
+    def test_store_recovers_from_concurrent_duplicate(self):
+        from django.core.files.base import ContentFile
+
+        first = GenericFileUpload.objects.store(ContentFile(b"same bytes", name="one.txt"))
+        storage = first.file_upload.storage
+        name = storage.save("two.txt", ContentFile(b"same bytes"))
+        # Simulate losing the race: the lookup misses, the insert conflicts
+        acquire = GenericFileUpload.objects.acquire
+        calls = []
+
+        def racing_acquire(content_hash, owner=None):
+            calls.append(content_hash)
+            return None if len(calls) == 1 else acquire(content_hash, owner)
+
+        GenericFileUpload.objects.acquire = racing_acquire
+        try:
+            second = GenericFileUpload.objects.store(name, first.content_hash)
+        finally:
+            del GenericFileUpload.objects.acquire
+        self.assertEqual(second.id, first.id)
+        self.assertFalse(storage.exists(name))
+
+    def test_image_variants(self):
+        from .variants import VariantPipeline
+
+        photo = create_image(None, "photo.jpg", (800, 400), image_format="JPEG")
+        response = self.client.post(self.file_upload_url, {
+            "file_upload": SimpleUploadedFile("photo.jpg", photo.getvalue())}, **self.bearer)
+        upload_id = response.json()["id"]
+        self.assertEqual(response.json()["variants"], {})
+
+        pipeline = VariantPipeline(sizes={"thumb": 160, "medium": 720}, processes=0, webp=False)
+        variants = pipeline.process(upload_id)
+        self.assertEqual({key: (variant["width"], variant["height"]) for key, variant in variants.items()},
+                         {"thumb": (160, 80), "medium": (720, 360)})
+        self.assertEqual(pipeline.stats()["processed"], 1)
+
+        response = self.client.get(f"{self.file_upload_url}/{upload_id}")
+        self.assertEqual(sorted(response.json()["variants"]), ["medium", "thumb"])
+        self.assertTrue(response.json()["variants"]["thumb"].startswith("http://testserver/"))
+        self.assertTrue(response.json()["variants"]["thumb"].endswith(".thumb.jpg"))
+
+        # Variants go with the last reference to the original
+        storage = GenericFileUpload.objects.get().file_upload.storage
+        self.client.delete(f"{self.file_upload_url}/{upload_id}", **self.bearer)
+        self.assertFalse(any(storage.exists(variant["name"]) for variant in variants.values()))
+
+    def test_image_variants_keep_transparency(self):
+        from .variants import render_variants
+
+        rendered = render_variants(
+            create_image(None, "icon.png", (64, 64), "RGBA").getvalue(), {"thumb": 160}, False, 80)
+        self.assertEqual(rendered["thumb"][1:], ("png", 64, 64))
+
+    def test_variant_pipeline_renders_in_process_pool(self):
+        from django.test import override_settings
+        from .variants import VariantPipeline
+
+        photo = create_image(None, "photo.jpg", (800, 400), image_format="JPEG")
+        upload = GenericFileUpload.objects.store(SimpleUploadedFile("photo.jpg", photo.getvalue()))
+        pipeline = VariantPipeline(sizes={"thumb": 160}, workers=1, processes=1, webp=False)
+        with override_settings(BACKGROUND_TASKS=True):
+            pipeline.start()
+        self.addCleanup(pipeline.stop)
+        # Worker processes start fresh instead of forking the threaded server
+        self.assertEqual(pipeline.pool._mp_context.get_start_method(), "spawn")
+        pipeline.process(upload.id)
+
+        stats = pipeline.stats()
+        self.assertEqual((stats["processed"], stats["depth"]), (1, 0))
+        self.assertGreater(stats["processing_avg"], 0)
+        upload.refresh_from_db()
+        self.assertEqual(upload.variants["thumb"]["width"], 160)
+
+    def test_variant_pipeline_queues_images_only(self):
+        from django.test import override_settings
+        from .variants import VariantPipeline
+
+        pipeline = VariantPipeline(workers=1, processes=0)
+        processed = []
+        pipeline.process = processed.append
+        # Nothing is queued while background tasks are off
+        self.assertFalse(pipeline.enqueue(1, "photo.jpg"))
+        with override_settings(BACKGROUND_TASKS=True):
+            self.assertFalse(pipeline.enqueue(2, "notes.txt"))
+            self.assertTrue(pipeline.enqueue(3, "photo.jpg"))
+            pipeline.stop()
+        self.assertEqual(processed, [3])
+        self.assertEqual(pipeline.stats()["enqueued"], 1)
+
+    def test_variant_pipeline_stop_is_bounded(self):
+        import threading
+        from django.test import override_settings
+        from .variants import VariantPipeline
+
+        pipeline = VariantPipeline(workers=1, processes=0)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        pipeline.process = lambda upload_id: release.wait(5)
+        with override_settings(BACKGROUND_TASKS=True):
+            self.assertTrue(pipeline.enqueue(1, "photo.jpg"))
+            started = time.monotonic()
+            pipeline.stop(timeout=0.2)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_s3_writer_uploads_one_part_per_chunk(self):
+        from io import BytesIO
+        from storages.backends.s3boto3 import S3Boto3Storage
+        from .uploads import S3MultipartChunkWriter
+
+        storage = S3Boto3Storage(bucket_name="bucket", location="media")
+        storage.exists = lambda name: False
+        client = FakeS3Client()
+        writer = S3MultipartChunkWriter(storage, "photo.png", client=client)
+        state = writer.begin()
+        self.assertEqual(state["key"], "media/photo.png")
+
+        writer = S3MultipartChunkWriter(storage, "photo.png", state, client=client)
+        writer.write(0, BytesIO(b"a" * 10), 10)
+        writer.write(10, BytesIO(b"b" * 5), 5)
+        self.assertEqual(writer.complete(), "photo.png")
+        self.assertEqual(client.objects["media/photo.png"], b"a" * 10 + b"b" * 5)
+        self.assertEqual(writer.min_chunk_size, 5 * 1024 * 1024)
+
+    def test_presigned_direct_upload(self):
+        content = b"direct upload " * 50
+        response = self.client.post(f"{self.uploads_url}/presign", {
+            "filename": "../notes.txt", "size": len(content)}, **self.bearer)
+        self.assertEqual(response.status_code, 201)
+        target = response.json()
+        self.assertEqual(target["method"], "PUT")
+
+        # Completing before the bytes arrived is refused
+        response = self.client.post(f"{self.uploads_url}/complete", {
+            "upload_token": target["upload_token"]}, **self.bearer)
+        self.assertEqual(response.status_code, 409)
+
+        # The signed URL is the only credential the upload needs
+        response = self.client.put(target["url"], content, content_type="text/plain")
+        self.assertEqual(response.status_code, 204)
+        response = self.client.put(target["url"] + "x", content, content_type="text/plain")
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.post(f"{self.uploads_url}/complete", {
+            "upload_token": target["upload_token"]}, **self.bearer)
+        self.assertEqual(response.status_code, 201)
+        upload = GenericFileUpload.objects.get(id=response.json()["id"])
+        self.assertTrue(upload.file_upload.name.endswith("/notes.txt"))
+        with upload.file_upload.open() as stored:
+            self.assertEqual(stored.read(), content)
+
+    def test_presign_rejects_oversized_files(self):
+        from django.test import override_settings
+
+        with override_settings(PRESIGNED_UPLOAD_MAX_SIZE=10):
+            response = self.client.post(f"{self.uploads_url}/presign", {
+                "filename": "big.bin", "size": 11}, **self.bearer)
+        self.assertEqual(response.status_code, 400)
+
+    def test_s3_presigned_post(self):
+        from storages.backends.s3boto3 import S3Boto3Storage
+        from socialchat.storage_backends import MediaStorage
+
+        storage = MediaStorage(bucket_name="bucket", access_key="key", secret_key="secret",
+                               region_name="us-east-1")
+        self.assertIsInstance(storage, S3Boto3Storage)
+        target = storage.presigned_upload("abc/photo.png", "image/png", 100, 60)
+        self.assertEqual(target["method"], "POST")
+        self.assertEqual(target["fields"]["key"], "media/abc/photo.png")
+        self.assertEqual(target["fields"]["Content-Type"], "image/png")
+        self.assertIn("policy", target["fields"])
+
+
+class StubSocketServer(HTTPServer):
+    """Local stand-in for SOCKET_SERVER that records every POST body."""
+
+    def __init__(self, fail_first=0):
+        self.received = []
+        self.fail_first = fail_first
+        super().__init__(("127.0.0.1", 0), StubSocketHandler)
+        self.url = "http://127.0.0.1:%s/" % self.server_port
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubSocketHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.server.fail_first:
+            self.server.fail_first -= 1
+            self.send_response(503)
+        else:
+            self.server.received.append(json.loads(body))
+            self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestNotificationDispatch(APITestCase):
+
+    def start_dispatcher(self, server, **kwargs):
+        dispatcher = NotificationDispatcher(url=server.url, **kwargs)
+        self.addCleanup(dispatcher.stop)
+        return dispatcher
+
+    def test_posts_one_object_per_notification(self):
+        server = StubSocketServer()
+        self.addCleanup(server.stop)
+        dispatcher = self.start_dispatcher(server, workers=1, batch_size=10, batch_wait=0.2)
+
+        for index in range(3):
+            dispatcher.enqueue({"message": index, "to": 1})
+        dispatcher.stop()
+
+        self.assertEqual(sorted(item["message"] for item in server.received), [0, 1, 2])
+        self.assertEqual(dispatcher.stats()["sent"], 3)
+
+    def test_batches_notifications(self):
+        server = StubSocketServer()
+        self.addCleanup(server.stop)
+        dispatcher = self.start_dispatcher(
+            server, workers=1, batch_size=10, batch_wait=0.2, batched=True)
+
+        for index in range(5):
+            dispatcher.enqueue({"message": index, "to": 1})
+        dispatcher.stop()
+
+        delivered = [item["message"]
+                     for batch in server.received for item in batch]
+        self.assertEqual(sorted(delivered), [0, 1, 2, 3, 4])
+        self.assertLess(len(server.received), 5)
+
+        stats = dispatcher.stats()
+        self.assertEqual(stats["sent"], 5)
+        self.assertEqual(stats["depth"], 0)
+        self.assertEqual(stats["dropped"], 0)
+
+    def test_retries_with_backoff(self):
+        server = StubSocketServer(fail_first=2)
+        self.addCleanup(server.stop)
+        dispatcher = self.start_dispatcher(
+            server, workers=1, batch_wait=0, backoff=0.01)
+
+        dispatcher.enqueue({"message": "retry", "to": 1})
+        dispatcher.stop()
+
+        self.assertEqual(server.received, [{"message": "retry", "to": 1}])
+        self.assertEqual(dispatcher.stats()["retries"], 2)
+
+    def test_drops_when_queue_is_full(self):
+        server = StubSocketServer()
+        self.addCleanup(server.stop)
+        dispatcher = self.start_dispatcher(server, max_queue=1)
+        dispatcher.start = lambda: None
+
+        self.assertTrue(dispatcher.enqueue({"message": 1}))
+        self.assertFalse(dispatcher.enqueue({"message": 2}))
+        self.assertEqual(dispatcher.stats()["dropped"], 1)
+        self.assertEqual(dispatcher.stats()["depth"], 1)
+
+    def test_stop_gives_up_on_unreachable_server(self):
+        server = StubSocketServer(fail_first=100)
+        self.addCleanup(server.stop)
+        dispatcher = self.start_dispatcher(server, workers=1, batch_wait=0, backoff=5)
+
+        dispatcher.enqueue({"message": "lost", "to": 1})
+        started = time.monotonic()
+        dispatcher.stop(timeout=0.5)
+
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(server.received, [])
+
+    def test_message_create_enqueues_after_commit(self):
+        from . import views
+
+        server = StubSocketServer()
+        self.addCleanup(server.stop)
+        dispatcher = self.start_dispatcher(server, batch_wait=0)
+        original, views.dispatcher = views.dispatcher, dispatcher
+        self.addCleanup(setattr, views, "dispatcher", original)
+
+        sender, access = create_user(self.client, "UserA")
+        receiver, _ = create_user(self.client, "UserB")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/message/message", data={
+                "sender_id": sender.id, "receiver_id": receiver.id, "message": "queued"},
+                HTTP_AUTHORIZATION=f"Bearer {access}")
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(dispatcher.stats()["enqueued"], 0)
+
+        deadline = time.monotonic() + 5
+        while not server.received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(server.received[0]["message"], "queued")
+        self.assertEqual(server.received[0]["to"], receiver.id)
+
+
+class TestUnreadCounter(UsersTestCase):
+    message_url = "/message/message"
+
+    def post_message(self, text):
+        response = self.client.post(self.message_url, data={
+            "sender_id": self.sender.id, "receiver_id": self.receiver.id, "message": text}, **self.bearer)
+        return response.json()["id"]
+
+    def unread(self):
+        return UnreadCounter.objects.counts_for(self.receiver.id, [self.sender.id]).get(self.sender.id, 0)
+
+    def test_counter_follows_create_read_and_delete(self):
+        first = self.post_message("first")
+        second = self.post_message("second")
+        self.assertEqual(self.unread(), 2)
+
+        self.client.patch(f"{self.message_url}/{first}",
+                          data={"is_read": True}, **self.bearer)
+        self.assertEqual(self.unread(), 1)
+
+        # Re-reading an already read message changes nothing
+        self.client.patch(f"{self.message_url}/{first}",
+                          data={"is_read": True}, **self.bearer)
+        self.assertEqual(self.unread(), 1)
+
+        self.client.delete(f"{self.message_url}/{second}", **self.bearer)
+        self.assertEqual(self.unread(), 0)
+
+        self.client.delete(f"{self.message_url}/{first}", **self.bearer)
+        self.assertEqual(self.unread(), 0)
+
+    def test_rebuild_command_fixes_drift(self):
+        self.post_message("first")
+        Message.objects.create(
+            sender=self.sender, receiver=self.receiver, message="untracked")
+        UnreadCounter.objects.create(
+            sender=self.receiver, receiver=self.sender, count=3)
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_unread_counters", "--check", stdout=StringIO())
+
+        self.assertEqual(UnreadCounter.objects.rebuild(), [
+            (self.sender.id, self.receiver.id, 1, 2),
+            (self.receiver.id, self.sender.id, 3, 0),
+        ])
+        self.assertEqual(self.unread(), 2)
+        self.assertEqual(UnreadCounter.objects.rebuild(dry_run=True), [])
+
+
+class TestConversationPagination(UsersTestCase):
+    message_url = "/message/message"
+
+    def setUp(self):
+        super().setUp()
+        self.messages = [Message.objects.create(
+            sender=self.sender, receiver=self.receiver, message=str(index)) for index in range(25)]
+        # Rows sharing a timestamp are ordered by id
+        Message.objects.filter(id__in=[m.id for m in self.messages[3:8]]).update(
+            created_at=self.messages[3].created_at)
+
+    def get(self, url):
+        response = self.client.get(url, **self.bearer)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_before_and_after_cursors(self):
+        first = self.get(self.message_url + f"?user_id={self.receiver.id}")
+        self.assertNotIn("count", first)
+        self.assertIsNone(first["previous"])
+        self.assertEqual([m["message"] for m in first["results"]],
+                         [str(index) for index in range(24, 4, -1)])
+
+        older = self.get(first["next"])
+        self.assertEqual([m["message"] for m in older["results"]],
+                         ["4", "3", "2", "1", "0"])
+        self.assertIsNone(older["next"])
+
+        newer = self.get(older["previous"])
+        self.assertEqual([m["id"] for m in newer["results"]],
+                         [m["id"] for m in first["results"]])
+
+    def test_page_param_keeps_page_number_pagination(self):
+        result = self.get(
+            self.message_url + f"?user_id={self.receiver.id}&page=2")
+        self.assertEqual(result["count"], 25)
+        self.assertEqual(len(result["results"]), 5)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            self.message_url + f"?user_id={self.receiver.id}&before=bogus", **self.bearer)
+        self.assertEqual(response.status_code, 404)
+
+
+class TestMessageIndexes(UsersTestCase):
+    profiles = False
+
+    def test_conversation_key_is_direction_independent(self):
+        sent = Message.objects.create(
+            sender=self.sender, receiver=self.receiver, message="hi")
+        received = Message.objects.create(
+            sender=self.receiver, receiver=self.sender, message="hello")
+
+        self.assertEqual(sent.conversation_key, received.conversation_key)
+        self.assertEqual(sent.conversation_key,
+                         f"{self.sender.id}:{self.receiver.id}")
+
+    def test_conversation_page_uses_index(self):
+        from django.db import connection
+
+        if connection.vendor != "sqlite":
+            self.skipTest("Query plan assertions target SQLite")
+
+        key = Message.make_conversation_key(self.sender.id, self.receiver.id)
+        plan = Message.objects.filter(conversation_key=key).order_by(
+            "-created_at", "-id")[:21].explain()
+
+        self.assertIn("message_conversation_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+        # Deep pages seek straight to the cursor
+        from django.db.models import Q
+        from django.utils import timezone
+        cursor = timezone.now()
+        plan = Message.objects.filter(
+            Q(created_at__lt=cursor) | Q(created_at=cursor, id__lt=10),
+            conversation_key=key, created_at__lte=cursor
+        ).order_by("-created_at", "-id")[:21].explain()
+
+        self.assertIn("message_conversation_idx (conversation_key=? AND created_at<?)", plan)
+
+    def test_unread_lookup_uses_partial_index(self):
+        from django.db import connection
+
+        if connection.vendor != "sqlite":
+            self.skipTest("Query plan assertions target SQLite")
+
+        plan = Message.objects.filter(
+            receiver_id=self.sender.id, sender_id=self.receiver.id, is_read=False).explain()
+
+        self.assertIn("message_unread_idx", plan)
+
+
+class TestProfileSnapshots(UsersTestCase):
+    message_url = "/message/message"
+
+    def setUp(self):
+        from user_control.snapshots import profile_snapshots
+
+        profile_snapshots.clear()
+        self.addCleanup(profile_snapshots.clear)
+        super().setUp()
+        for index in range(6):
+            sender, receiver = ("UserA", "UserB") if index % 2 else ("UserB", "UserA")
+            Message.objects.create(sender=self.users[sender], receiver=self.users[receiver],
+                                   message=str(index))
+            UnreadCounter.objects.adjust(self.users[sender].id, self.users[receiver].id, 1)
+
+    def history(self):
+        from unittest import mock
+        from user_control.snapshots import ProfileSnapshotCache
+
+        serialize = ProfileSnapshotCache.serialize
+        with mock.patch.object(ProfileSnapshotCache, "serialize", side_effect=serialize) as spy:
+            response = self.client.get(
+                f"{self.message_url}?user_id={self.users['UserB'].id}", **self.bearers["UserA"])
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"], spy.call_count
+
+    def test_each_participant_is_serialized_once(self):
+        from user_control.serializers import UserProfileSerializer
+
+        results, serialized = self.history()
+        self.assertEqual((len(results), serialized), (6, 2))
+        # Later pages and requests reuse the snapshots
+        self.assertEqual(self.history()[1], 0)
+
+        request = self.client.get("/").wsgi_request
+        request.user = self.users["UserA"]
+        expected = UserProfileSerializer(self.users["UserB"].user_profile, context={"request": request}).data
+        sent_by_b = next(item for item in results if item["sender"]["id"] == expected["id"])
+        self.assertEqual(list(sent_by_b["sender"]), list(expected))
+        self.assertEqual(sent_by_b["sender"], json.loads(json.dumps(expected)))
+        self.assertEqual(sent_by_b["sender"]["unseen"], 3)
+
+    def test_profile_changes_invalidate_snapshots(self):
+        self.history()
+        profile = self.users["UserB"].user_profile
+        profile.first_name = "Renamed"
+        profile.save()
+
+        results, serialized = self.history()
+        self.assertEqual(serialized, 1)
+        self.assertEqual({item["receiver"]["first_name"] for item in results
+                          if item["receiver"]["id"] == profile.id}, {"Renamed"})
+
+    def test_group_changes_invalidate_snapshots(self):
+        from django.contrib.auth.models import Group
+
+        self.history()
+        group = Group.objects.create(name="moderators")
+        self.users["UserB"].groups.add(group)
+
+        results, serialized = self.history()
+        self.assertEqual(serialized, 1)
+        receiver = next(item["receiver"] for item in results
+                        if item["receiver"]["user"]["id"] == self.users["UserB"].id)
+        self.assertEqual(receiver["user"]["groups"], [group.id])
+
+        # From the group side too
+        group.user_set.clear()
+        results, serialized = self.history()
+        self.assertEqual(serialized, 1)
+        receiver = next(item["receiver"] for item in results
+                        if item["receiver"]["user"]["id"] == self.users["UserB"].id)
+        self.assertEqual(receiver["user"]["groups"], [])
+
+
+class TestFastPath(UsersTestCase):
+    message_url = "/message/message"
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        from django.test import override_settings
+        from user_control.presence import presence
+        from user_control.snapshots import profile_snapshots
+
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        storage = override_settings(
+            DEFAULT_FILE_STORAGE="socialchat.storage_backends.LocalMediaStorage",
+            MEDIA_ROOT=media_root.name)
+        storage.enable()
+        self.addCleanup(storage.disable)
+        profile_snapshots.clear()
+        self.addCleanup(profile_snapshots.clear)
+        # Every request marks the viewer online, keep is_online still between them
+        last_seen = mock.patch.object(presence, "last_seen", return_value=None)
+        last_seen.start()
+        self.addCleanup(last_seen.stop)
+        super().setUp()
+
+        upload = GenericFileUpload.objects.create(
+            file_upload=SimpleUploadedFile("note.txt", b"note"))
+        for index in range(5):
+            sender, receiver = ("UserA", "UserB") if index % 2 else ("UserB", "UserA")
+            message = Message.objects.create(
+                sender=self.users[sender], receiver=self.users[receiver],
+                message=f"message {index} \u00e9\u2028", is_read=index < 2)
+            UnreadCounter.objects.adjust(self.users[sender].id, self.users[receiver].id, 1)
+            if index == 1:
+                MessageAttachment.objects.create(message=message, attachment=upload, caption="note")
+
+    def fetch(self, query, fast=True):
+        from django.db import connection
+        from django.test import override_settings
+        from django.test.utils import CaptureQueriesContext
+
+        with override_settings(FAST_PATH_READS=fast), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"{self.message_url}?{query}", **self.bearers["UserA"])
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.content, len(queries)
+
+    def test_fast_path_output_matches_serializers(self):
+        user_id = self.users["UserB"].id
+        for query in (f"user_id={user_id}&fields=receiver,message_attachments",
+                      f"user_id={user_id}&fields=id,message,created_at",
+                      f"user_id={user_id}&page_size=2", f"user_id={user_id}&page=1", "page=1",
+                      f"user_id={user_id}"):
+            slow, slow_queries = self.fetch(query, fast=False)
+            fast, fast_queries = self.fetch(query)
+            self.assertEqual(fast, slow, query)
+            self.assertLessEqual(fast_queries, slow_queries, query)
+
+        data = json.loads(fast)["results"]
+        self.assertEqual([item["message_attachments"][0]["caption"] for item in data
+                          if item["message_attachments"]], ["note"])
+        self.assertEqual(data[0]["sender"]["unseen"], 3)
+        self.assertNotIn("conversation_key", data[0])
+        self.assertIn("\u00e9\\u2028".encode(), fast)
+
+    def test_sparse_fieldsets(self):
+        content, queries = self.fetch(f"user_id={self.users['UserB'].id}&fields=message,id")
+        results = json.loads(content)["results"]
+        self.assertEqual(list(results[0]), ["id", "message"])
+        self.assertEqual(len(results), 5)
+        # The page alone, no profiles, attachments or unread counts
+        self.assertEqual(queries, 2)
+
+        response = self.client.get(f"{self.message_url}?fields=id,secret,sender_id",
+                                   **self.bearers["UserA"])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["fields"], "Unknown fields: secret, sender_id")
+
+
+class TestConversationList(UsersTestCase):
+    message_url = "/message/message"
+    conversations_url = "/message/conversations"
+    usernames = ("UserA", "UserB", "UserC")
+
+    def send(self, sender, receiver, text):
+        response = self.client.post(self.message_url, data={
+            "sender_id": self.users[sender].id, "receiver_id": self.users[receiver].id,
+            "message": text}, **self.bearers[sender])
+        return response.json()["id"]
+
+    def inbox(self, name, url=None):
+        response = self.client.get(
+            url or self.conversations_url, **self.bearers[name])
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_inbox_is_ordered_by_activity_with_unread_counts(self):
+        self.send("UserB", "UserA", "hi from B")
+        self.send("UserB", "UserA", "again from B")
+        self.send("UserC", "UserA", "hi from C")
+        self.send("UserA", "UserB", "reply to B")
+
+        results = self.inbox("UserA")["results"]
+        self.assertEqual([item["peer"]["user"]["username"] for item in results],
+                         ["UserB", "UserC"])
+        self.assertEqual(results[0]["last_message"]["message"], "reply to B")
+        self.assertEqual([item["unread_count"] for item in results], [2, 1])
+        self.assertEqual(results[0]["peer"]["unseen"], 2)
+
+        # The other participant has their own row and count
+        results = self.inbox("UserB")["results"]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["unread_count"], 1)
+
+    def test_read_and_delete_update_snapshot(self):
+        first = self.send("UserB", "UserA", "first")
+        last = self.send("UserB", "UserA", "last")
+
+        self.client.patch(f"{self.message_url}/{first}",
+                          data={"is_read": True}, **self.bearers["UserB"])
+        self.assertEqual(self.inbox("UserA")["results"][0]["unread_count"], 1)
+
+        self.client.delete(f"{self.message_url}/{last}", **self.bearers["UserB"])
+        result = self.inbox("UserA")["results"][0]
+        self.assertEqual(result["last_message"]["id"], first)
+        self.assertEqual(result["unread_count"], 0)
+
+        self.client.delete(f"{self.message_url}/{first}", **self.bearers["UserB"])
+        self.assertEqual(self.inbox("UserA")["results"], [])
+        self.assertFalse(Conversation.objects.exists())
+
+    def test_keyset_pagination(self):
+        from user_control.models import CustomUser
+
+        for index in range(25):
+            peer = CustomUser.objects.create_user(
+                username=f"peer{index}", password="password", email=f"peer{index}@gmail.com")
+            message = Message.objects.create(
+                sender=peer, receiver=self.users["UserA"], message=str(index))
+            Conversation.objects.record_message(message)
+
+        first = self.inbox("UserA")
+        self.assertNotIn("count", first)
+        self.assertEqual(len(first["results"]), 20)
+        self.assertEqual(first["results"][0]["last_message"]["message"], "24")
+
+        second = self.inbox("UserA", first["next"])
+        self.assertEqual([item["last_message"]["message"] for item in second["results"]],
+                         ["4", "3", "2", "1", "0"])
+        self.assertEqual(second["results"][0]["peer"], {
+                         "user": {"id": second["results"][0]["last_message"]["sender"]}})
+
+
+class TestMessageAttachments(UsersTestCase):
+    message_url = "/message/message"
+
+    def setUp(self):
+        super().setUp()
+        self.files = [GenericFileUpload.objects.create(
+            file_upload=f"file{index}.png") for index in range(5)]
+
+    def post(self, attachments):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        payload = {
+            "sender_id": self.sender.id,
+            "receiver_id": self.receiver.id,
+            "message": "with files",
+            "attachments": attachments,
+        }
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.message_url, data=json.dumps(
+                payload), content_type="application/json", **self.bearer)
+        return response, len(context)
+
+    def attachments(self, count):
+        return [{"attachment_id": item.id, "caption": f"caption {index}"}
+                for index, item in enumerate(self.files[:count])]
+
+    def test_create_query_count_does_not_grow_with_attachments(self):
+        self.post(self.attachments(1))
+
+        response, one = self.post(self.attachments(1))
+        self.assertEqual(response.status_code, 201)
+
+        response, five = self.post(self.attachments(5))
+        result = response.json()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(one, five)
+        self.assertLessEqual(five, 12)
+        self.assertEqual([item["attachment"]["id"] for item in result["message_attachments"]],
+                         [item.id for item in self.files])
+        self.assertEqual(result["message_attachments"]
+                         [4]["caption"], "caption 4")
+
+    def test_create_renders_from_memory(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        for attachments in ([], self.attachments(2)):
+            with CaptureQueriesContext(connection) as context:
+                response, _ = self.post(attachments)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.json()["message_attachments"]), len(attachments))
+            # The saved message and its attachments are never read back
+            self.assertEqual([query["sql"] for query in context.captured_queries
+                              if 'FROM "message_control_message' in query["sql"]], [])
+
+    def test_unknown_attachment_rolls_back(self):
+        response, _ = self.post(
+            [{"attachment_id": self.files[0].id}, {"attachment_id": 999}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+    def test_update_diffs_attachments(self):
+        response, _ = self.post(self.attachments(3))
+        message_id = response.json()["id"]
+        kept = list(MessageAttachment.objects.filter(
+            message_id=message_id).values_list("id", flat=True))
+
+        # Plain updates leave attachments alone
+        response = self.client.patch(f"{self.message_url}/{message_id}", data=json.dumps(
+            {"is_read": True}), content_type="application/json", **self.bearer)
+        self.assertEqual(len(response.json()["message_attachments"]), 3)
+
+        attachments = self.attachments(3)[1:] + [{"attachment_id": self.files[4].id}]
+        response = self.client.patch(f"{self.message_url}/{message_id}", data=json.dumps(
+            {"attachments": attachments}), content_type="application/json", **self.bearer)
+        result = response.json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["attachment"]["id"] for item in result["message_attachments"]],
+                         [self.files[1].id, self.files[2].id, self.files[4].id])
+        self.assertEqual([item["id"] for item in result["message_attachments"][:2]], kept[1:])
+        self.assertEqual(MessageAttachment.objects.filter(
+            message_id=message_id).count(), 3)
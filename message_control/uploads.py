@@ -0,0 +1,226 @@
+import hashlib
+import mimetypes
+import os
+import uuid
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+def spool():
+    """Buffer that stays in memory up to UPLOAD_SPOOL_SIZE and spills to disk beyond."""
+    return SpooledTemporaryFile(max_size=settings.UPLOAD_SPOOL_SIZE)
+
+
+def copy_stream(source, target, length):
+    """Copy exactly ``length`` bytes in small blocks, return the number copied."""
+    copied = 0
+    while copied < length:
+        block = source.read(min(COPY_BUFFER_SIZE, length - copied))
+        if not block:
+            break
+        target.write(block)
+        copied += len(block)
+    return copied
+
+
+class FileSystemChunkWriter:
+    """Assembles chunks at their offsets in a staging file next to the storage root.
+
+    Chunks are written with seek + write, so a retried chunk overwrites its
+    own bytes. On completion the staging file is renamed into place on a
+    FileSystemStorage and streamed through ``storage.save`` otherwise.
+    """
+    min_chunk_size = 1
+
+    def __init__(self, storage, name, state=None):
+        self.storage = storage
+        self.name = name
+        self.state = state or {}
+
+    def begin(self):
+        if isinstance(self.storage, FileSystemStorage):
+            directory = self.storage.path(".uploads")
+        else:
+            directory = settings.UPLOAD_STAGING_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.state = {"staging": os.path.join(directory, uuid.uuid4().hex)}
+        open(self.state["staging"], "wb").close()
+        return self.state
+
+    def write(self, offset, stream, length):
+        with open(self.state["staging"], "r+b") as staging:
+            staging.seek(offset)
+            return copy_stream(stream, staging, length)
+
+    def complete(self):
+        staging = self.state["staging"]
+        if isinstance(self.storage, FileSystemStorage):
+            name = self.storage.get_available_name(self.name)
+            path = self.storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(staging, path)
+            return name
+
+        with open(staging, "rb") as content:
+            name = self.storage.save(self.name, File(content))
+        os.remove(staging)
+        return name
+
+    def abort(self):
+        staging = self.state.get("staging")
+        if staging and os.path.exists(staging):
+            os.remove(staging)
+
+
+class S3MultipartChunkWriter:
+    """Uploads every chunk as one part of an S3 multipart upload.
+
+    A chunk is spooled (memory up to UPLOAD_SPOOL_SIZE, disk beyond) so the
+    part upload can be retried, nothing else is buffered. S3 requires every
+    part but the last to be at least 5 MiB.
+    """
+    min_chunk_size = 5 * 1024 * 1024
+
+    def __init__(self, storage, name, state=None, client=None):
+        self.storage = storage
+        self.name = name
+        self.state = state or {}
+        self.client = client or storage.bucket.meta.client
+
+    def begin(self):
+        name = self.storage.get_available_name(self.name)
+        key = self.storage._normalize_name(self.storage._clean_name(name))
+        response = self.client.create_multipart_upload(
+            Bucket=self.storage.bucket_name, Key=key,
+            ContentType=mimetypes.guess_type(name)[0] or "application/octet-stream")
+        self.state = {"name": name, "key": key,
+                      "multipart_id": response["UploadId"], "parts": []}
+        return self.state
+
+    def write(self, offset, stream, length):
+        with spool() as part:
+            copied = copy_stream(stream, part, length)
+            part.seek(0)
+            number = len(self.state["parts"]) + 1
+            response = self.client.upload_part(
+                Bucket=self.storage.bucket_name, Key=self.state["key"],
+                UploadId=self.state["multipart_id"], PartNumber=number,
+                Body=part, ContentLength=copied)
+        self.state["parts"].append(
+            {"PartNumber": number, "ETag": response["ETag"]})
+        return copied
+
+    def complete(self):
+        self.client.complete_multipart_upload(
+            Bucket=self.storage.bucket_name, Key=self.state["key"],
+            UploadId=self.state["multipart_id"],
+            MultipartUpload={"Parts": self.state["parts"]})
+        return self.state["name"]
+
+    def abort(self):
+        if self.state.get("multipart_id"):
+            self.client.abort_multipart_upload(
+                Bucket=self.storage.bucket_name, Key=self.state["key"],
+                UploadId=self.state["multipart_id"])
+
+
+def get_chunk_writer(storage, name, state=None):
+    from storages.backends.s3boto3 import S3Boto3Storage
+
+    if isinstance(storage, S3Boto3Storage):
+        return S3MultipartChunkWriter(storage, name, state)
+    return FileSystemChunkWriter(storage, name, state)
+
+
+class StoredUploadedFile(UploadedFile):
+    """An upload that is already in storage under ``name``, only metadata is kept."""
+
+    def __init__(self, name, size, content_type, content_hash=None):
+        super().__init__(None, name, content_type, size)
+        self._name = name
+        self.content_hash = content_hash
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        self._name = value
+
+    def open(self, mode=None):
+        raise ValueError("The upload was streamed to storage and has no local content")
+
+
+class StorageUploadHandler(FileUploadHandler):
+    """Streams multipart file fields to storage while the request body is read.
+
+    Incoming data is collected in a spool and handed to the chunk writer
+    every UPLOAD_PART_SIZE bytes, so large files go out as a multipart
+    upload during the request instead of after it. A file smaller than one
+    part is returned from its spool and never written here, so the caller
+    can skip storage altogether when the content is already known. The
+    SHA-256 of the content is computed on the way in as ``content_hash``.
+    """
+
+    def __init__(self, request=None, storage=None, upload_to=None):
+        super().__init__(request)
+        self.storage = storage
+        self.upload_to = upload_to
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None,
+                 content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length,
+                         charset, content_type_extra)
+        name = self.upload_to(file_name) if self.upload_to else file_name
+        self.writer = get_chunk_writer(self.storage, name)
+        self.buffer = spool()
+        self.hash = hashlib.sha256()
+        self.started = False
+        self.offset = 0
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hash.update(raw_data)
+        self.buffer.write(raw_data)
+        if self.buffer.tell() >= max(settings.UPLOAD_PART_SIZE, self.writer.min_chunk_size):
+            self.flush()
+        return None
+
+    def flush(self):
+        if not self.started:
+            self.writer.begin()
+            self.started = True
+        length = self.buffer.tell()
+        self.buffer.seek(0)
+        self.offset += self.writer.write(self.offset, self.buffer, length)
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def file_complete(self, file_size):
+        content_hash = self.hash.hexdigest()
+        if not self.started:
+            self.buffer.seek(0)
+            upload = UploadedFile(self.buffer, self.file_name, self.content_type,
+                                  file_size, self.charset, self.content_type_extra)
+            upload.content_hash = content_hash
+            return upload
+
+        if self.buffer.tell():
+            self.flush()
+        name = self.writer.complete()
+        self.buffer.close()
+        return StoredUploadedFile(name, file_size, self.content_type, content_hash)
+
+    def upload_interrupted(self):
+        if getattr(self, "started", False):
+            self.writer.abort()
+        if getattr(self, "buffer", None):
+            self.buffer.close()
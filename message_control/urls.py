@@ -1,12 +1,19 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from.views import GenericFileUploadView, MessageView
+from.views import ConversationView, GenericFileUploadView, LocalUploadView, MessageView, UploadSessionView
+from . import async_views
 
 router = DefaultRouter(trailing_slash=False)
 
 router.register("file-upload", GenericFileUploadView)
 router.register("message", MessageView)
+router.register("conversations", ConversationView)
+router.register("uploads", UploadSessionView)
 
 urlpatterns = [
-    path("", include(router.urls))
+    path("", include(router.urls)),
+    path("uploads/direct/<str:token>", LocalUploadView.as_view(), name="local-upload"),
+    path("async/message", async_views.messages),
+    path("async/conversations", async_views.conversations),
+    path("async/file-upload", async_views.file_upload),
 ]
@@ -0,0 +1,221 @@
+import logging
+import mimetypes
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+def webp_supported():
+    from PIL import features
+
+    return bool(features.check("webp"))
+
+
+def render_variants(data, sizes, webp, quality):
+    """Resize image bytes to every ``{key: max_edge}`` in ``sizes``.
+
+    Runs in a worker process, so it only takes and returns plain data:
+    ``{key: (bytes, extension, width, height)}``, with an extra ``<key>_webp``
+    entry per size when ``webp`` is set. Images already smaller than a size
+    are re-encoded at their own dimensions.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if alpha else "RGB")
+
+    variants = {}
+    for key, edge in sizes.items():
+        resized = image.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        encodings = [(key, "PNG", "png") if alpha else (key, "JPEG", "jpg")]
+        if webp:
+            encodings.append((f"{key}_webp", "WEBP", "webp"))
+        for name, image_format, extension in encodings:
+            output = BytesIO()
+            resized.save(output, image_format, quality=quality, optimize=True)
+            variants[name] = (output.getvalue(), extension, *resized.size)
+    return variants
+
+
+class VariantPipeline:
+    """Generates resized variants of uploaded images in the background.
+
+    Upload ids are queued after commit and picked up by worker threads,
+    which read the original from storage, hand the decoding and resizing to
+    a process pool (Pillow holds the GIL for most of it) and store the
+    results next to the original. ``processes=0`` renders in the worker
+    thread instead, for tests and single core hosts.
+    """
+
+    def __init__(self, sizes=None, workers=None, processes=None, max_queue=None, webp=None,
+                 quality=None):
+        self.sizes = sizes or settings.IMAGE_VARIANT_SIZES
+        self.quality = quality or settings.IMAGE_VARIANT_QUALITY
+        self.workers = workers or settings.IMAGE_VARIANT_WORKERS
+        self.processes = settings.IMAGE_VARIANT_PROCESSES if processes is None else processes
+        self.webp = webp_supported() if webp is None else webp
+
+        self.queue = queue.Queue(
+            maxsize=max_queue or settings.IMAGE_VARIANT_QUEUE_SIZE)
+        self.pool = None
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stopping = threading.Event()
+        self._stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "skipped": 0,
+            "dropped": 0,
+            "failed": 0,
+            "processing_total": 0.0,
+            "processing_max": 0.0,
+        }
+
+    def start(self):
+        if not settings.BACKGROUND_TASKS:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            if self.processes and self.pool is None:
+                # Forking a process that already runs threads can copy held locks
+                self.pool = ProcessPoolExecutor(
+                    self.processes, mp_context=multiprocessing.get_context("spawn"))
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._run, name=f"image-variants-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """Stop the workers once everything already queued has been processed, or ``timeout`` passed."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if threads:
+            deadline = time.monotonic() + timeout
+            with self.queue.all_tasks_done:
+                while self.queue.unfinished_tasks:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        logger.warning("Stopping with %s uploads left without variants",
+                                       self.queue.unfinished_tasks)
+                        break
+                    self.queue.all_tasks_done.wait(remaining)
+            self._stopping.set()
+            for thread in threads:
+                thread.join(timeout)
+        with self._lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            # Renders still running past the deadline are abandoned
+            pool.shutdown(wait=not any(thread.is_alive() for thread in threads), cancel_futures=True)
+
+    @staticmethod
+    def accepts(name):
+        content_type = mimetypes.guess_type(name)[0] or ""
+        return content_type.startswith("image/") and content_type != "image/svg+xml"
+
+    def enqueue(self, upload_id, name):
+        """Queue an upload for processing, False when it is not an image or nothing runs."""
+        if not self.accepts(name):
+            return False
+        self.start()
+        if not self._threads:
+            return False
+        try:
+            self.queue.put_nowait(upload_id)
+        except queue.Full:
+            self._incr("dropped")
+            logger.warning("Image variant queue full, skipping upload %s", upload_id)
+            return False
+        self._incr("enqueued")
+        return True
+
+    def process(self, upload_id):
+        """Generate and record the variants of one upload, return them or None when skipped."""
+        from .models import GenericFileUpload
+
+        upload = GenericFileUpload.objects.filter(pk=upload_id).first()
+        if upload is None or not upload.file_upload:
+            self._incr("skipped")
+            return None
+
+        started = time.monotonic()
+        storage = upload.file_upload.storage
+        with storage.open(upload.file_upload.name, "rb") as original:
+            data = original.read()
+        try:
+            if self.pool is not None:
+                rendered = self.pool.submit(
+                    render_variants, data, self.sizes, self.webp, self.quality).result()
+            else:
+                rendered = render_variants(data, self.sizes, self.webp, self.quality)
+        except Exception:
+            logger.warning("Could not render variants of upload %s", upload_id, exc_info=True)
+            self._incr("failed")
+            return None
+
+        root = os.path.splitext(upload.file_upload.name)[0]
+        variants = {}
+        for key, (content, extension, width, height) in rendered.items():
+            name = storage.save(f"{root}.{key}.{extension}", ContentFile(content))
+            variants[key] = {"name": name, "width": width, "height": height}
+
+        if not GenericFileUpload.objects.filter(pk=upload_id).update(variants=variants):
+            # The upload was deleted meanwhile
+            for variant in variants.values():
+                storage.delete(variant["name"])
+            self._incr("skipped")
+            return None
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats["processed"] += 1
+            self._stats["processing_total"] += elapsed
+            self._stats["processing_max"] = max(
+                self._stats["processing_max"], elapsed)
+        return variants
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        processing = stats.pop("processing_total")
+        stats["depth"] = self.queue.qsize()
+        stats["processing_avg"] = processing / stats["processed"] if stats["processed"] else 0.0
+        return stats
+
+    def _incr(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                upload_id = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            close_old_connections()
+            try:
+                self.process(upload_id)
+            except Exception:
+                logger.exception("Image variants of upload %s failed", upload_id)
+                self._incr("failed")
+            finally:
+                self.queue.task_done()
+
+
+variant_pipeline = VariantPipeline()
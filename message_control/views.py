@@ -1,53 +1,317 @@
-from rest_framework.viewsets import ModelViewSet
+import mimetypes
+import posixpath
+import re
+import uuid
+
+import jwt
+
 from django.conf import settings
+from django.core import signing
+from django.core.files import File
+from rest_framework.decorators import action
+from rest_framework.views import APIView
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
+from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, ListModelMixin, RetrieveModelMixin
 from socialchat.custom_auth import IsAuthenticatedCustom
-from .serializers import GenericFileUpload, GenericFileUploadSerializer, Message, MessageAttachment, MessageSerializer
+from socialchat.fastpath import FastPathMixin
+from socialchat.optimizer import QueryOptimizerMixin
+from .serializers import (
+    GenericFileUpload, GenericFileUploadSerializer, Message, MessageAttachment, MessageSerializer,
+    ConversationSerializer, UploadSessionSerializer, PresignUploadSerializer, CompleteUploadSerializer,
+)
+from socialchat.storage_backends import LOCAL_UPLOAD_SALT
+from .models import Conversation, UnreadCounter, UploadSession
+from .uploads import StorageUploadHandler, StoredUploadedFile, get_chunk_writer
+from socialchat.background import PeriodicTask
+from .pagination import InboxPagination, MessageHistoryPagination
 from rest_framework.response import Response
-from django.db.models import Q
-import requests
-import json
+from rest_framework.exceptions import ValidationError
+from django.db import transaction
+from .dispatch import dispatcher
+from socialchat.pubsub import broker
 
 # Create your views here.
 
 
 def handle_request(serializer_data):
+    transaction.on_commit(message_delivery(serializer_data))
+    return True
+
+
+def message_delivery(serializer_data):
+    """A callable publishing the saved message to sockets and the notification server."""
     notification = {
         "message": serializer_data.data.get("message"),
         "from": serializer_data.data.get("sender"),
         "to": serializer_data.data.get("receiver").get("id"),
     }
-    headers = {
-        "Content-Type": "application/json",
-    }
+    message = serializer_data.instance
+    event = {"type": "message", "data": serializer_data.data}
+
+    def deliver():
+        broker.publish((message.sender_id, message.receiver_id), event)
+        dispatcher.enqueue(notification)
+
+    return deliver
+
+
+def upload_name(filename):
+    return GenericFileUpload._meta.get_field("file_upload").generate_filename(None, filename)
+
+
+def upload_storage():
+    return GenericFileUpload._meta.get_field("file_upload").storage
+
+
+def upload_owner(request):
+    """The user of a valid bearer token, None for anonymous uploads."""
+    from user_control.views import decode_jwt
+
     try:
-        requests.post(settings.SOCKET_SERVER, json.dumps(
-            notification), headers=headers)
-    except Exception:
-        pass
-    return True
+        return decode_jwt(request.META.get("HTTP_AUTHORIZATION"))
+    except jwt.InvalidTokenError:
+        return None
+
 
+PRESIGN_SALT = "message_control.views.presign"
 
-class GenericFileUploadView(ModelViewSet):
+session_purger = PeriodicTask(
+    "upload-session-purge", settings.UPLOAD_SESSION_PURGE_INTERVAL,
+    lambda: UploadSession.objects.purge_expired(settings.UPLOAD_SESSION_TTL))
+
+
+class GenericFileUploadView(QueryOptimizerMixin, CreateModelMixin, ListModelMixin, RetrieveModelMixin,
+                            DestroyModelMixin, GenericViewSet):
+    """File uploads, shared by everyone who uploads the same bytes.
+
+    Uploads cannot be replaced in place, new content is a new upload. DELETE
+    only drops the caller's ownership, the file goes away once no owner is
+    left and no message or profile uses it.
+    """
     queryset = GenericFileUpload.objects.all()
     serializer_class = GenericFileUploadSerializer
 
+    def get_permissions(self):
+        if self.action == "destroy":
+            return [IsAuthenticatedCustom()]
+        return super().get_permissions()
 
-class MessageView(ModelViewSet):
-    queryset = Message.objects.select_related(
-        "sender", "receiver").prefetch_related("message_attachments")
+    def get_queryset(self):
+        if self.action == "destroy":
+            return self.queryset.filter(owners=self.request.user)
+        return self.queryset
+
+    def create(self, request, *args, **kwargs):
+        # Stream file fields to storage while the body is parsed
+        if settings.UPLOAD_STREAMING:
+            request._request.upload_handlers = [StorageUploadHandler(
+                request._request, upload_storage(), upload_name)]
+        return super().create(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        upload = serializer.validated_data["file_upload"]
+        content = upload.name if isinstance(upload, StoredUploadedFile) else upload
+        serializer.instance = GenericFileUpload.objects.store(
+            content, getattr(upload, "content_hash", None), upload_owner(self.request))
+
+    def perform_destroy(self, instance):
+        GenericFileUpload.objects.release(instance, self.request.user)
+
+
+class UploadSessionView(QueryOptimizerMixin, CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
+    """Resumable uploads.
+
+    POST creates a session for ``filename`` and ``size``. Each PUT sends the
+    next chunk as the raw body with ``Content-Range: bytes start-end/size``,
+    a chunk that does not start at the current offset gets 409 and the offset
+    to resume from. The request completing the file returns 201 with the
+    created ``file``. GET reports the offset, DELETE aborts.
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = (IsAuthenticatedCustom,)
+    content_range = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+    def get_queryset(self):
+        return self.queryset.filter(owner_id=self.request.user.id)
+
+    def perform_create(self, serializer):
+        filename = serializer.validated_data["filename"]
+        writer = get_chunk_writer(upload_storage(), upload_name(filename))
+        state = writer.begin()
+        serializer.save(owner_id=self.request.user.id,
+                        name=state.get("name", writer.name), state=state)
+        session_purger.start()
+
+    def update(self, request, *args, **kwargs):
+        session = self.get_object()
+        if session.upload_id:
+            return Response(self.get_serializer(session).data, status=200)
+
+        match = self.content_range.match(request.headers.get("Content-Range", ""))
+        if not match:
+            raise ValidationError({"Content-Range": "Expected bytes <start>-<end>/<size>"})
+        start, end, size = map(int, match.groups())
+        length = end - start + 1
+        if size != session.size or end >= size or length <= 0:
+            raise ValidationError({"Content-Range": "Range does not match the upload"})
+        if start != session.offset:
+            return Response({"success": False, "message": "Unexpected offset",
+                             "offset": session.offset}, status=409)
+
+        writer = get_chunk_writer(upload_storage(), session.name, session.state)
+        if length > settings.UPLOAD_MAX_CHUNK_SIZE or (end + 1 < size and length < writer.min_chunk_size):
+            raise ValidationError({"Content-Range": f"Chunks must be between {writer.min_chunk_size} "
+                                   f"and {settings.UPLOAD_MAX_CHUNK_SIZE} bytes"})
+
+        if writer.write(start, request._request, length) != length:
+            raise ValidationError({"Content-Range": "The body is shorter than the range"})
+        advanced = UploadSession.objects.filter(id=session.id, offset=start).update(
+            offset=end + 1, state=writer.state)
+        if not advanced:
+            session.refresh_from_db(fields=["offset"])
+            return Response({"success": False, "message": "Unexpected offset",
+                             "offset": session.offset}, status=409)
+
+        session.offset, session.state = end + 1, writer.state
+        if session.offset < session.size:
+            return Response(self.get_serializer(session).data, status=200)
+
+        session.upload = GenericFileUpload.objects.create(file_upload=writer.complete())
+        session.upload.owners.add(session.owner_id)
+        session.save(update_fields=["upload", "updated_at"])
+        return Response(self.get_serializer(session).data, status=201)
+
+    def perform_destroy(self, instance):
+        if not instance.upload_id:
+            get_chunk_writer(upload_storage(), instance.name, instance.state).abort()
+        instance.delete()
+
+    @action(detail=False, methods=["post"])
+    def presign(self, request):
+        """Hand out a URL (and form fields) the client uploads to directly, bytes never reach us."""
+        serializer = PresignUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if data["size"] > settings.PRESIGNED_UPLOAD_MAX_SIZE:
+            raise ValidationError(
+                {"size": f"Direct uploads are limited to {settings.PRESIGNED_UPLOAD_MAX_SIZE} bytes"})
+
+        storage = upload_storage()
+        if not hasattr(storage, "presigned_upload"):
+            return Response({"success": False, "message": "Direct uploads are not supported"}, status=400)
+
+        # A random prefix keeps names unique without asking storage first
+        filename = posixpath.basename(data["filename"].replace("\\", "/"))
+        name = upload_name(posixpath.join(uuid.uuid4().hex, filename))
+        content_type = data.get("content_type") or mimetypes.guess_type(
+            filename)[0] or "application/octet-stream"
+        target = storage.presigned_upload(
+            name, content_type, settings.PRESIGNED_UPLOAD_MAX_SIZE, settings.PRESIGNED_UPLOAD_EXPIRY)
+
+        token = signing.dumps(
+            {"name": name, "user_id": request.user.id}, salt=PRESIGN_SALT)
+        return Response({
+            "upload_token": token,
+            "method": target["method"],
+            "url": request.build_absolute_uri(target["url"]),
+            "fields": target["fields"],
+            "expires_in": settings.PRESIGNED_UPLOAD_EXPIRY,
+        }, status=201)
+
+    @action(detail=False, methods=["post"])
+    def complete(self, request):
+        """Create the GenericFileUpload once the presigned upload has landed in storage."""
+        serializer = CompleteUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            token = signing.loads(serializer.validated_data["upload_token"], salt=PRESIGN_SALT,
+                                  max_age=settings.PRESIGNED_UPLOAD_EXPIRY * 2)
+        except signing.BadSignature:
+            raise ValidationError({"upload_token": "Invalid or expired upload token"})
+        if token["user_id"] != request.user.id:
+            raise ValidationError({"upload_token": "Invalid or expired upload token"})
+
+        storage = upload_storage()
+        if not storage.exists(token["name"]):
+            return Response({"success": False, "message": "The file has not been uploaded"}, status=409)
+
+        upload, created = GenericFileUpload.objects.get_or_create(
+            file_upload=token["name"])
+        upload.owners.add(request.user)
+        return Response(GenericFileUploadSerializer(upload, context=self.get_serializer_context()).data,
+                        status=201 if created else 200)
+
+
+class LocalUploadView(APIView):
+    """Receiver for LocalMediaStorage presigned URLs, the signed token is the credential."""
+    authentication_classes = ()
+    permission_classes = ()
+
+    def put(self, request, token):
+        try:
+            target = signing.loads(token, salt=LOCAL_UPLOAD_SALT,
+                                   max_age=settings.PRESIGNED_UPLOAD_EXPIRY)
+        except signing.BadSignature:
+            return Response({"success": False, "message": "Invalid or expired upload URL"}, status=403)
+
+        length = int(request.headers.get("Content-Length") or 0)
+        if not 0 < length <= target["max_size"]:
+            return Response({"success": False, "message": "Invalid upload size"}, status=400)
+
+        storage = upload_storage()
+        if storage.exists(target["name"]):
+            return Response({"success": False, "message": "The file was already uploaded"}, status=409)
+        storage.save(target["name"], File(request._request))
+        return Response(status=204)
+
+
+class MessageView(FastPathMixin, QueryOptimizerMixin, ModelViewSet):
+    queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = (IsAuthenticatedCustom,)
 
+    @property
+    def paginator(self):
+        # Conversations scroll by cursor, ?page= keeps the numbered pages
+        params = self.request.query_params
+        if not hasattr(self, "_paginator") and params.get("user_id") and "page" not in params:
+            self._paginator = MessageHistoryPagination()
+        return super().paginator
+
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get("many") and args:
+            kwargs["context"] = {
+                **self.get_serializer_context(),
+                "unseen_counts": self.get_unseen_counts(args[0]),
+            }
+        return super().get_serializer(*args, **kwargs)
+
+    def get_unseen_counts(self, messages):
+        participant_ids = set()
+        for message in messages:
+            participant_ids.update((message.sender_id, message.receiver_id))
+        return Message.unseen_counts(self.request.user.id, participant_ids)
+
     def get_queryset(self):
         data = self.request.query_params.dict()
         user_id = data.get("user_id", None)
 
         if user_id:
             active_user_id = self.request.user.id
-            return self.queryset.filter(Q(sender_id=user_id, receiver_id=active_user_id) | Q(sender_id=active_user_id, receiver_id=user_id)).distinct()
+            return self.queryset.filter(conversation_key=Message.make_conversation_key(user_id, active_user_id))
         return self.queryset
 
     def create(self, request, *args, **kwargs):
+        serializer, attachments = self.validate_message(request)
+        files = self.get_attachment_files(attachments)
+        self.save_message(serializer, attachments, files)
+        handle_request(serializer)
+
+        return Response(serializer.data, status=201)
+
+    def validate_message(self, request):
+        """The validated serializer of a new message, and its attachments payload."""
         try:
             request.data._mutable = True
         except:
@@ -60,18 +324,20 @@ class MessageView(ModelViewSet):
 
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-
-        if attachments:
-            MessageAttachment.objects.bulk_create(
-                [MessageAttachment(**attachment, message_id=serializer.data["id"]) for attachment in attachments])
+        return serializer, attachments
 
-            message_data = self.get_queryset().get(id=serializer.data["id"])
-            return Response(self.serializer_class(message_data).data, status=201)
+    def save_message(self, serializer, attachments, files):
+        """Write a new message, its counters and attachments in one transaction."""
+        with transaction.atomic():
+            message = serializer.save(sender=self.request.user)
+            Conversation.objects.record_message(message)
+            UnreadCounter.objects.record_change(
+                None, UnreadCounter.objects.state(message))
+            saved = self.save_attachments(message, attachments, files, [])
 
-        handle_request(serializer)
-
-        return Response(serializer.data, status=201)
+        # Rendered from memory, the message was just written
+        serializer.context["saved_attachments"] = {message.id: saved}
+        return message
 
     def update(self, request, *args, **kwargs):
 
@@ -86,17 +352,85 @@ class MessageView(ModelViewSet):
         serializer = self.serializer_class(
             data=request.data, instance=message_instance, partial=True)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        files = self.get_attachment_files(attachments)
 
-        MessageAttachment.objects.filter(
-            message_id=message_instance.id).delete()
-
-        if attachments:
-            MessageAttachment.objects.bulk_create(MessageAttachment(
-                **attachment, message_id=message_instance.id) for attachment in attachments)
-
-            message_data = self.get_object()
-            return Response(self.serializer_class(message_data).data, status=200)
+        with transaction.atomic():
+            before = UnreadCounter.objects.state(message_instance)
+            message = serializer.save()
+            UnreadCounter.objects.record_change(
+                before, UnreadCounter.objects.state(message))
+            # Attachments are only replaced when the request sends them
+            if attachments is not None:
+                saved = self.save_attachments(
+                    message, attachments, files, list(message.message_attachments.all()))
+                serializer.context["saved_attachments"] = {message.id: saved}
 
         handle_request(serializer)
         return Response(serializer.data, status=200)
+
+    @staticmethod
+    def get_attachment_files(attachments):
+        """Validate the attachment payload, fetching every referenced upload in one query."""
+        if not attachments:
+            return {}
+
+        try:
+            ids = {int(attachment["attachment_id"])
+                   for attachment in attachments}
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(
+                {"attachments": "Every attachment needs a numeric attachment_id"})
+
+        files = GenericFileUpload.objects.in_bulk(ids)
+        missing = ids - files.keys()
+        if missing:
+            raise ValidationError(
+                {"attachments": f"Unknown attachment ids: {sorted(missing)}"})
+        return files
+
+    @staticmethod
+    def save_attachments(message, attachments, files, existing):
+        """Diff the requested attachments against existing ones, writing only the changes.
+
+        Returns the message's attachments in request order, kept rows and
+        the new ones alike.
+        """
+        unmatched = list(existing)
+        saved, pending = [], []
+        for attachment in attachments or []:
+            attachment_id = int(attachment["attachment_id"])
+            caption = attachment.get("caption")
+            match = next((item for item in unmatched
+                          if item.attachment_id == attachment_id and item.caption == caption), None)
+            if match:
+                unmatched.remove(match)
+                saved.append(match)
+            else:
+                pending.append(MessageAttachment(
+                    message=message, attachment=files[attachment_id], caption=caption))
+                saved.append(pending[-1])
+
+        if unmatched:
+            MessageAttachment.objects.filter(
+                id__in=[item.id for item in unmatched]).delete()
+        if pending:
+            MessageAttachment.objects.bulk_create(pending)
+        return saved
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            UnreadCounter.objects.record_change(
+                UnreadCounter.objects.state(instance), None)
+            instance.delete()
+            Conversation.objects.refresh_last_message(
+                instance.conversation_key)
+
+
+class ConversationView(QueryOptimizerMixin, ListModelMixin, GenericViewSet):
+    queryset = Conversation.objects.all()
+    serializer_class = ConversationSerializer
+    permission_classes = (IsAuthenticatedCustom,)
+    pagination_class = InboxPagination
+
+    def get_queryset(self):
+        return self.queryset.filter(owner_id=self.request.user.id)
@@ -13,4 +13,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'socialchat.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Load the typeahead index and revoked tokens before the first request needs them
+from user_control.revocation import revocation_list  # noqa: E402
+from user_control.suggest import suggest_index  # noqa: E402
+from socialchat.websocket import websocket_application  # noqa: E402
+
+suggest_index.warm()
+revocation_list.warm()
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,52 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Runs ``func`` every ``interval`` seconds on a daemon thread.
+
+    The thread is only started on the first call to ``start()``, so importing
+    a module that defines a task never spawns threads by itself. Nothing is
+    started while ``settings.BACKGROUND_TASKS`` is off.
+    """
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0 or not settings.BACKGROUND_TASKS:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stopping.set()
+        thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            close_old_connections()
+            try:
+                self.func()
+            except Exception:
+                logger.exception("Periodic task %s failed", self.name)
+        connection.close()
@@ -1,5 +1,7 @@
+import jwt
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
 from rest_framework.permissions import BasePermission, SAFE_METHODS
-from django.utils import timezone
 from rest_framework.views import exception_handler
 from rest_framework.response import Response
 from django.contrib.auth import authenticate
@@ -15,13 +17,29 @@ class IsAuthenticatedCustom(BasePermission):
 
         request.user = user
         if request.user and request.user.is_authenticated:
-            from user_control.models import CustomUser
-            CustomUser.objects.filter(id=request.user.id).update(
-                is_online=timezone.now())
+            from user_control.presence import presence
+            presence.touch(request.user.id)
             return True
         return False
 
 
+@sync_to_async
+def authenticate_token(token):
+    """Resolve an access token to an active user for async callers, None when invalid."""
+    from user_control.views import decode_jwt
+    from user_control.presence import presence
+
+    close_old_connections()
+    try:
+        user = decode_jwt(f"Bearer {token}")
+    except jwt.InvalidTokenError:
+        return None
+    if user is None or not user.is_active:
+        return None
+    presence.touch(user.id)
+    return user
+
+
 class IsAuthenticatedOrReadCustom(BasePermission):
 
     def has_permission(self, request, view):
@@ -29,9 +47,8 @@ class IsAuthenticatedOrReadCustom(BasePermission):
             return True
 
         if request.user and request.user.is_authenticated:
-            from user_control.models import CustomUser
-            CustomUser.objects.filter(id=request.user.id).update(
-                is_online=timezone.now())
+            from user_control.presence import presence
+            presence.touch(request.user.id)
             return True
         return False
 
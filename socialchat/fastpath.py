@@ -0,0 +1,186 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+# Fields whose to_representation returns the database value unchanged
+PLAIN_FIELDS = (
+    serializers.CharField, serializers.EmailField, serializers.SlugField, serializers.URLField,
+    serializers.IntegerField, serializers.BooleanField, serializers.ReadOnlyField,
+)
+# Fields rendered by their own to_representation, fed the database value
+CONVERTED_FIELDS = (
+    serializers.DateTimeField, serializers.DateField, serializers.TimeField, serializers.DurationField,
+    serializers.UUIDField, serializers.FloatField, serializers.DecimalField,
+)
+
+
+def parse_fields(value, serializer_class):
+    """``?fields=a,b`` as a frozenset of readable field names, None when not given."""
+    requested = {name.strip() for name in (value or "").split(",") if name.strip()}
+    if not requested:
+        return None
+    readable = {name for name, field in serializer_class().fields.items() if not field.write_only}
+    unknown = requested - readable
+    if unknown:
+        raise ValidationError({"fields": f"Unknown fields: {', '.join(sorted(unknown))}"})
+    return frozenset(requested)
+
+
+class SparseFieldsetMixin:
+    """Renders only the top-level fields named in ``context["fields"]``, when set."""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        only = self.context.get("fields")
+        parent = self.parent
+        top_level = parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+        if only is None or not top_level:
+            return fields
+        return {name: field for name, field in fields.items() if name in only or field.write_only}
+
+
+def get_column(model, field):
+    """The ``values()`` column ``field`` renders unchanged, None if it needs more than a column."""
+    if len(field.source_attrs) != 1:
+        return None
+    try:
+        model_field = model._meta.get_field(field.source_attrs[0])
+    except FieldDoesNotExist:
+        return None
+    if not model_field.concrete:
+        return None
+    if model_field.is_relation:
+        related = isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None
+        single = model_field.many_to_one or model_field.one_to_one
+        return model_field.attname if related and single else None
+    return model_field.attname if type(field) in PLAIN_FIELDS + CONVERTED_FIELDS else None
+
+
+class FastPath:
+    """Renders ``values_list()`` rows with a function compiled for one serializer.
+
+    ``columns`` are fetched per row, ``loaders`` are ``(loader, column
+    indexes)`` pairs called once per page with every key found in those
+    columns, ``render_rows(rows, *loaded)`` builds the output dicts.
+    """
+
+    def __init__(self, columns, loaders, render_rows):
+        self.columns = columns
+        self.loaders = loaders
+        self.render_rows = render_rows
+
+    def values(self, queryset):
+        # Joins and prefetches of the serializer path are of no use to rows
+        return queryset.prefetch_related(None).values_list(*self.columns, named=True)
+
+    def render(self, rows, context):
+        rows = list(rows)
+        loaded = []
+        for loader, indexes in self.loaders:
+            keys = {row[index] for row in rows for index in indexes}
+            keys.discard(None)
+            loaded.append(loader(keys, context) if keys else {})
+        return self.render_rows(rows, *loaded)
+
+
+@lru_cache(maxsize=256)
+def get_fast_path(serializer_class, fields=None, extra_columns=()):
+    """FastPath rendering ``serializer_class`` like ``serializer.data``, None if it cannot.
+
+    Fields that are more than a column, nested serializers and method
+    fields, need a loader in ``Meta.fast_path_loaders`` as ``{name: (column,
+    loader or dotted path)}``. ``loader(keys, context)`` returns the rendered
+    value for every key, keys it leaves out render as None. Fields sharing a
+    loader share one call. ``extra_columns`` are fetched for pagination.
+    """
+    serializer = serializer_class()
+    meta = serializer.Meta
+    model = meta.model
+    hints = getattr(meta, "fast_path_loaders", {})
+
+    columns, converters, loaders, entries = [], [], {}, []
+
+    def column_index(column):
+        if column not in columns:
+            columns.append(column)
+        return columns.index(column)
+
+    for name, field in serializer.fields.items():
+        if field.write_only or (fields is not None and name not in fields):
+            continue
+        if name in hints:
+            column, loader = hints[name]
+            if isinstance(loader, str):
+                loader = import_string(loader)
+            index = column_index(column)
+            indexes = loaders.setdefault(loader, [])
+            if index not in indexes:
+                indexes.append(index)
+            entries.append((name, f"l{list(loaders).index(loader)}.get(row[{index}])"))
+            continue
+        column = get_column(model, field)
+        if column is None:
+            return None
+        index = column_index(column)
+        if type(field) in PLAIN_FIELDS or isinstance(field, serializers.PrimaryKeyRelatedField):
+            entries.append((name, f"row[{index}]"))
+        else:
+            converters.append(field.to_representation)
+            entries.append((name, f"None if row[{index}] is None else c{len(converters) - 1}(row[{index}])"))
+
+    for column in extra_columns:
+        column_index(column)
+
+    arguments = "".join(f", l{index}" for index in range(len(loaders)))
+    items = "".join(f"{name!r}: {entry}, " for name, entry in entries)
+    source = f"def render_rows(rows{arguments}):\n    return [{{{items}}} for row in rows]\n"
+    namespace = {f"c{index}": converter for index, converter in enumerate(converters)}
+    exec(compile(source, f"<fast path for {serializer_class.__name__}>", "exec"), namespace)
+
+    return FastPath(columns, [(loader, indexes) for loader, indexes in loaders.items()],
+                    namespace["render_rows"])
+
+
+class FastPathMixin:
+    """List responses rendered from ``values_list()`` rows, plus ``?fields=`` sparse fieldsets.
+
+    When ``settings.FAST_PATH_READS`` is on and the serializer can be
+    compiled (see ``get_fast_path``), ``list`` skips model instances and
+    field-by-field serialization, producing the same data. ``?fields=id,message``
+    trims the top-level fields on every read, the serializer needs
+    SparseFieldsetMixin for the regular path. Goes before QueryOptimizerMixin.
+    """
+    fields_query_param = "fields"
+
+    def get_sparse_fields(self):
+        if not hasattr(self, "_sparse_fields"):
+            self._sparse_fields = parse_fields(
+                self.request.query_params.get(self.fields_query_param), self.get_serializer_class())
+        return self._sparse_fields
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), "fields": self.get_sparse_fields()}
+
+    def get_fast_path(self):
+        if not settings.FAST_PATH_READS:
+            return None
+        ordering_field = getattr(self.paginator, "ordering_field", None)
+        extra_columns = ("id", ordering_field) if ordering_field else ()
+        return get_fast_path(self.get_serializer_class(), self.get_sparse_fields(), extra_columns)
+
+    def list(self, request, *args, **kwargs):
+        fast_path = self.get_fast_path()
+        if fast_path is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = fast_path.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        data = fast_path.render(queryset if page is None else page, self.get_serializer_context())
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
@@ -0,0 +1,348 @@
+import asyncio
+import json
+import random
+import statistics
+import tempfile
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+from socialchat.testing import BufferedAsyncClient
+
+SCENARIOS = (
+    "login",
+    "refresh",
+    "profile_search",
+    "profile_suggest",
+    "conversation_fetch",
+    "message_create",
+    "file_upload",
+)
+
+# Sync endpoint and its async counterpart, compared under concurrent load
+ASYNC_ENDPOINTS = {
+    "conversation_fetch": ("/message/message", "/message/async/message"),
+    "message_create": ("/message/message", "/message/async/message"),
+    "profile_search": ("/user/profile", "/user/async/profile"),
+    "profile_suggest": ("/user/profile/suggest", "/user/async/profile/suggest"),
+    "file_upload": ("/message/file-upload", "/message/async/file-upload"),
+}
+
+PASSWORD = "benchmarkPassword123"
+
+
+class Benchmark:
+    """Seeds the current database and times the REST API through the test client.
+
+    Every scenario reports latency percentiles and the number of queries per
+    request. File uploads go to a temporary LocalMediaStorage so no network is
+    involved. With ``concurrency`` set, the sync and async views behind
+    ``ASYNC_ENDPOINTS`` are also driven through the ASGI handler with that
+    many requests in flight and their throughput is reported. With
+    ``fast_path`` the message history is also fetched through serializers
+    and JSONRenderer, then the fast path and orjson, and their throughput is
+    compared on byte-for-byte identical responses.
+    """
+
+    def __init__(self, users=1000, messages=100000, iterations=50, hot_ratio=0.1,
+                 scenarios=SCENARIOS, seed=0, log=None, concurrency=0, fast_path=False):
+        self.users = max(users, 2)
+        self.messages = messages
+        self.iterations = iterations
+        self.hot_ratio = hot_ratio
+        self.scenarios = scenarios
+        self.random = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.concurrency = concurrency
+        self.fast_path = fast_path
+        self.client = Client()
+
+    def run(self):
+        started = time.perf_counter()
+        self.seed_data()
+        seeded = time.perf_counter() - started
+
+        results = {}
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                DEFAULT_FILE_STORAGE="socialchat.storage_backends.LocalMediaStorage",
+                MEDIA_ROOT=media_root):
+            self.login()
+            for name in self.scenarios:
+                self.log(f"Running {name}")
+                results[name] = getattr(self, f"scenario_{name}")()
+            throughput = {}
+            if self.concurrency:
+                for name in ASYNC_ENDPOINTS:
+                    self.log(f"Comparing sync and async {name}")
+                    throughput[name] = async_to_sync(self.compare_async)(name)
+            if self.fast_path:
+                self.log("Comparing the serializer and fast path message history")
+                fast_path = self.compare_fast_path()
+
+        report = {
+            "config": {
+                "users": self.users,
+                "messages": self.messages,
+                "iterations": self.iterations,
+                "hot_ratio": self.hot_ratio,
+                "database": connection.vendor,
+            },
+            "seed_seconds": round(seeded, 3),
+            "scenarios": results,
+        }
+        if throughput:
+            report["throughput"] = throughput
+        if self.fast_path:
+            report["fast_path"] = fast_path
+        return report
+
+    def seed_data(self):
+        from message_control.models import Message, UnreadCounter
+        from user_control.models import CustomUser, UserProfile
+        from user_control.search import search_index
+
+        self.log(f"Seeding {self.users} users")
+        password = make_password(PASSWORD)
+        CustomUser.objects.bulk_create(
+            (CustomUser(username=f"bench{index}", email=f"bench{index}@example.com", password=password)
+             for index in range(self.users)), batch_size=2000)
+        user_ids = list(CustomUser.objects.filter(
+            username__startswith="bench").order_by("id").values_list("id", flat=True))
+        UserProfile.objects.bulk_create(
+            (UserProfile(user_id=user_id, first_name=f"First{index}", last_name=f"Last{index}",
+                         caption="benchmark", about="benchmark")
+             for index, user_id in enumerate(user_ids)), batch_size=2000)
+        search_index.rebuild()
+        self.user_ids = user_ids
+
+        self.log(f"Seeding {self.messages} messages")
+        hot = user_ids[0], user_ids[1]
+        batch = []
+        for index in range(self.messages):
+            if self.random.random() < self.hot_ratio:
+                sender_id, receiver_id = self.random.sample(hot, 2)
+            else:
+                sender_id, receiver_id = self.random.sample(user_ids, 2)
+            batch.append(Message(
+                sender_id=sender_id, receiver_id=receiver_id, message=f"message {index}",
+                is_read=self.random.random() < 0.8,
+                conversation_key=Message.make_conversation_key(sender_id, receiver_id)))
+            if len(batch) == 5000:
+                Message.objects.bulk_create(batch)
+                batch = []
+        Message.objects.bulk_create(batch)
+        UnreadCounter.objects.rebuild()
+
+    def login(self):
+        response = self.client.post(
+            "/user/login", {"username": "bench0", "password": PASSWORD})
+        result = response.json()
+        self.access, self.refresh = result["access"], result["refresh"]
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {self.access}"}
+
+    def measure(self, request):
+        timings, queries = [], []
+        for iteration in range(self.iterations):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = request(iteration)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context))
+            if response.status_code >= 400:
+                raise RuntimeError(
+                    f"Benchmark request failed with {response.status_code}: {response.content[:200]}")
+        return summarize(timings, queries)
+
+    def scenario_login(self):
+        return self.measure(lambda _: self.client.post(
+            "/user/login", {"username": "bench0", "password": PASSWORD}))
+
+    def scenario_refresh(self):
+        self.login()
+
+        def refresh(_):
+            response = self.client.post("/user/refresh", {"refresh": self.refresh})
+            self.refresh = response.json().get("refresh", self.refresh)
+            return response
+
+        return self.measure(refresh)
+
+    def scenario_profile_search(self):
+        return self.measure(lambda _: self.client.get(
+            "/user/profile", {"keyword": f"bench{self.random.randrange(self.users)}"}, **self.headers))
+
+    def scenario_profile_suggest(self):
+        return self.measure(lambda _: self.client.get(
+            "/user/profile/suggest", {"q": f"bench{self.random.randrange(self.users)}"}, **self.headers))
+
+    def scenario_conversation_fetch(self):
+        peer_id = self.user_ids[1]
+        state = {"url": f"/message/message?user_id={peer_id}"}
+
+        def fetch(_):
+            response = self.client.get(state["url"], **self.headers)
+            state["url"] = response.json().get("next") or f"/message/message?user_id={peer_id}"
+            return response
+
+        return self.measure(fetch)
+
+    def scenario_message_create(self):
+        return self.measure(lambda iteration: self.client.post("/message/message", {
+            "sender_id": self.user_ids[0],
+            "receiver_id": self.user_ids[1],
+            "message": f"benchmark {iteration}",
+        }, **self.headers))
+
+    def scenario_file_upload(self):
+        return self.measure(lambda iteration: self.client.post("/message/file-upload", {
+            "file_upload": SimpleUploadedFile(f"bench{iteration}.txt", b"x" * 1024),
+        }, **self.headers))
+
+    def compare_fast_path(self):
+        from rest_framework.renderers import JSONRenderer
+        from user_control.presence import presence
+        from socialchat.renderers import ORJSONRenderer
+
+        url = f"/message/message?user_id={self.user_ids[1]}"
+        urls = []
+        for _ in range(self.iterations):
+            urls.append(url)
+            url = self.client.get(url, **self.headers).json().get("next") or urls[0]
+
+        result, contents = {"pages": len(urls)}, {}
+        modes = (("serializer", False, JSONRenderer), ("fast_path", True, ORJSONRenderer))
+        # Requests move the viewer's last seen time, which is in every page
+        with mock.patch.object(presence, "touch"):
+            for kind, fast, renderer in modes:
+                with override_settings(FAST_PATH_READS=fast):
+                    started = time.perf_counter()
+                    responses = [self.client.get(page, HTTP_ACCEPT=renderer.media_type, **self.headers)
+                                 for page in urls]
+                    elapsed = time.perf_counter() - started
+                contents[kind] = [response.content for response in responses]
+                result[f"{kind}_rps"] = round(len(urls) / elapsed, 1)
+        if contents["serializer"] != contents["fast_path"]:
+            raise RuntimeError("The fast path responses differ from the serializer ones")
+        result["speedup"] = round(result["fast_path_rps"] / result["serializer_rps"], 2)
+        return result
+
+    async def compare_async(self, name):
+        client = BufferedAsyncClient()
+        result = {"concurrency": self.concurrency}
+        for kind, path in zip(("sync", "async"), ASYNC_ENDPOINTS[name]):
+            request = self.async_request(client, name, path)
+            started = time.perf_counter()
+            for _ in range(self.iterations):
+                responses = await asyncio.gather(
+                    *(request() for _ in range(self.concurrency)))
+                failed = [response for response in responses if response.status_code >= 400]
+                if failed:
+                    raise RuntimeError(
+                        f"Benchmark request failed with {failed[0].status_code}: {failed[0].content[:200]}")
+            elapsed = time.perf_counter() - started
+            result[f"{kind}_rps"] = round(self.iterations * self.concurrency / elapsed, 1)
+        result["speedup"] = round(result["async_rps"] / result["sync_rps"], 2)
+        return result
+
+    def async_request(self, client, name, path):
+        headers = {"authorization": f"Bearer {self.access}"}
+        if name == "conversation_fetch":
+            return lambda: client.get(path, {"user_id": self.user_ids[1]}, **headers)
+        if name == "message_create":
+            return lambda: client.post(path, {
+                "sender_id": self.user_ids[0], "receiver_id": self.user_ids[1],
+                "message": "benchmark"}, **headers)
+        if name == "file_upload":
+            return lambda: client.post(path, {
+                "file_upload": SimpleUploadedFile("bench.txt", b"x" * 1024)}, **headers)
+        return lambda: client.get(path, {
+            "keyword" if name == "profile_search" else "q": f"bench{self.random.randrange(self.users)}"
+        }, **headers)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(timings, queries):
+    return {
+        "iterations": len(timings),
+        "p50_ms": round(percentile(timings, 0.5), 3),
+        "p99_ms": round(percentile(timings, 0.99), 3),
+        "mean_ms": round(statistics.mean(timings), 3),
+        "queries_p50": percentile(queries, 0.5),
+        "queries_max": max(queries),
+    }
+
+
+def compare_reports(baseline, current):
+    """Rows of (scenario, metric, baseline, current, change in percent)."""
+    rows = []
+    for name, metrics in current["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("p50_ms", "p99_ms", "queries_p50", "queries_max"):
+            before, after = previous[metric], metrics[metric]
+            change = (after - before) / before * 100 if before else 0.0
+            rows.append((name, metric, before, after, round(change, 1)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = "Seed a throwaway database and report REST API latency and query counts as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--messages", type=int, default=1000000)
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--hot-ratio", type=float, default=0.1,
+                            help="Share of messages in the conversation that gets fetched")
+        parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                            help="Only run the given scenario, may be repeated")
+        parser.add_argument("--concurrency", type=int, default=0,
+                            help="Also compare sync and async view throughput with this many requests in flight")
+        parser.add_argument("--fast-path", action="store_true",
+                            help="Also compare message history throughput with and without the fast path")
+        parser.add_argument("--output", help="Write the JSON report to this file")
+        parser.add_argument("--compare", help="Baseline JSON report to compare against")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        background_tasks, settings.BACKGROUND_TASKS = settings.BACKGROUND_TASKS, False
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = Benchmark(
+                users=options["users"], messages=options["messages"],
+                iterations=options["iterations"], hot_ratio=options["hot_ratio"],
+                scenarios=options["scenario"] or SCENARIOS,
+                concurrency=options["concurrency"], fast_path=options["fast_path"],
+                log=lambda message: self.stderr.write(message),
+            ).run()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            settings.BACKGROUND_TASKS = background_tasks
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as report_file:
+                report_file.write(output)
+        self.stdout.write(output)
+
+        if options["compare"]:
+            with open(options["compare"]) as baseline_file:
+                baseline = json.load(baseline_file)
+            for name, metric, before, after, change in compare_reports(baseline, report):
+                self.stdout.write(
+                    f"{name:20} {metric:12} {before:>10} -> {after:<10} {change:+.1f}%")
@@ -0,0 +1,181 @@
+import sys
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection
+from django.db.models import Prefetch
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+
+MAX_DEPTH = 8
+
+
+class LazyLoadError(AssertionError):
+    """A related object was fetched lazily while a response was serialized."""
+
+
+class QueryPlan:
+    """``select_related`` paths plus ``{path: (model, QueryPlan)}`` prefetches."""
+
+    def __init__(self):
+        self.select = set()
+        self.prefetch = {}
+
+    def apply(self, queryset):
+        if self.select:
+            queryset = queryset.select_related(*sorted(self.select))
+
+        # Lookups the view already prefetches win over the computed ones
+        seen = [getattr(lookup, "prefetch_to", lookup)
+                for lookup in queryset._prefetch_related_lookups]
+        lookups = []
+        for path, (model, plan) in sorted(self.prefetch.items()):
+            if any(lookup == path or lookup.startswith(f"{path}__") for lookup in seen):
+                continue
+            if plan.select or plan.prefetch:
+                lookups.append(Prefetch(path, queryset=plan.apply(model._default_manager.all())))
+            else:
+                lookups.append(path)
+        return queryset.prefetch_related(*lookups) if lookups else queryset
+
+
+def get_relation(model, name):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    return field if field.is_relation else None
+
+
+def nested_serializer(serializer, field_name, field):
+    """The (source, serializer) a field renders, None for fields without nested data.
+
+    SerializerMethodFields that render related objects declare them in
+    ``Meta.method_field_sources`` as ``{name: (source, serializer class or dotted path)}``.
+    """
+    if isinstance(field, serializers.SerializerMethodField):
+        hints = getattr(getattr(serializer, "Meta", None), "method_field_sources", {})
+        if field_name not in hints:
+            return None
+        source, child = hints[field_name]
+        if isinstance(child, str):
+            child = import_string(child)
+        return source.split("."), child()
+    if isinstance(field, serializers.ListSerializer):
+        return field.source_attrs, field.child
+    if isinstance(field, serializers.BaseSerializer):
+        return field.source_attrs, field
+    if isinstance(field, serializers.ManyRelatedField):
+        return field.source_attrs, None
+    if isinstance(field, serializers.PrimaryKeyRelatedField):
+        # Rendered from the foreign key column, nothing to join
+        return None
+    if isinstance(field, serializers.RelatedField):
+        return field.source_attrs, None
+    if len(field.source_attrs) > 1:
+        return field.source_attrs[:-1], None
+    return None
+
+
+def walk(serializer, model, plan, prefix=(), via=None, depth=0, only=None):
+    if depth > MAX_DEPTH:
+        return
+    for field_name, field in serializer.fields.items():
+        if field.write_only or (only is not None and field_name not in only):
+            continue
+        nested = nested_serializer(serializer, field_name, field)
+        if nested is None:
+            continue
+        source_attrs, child = nested
+        current, path, current_via = model, list(prefix), via
+        for attr in source_attrs:
+            relation = get_relation(current, attr)
+            if relation is None:
+                break
+            if current_via is not None and relation.one_to_one and current_via.remote_field is relation:
+                # Both sides of a one-to-one are cached by the first join
+                path, current, current_via = path[:-1], relation.related_model, None
+                continue
+            if relation.one_to_many or relation.many_to_many:
+                nested_plan = QueryPlan()
+                if child is not None:
+                    walk(child, relation.related_model, nested_plan, via=relation, depth=depth + 1)
+                plan.prefetch["__".join(path + [attr])] = (relation.related_model, nested_plan)
+                break
+            path.append(attr)
+            plan.select.add("__".join(path))
+            current, current_via = relation.related_model, relation
+        else:
+            if child is not None:
+                walk(child, current, plan, path, current_via, depth + 1)
+
+
+@lru_cache(maxsize=256)
+def get_query_plan(serializer_class, model, fields=None):
+    """Joins and prefetches ``serializer_class`` needs to render ``model`` rows without lazy loads.
+
+    ``fields``, a frozenset, limits the plan to those top-level fields.
+    """
+    plan = QueryPlan()
+    walk(serializer_class(), model, plan, only=fields)
+    return plan
+
+
+def optimize_queryset(queryset, serializer_class, fields=None):
+    return get_query_plan(serializer_class, queryset.model, fields).apply(queryset)
+
+
+def lazy_load_source():
+    """The related descriptor or manager running the current query, if any."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_filename.endswith("related_descriptors.py"):
+            owner = frame.f_locals.get("self")
+            relation = getattr(owner, "field", None) or getattr(owner, "related", None)
+            return f"{type(owner).__name__} {relation}"
+        frame = frame.f_back
+    return None
+
+
+@contextmanager
+def forbid_lazy_loads():
+    """Raise LazyLoadError on any query issued by a related descriptor inside the block."""
+    def blocker(execute, sql, params, many, context):
+        source = lazy_load_source()
+        if source is not None:
+            raise LazyLoadError(f"{source} was loaded lazily: {sql}")
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(blocker):
+        yield
+
+
+class QueryOptimizerMixin:
+    """Adds the joins and prefetches the view's serializer needs to every queryset it serves.
+
+    With ``settings.QUERY_OPTIMIZER_STRICT`` on, as in tests, responses are
+    serialized eagerly and a lazily loaded relation raises LazyLoadError
+    instead of silently costing a query per row.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return optimize_queryset(queryset, self.get_serializer_class(), self.get_sparse_fields())
+
+    def get_sparse_fields(self):
+        """Top-level fields the response renders, None for all of them."""
+        return None
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if settings.QUERY_OPTIMIZER_STRICT and args and "data" not in kwargs:
+            with forbid_lazy_loads():
+                serializer.data
+        return serializer
+
+    def handle_exception(self, exc):
+        if isinstance(exc, LazyLoadError):
+            raise exc
+        return super().handle_exception(exc)
@@ -0,0 +1,196 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+from .background import PeriodicTask
+from .websocket import socket_registry
+
+
+class InMemoryBroker:
+    """Single-process broker, events go straight to this process's sockets."""
+
+    def __init__(self, registry=None):
+        self.registry = registry or socket_registry
+        self._published = 0
+
+    def publish(self, user_ids, event):
+        """Publish ``event`` on the channel of every user in ``user_ids``."""
+        self._published += 1
+        self.registry.publish(user_ids, event)
+        return True
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def stats(self):
+        return {"published": self._published}
+
+
+class SQLiteBroker:
+    """Multi-process broker sharing events through a local SQLite file.
+
+    Events are delivered to sockets in the publishing process right away and
+    buffered for the other processes. A background task writes the buffer in
+    one transaction per batch and polls for rows written by other processes,
+    so a remote delivery takes at most about two ``poll_interval``. When the
+    buffer reaches ``max_pending`` the publisher writes it itself, which
+    throttles producers instead of dropping events. Rows older than
+    ``retention`` seconds are pruned.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS pubsub_event ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, "
+        "users TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS pubsub_event_created_idx ON pubsub_event (created_at)",
+    )
+
+    def __init__(self, registry=None, path=None, poll_interval=None, batch_size=None,
+                 max_pending=None, retention=None):
+        self.registry = registry or socket_registry
+        self.path = str(path or settings.PUBSUB_SQLITE_PATH)
+        self.batch_size = batch_size or settings.PUBSUB_BATCH_SIZE
+        self.max_pending = max_pending or settings.PUBSUB_MAX_PENDING
+        self.retention = settings.PUBSUB_RETENTION if retention is None else retention
+        self.origin = uuid.uuid4().hex
+        self.task = PeriodicTask(
+            "pubsub-sqlite",
+            settings.PUBSUB_POLL_INTERVAL if poll_interval is None else poll_interval,
+            self.tick)
+
+        self._pending = deque()
+        self._connection = None
+        self._cursor = None
+        self._pruned_at = 0.0
+        self._lock = threading.Lock()
+        self._stats = {
+            "published": 0,
+            "written": 0,
+            "batches": 0,
+            "throttled": 0,
+            "received": 0,
+            "pruned": 0,
+        }
+
+    def publish(self, user_ids, event):
+        """Publish ``event`` on the channel of every user in ``user_ids``."""
+        user_ids = sorted(set(user_ids))
+        payload = json.dumps(event, cls=DjangoJSONEncoder)
+        self.registry.send_text(user_ids, payload)
+
+        with self._lock:
+            self._pending.append((json.dumps(user_ids), payload, time.time()))
+            self._stats["published"] += 1
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._incr("throttled")
+            self.flush()
+        self.start()
+        return True
+
+    def start(self):
+        self.task.start()
+
+    def stop(self):
+        self.task.stop()
+        self.flush()
+
+    def tick(self):
+        self.flush()
+        self.poll()
+        if time.time() - self._pruned_at >= self.retention:
+            self.prune()
+
+    def flush(self):
+        """Write buffered events in batches of ``batch_size``, return the number written."""
+        written = 0
+        while True:
+            with self._lock:
+                batch = [self._pending.popleft() for _ in range(
+                    min(self.batch_size, len(self._pending)))]
+            if not batch:
+                return written
+            try:
+                with self._lock:
+                    connection = self._connect()
+                    with connection:
+                        connection.executemany(
+                            "INSERT INTO pubsub_event (origin, users, payload, created_at) "
+                            "VALUES (?, ?, ?, ?)",
+                            [(self.origin, *row) for row in batch])
+            except sqlite3.Error:
+                with self._lock:
+                    self._pending.extendleft(reversed(batch))
+                raise
+            written += len(batch)
+            with self._lock:
+                self._stats["written"] += len(batch)
+                self._stats["batches"] += 1
+
+    def poll(self):
+        """Deliver events written by other processes since the last poll."""
+        received = 0
+        while True:
+            with self._lock:
+                connection = self._connect()
+                rows = connection.execute(
+                    "SELECT id, origin, users, payload FROM pubsub_event "
+                    "WHERE id > ? ORDER BY id LIMIT ?",
+                    (self._cursor, self.batch_size)).fetchall()
+                if rows:
+                    self._cursor = rows[-1][0]
+            for _, origin, users, payload in rows:
+                if origin != self.origin:
+                    self.registry.send_text(json.loads(users), payload)
+                    received += 1
+            if len(rows) < self.batch_size:
+                break
+        self._incr("received", received)
+        return received
+
+    def prune(self):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                pruned = connection.execute(
+                    "DELETE FROM pubsub_event WHERE created_at < ?",
+                    (time.time() - self.retention,)).rowcount
+            self._pruned_at = time.time()
+            self._stats["pruned"] += pruned
+        return pruned
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "pending": len(self._pending)}
+
+    def _incr(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _connect(self):
+        # Called with the lock held, the connection is shared by all threads
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=5, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.schema:
+                connection.execute(statement)
+            # Only events published after this process attached are delivered
+            self._cursor = connection.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM pubsub_event").fetchone()[0]
+            self._connection = connection
+        return self._connection
+
+
+broker = import_string(settings.PUBSUB_BACKEND)()
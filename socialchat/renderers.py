@@ -0,0 +1,61 @@
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson, producing the same bytes.
+
+    Opt-in per request with ``Accept: application/json; encoder=orjson``,
+    it goes before JSONRenderer, which also matches that media type.
+
+    orjson writes compact, non-ASCII-escaped JSON like the default
+    JSONRenderer, dates and times are handed to DRF's encoder so they keep
+    its format and U+2028/U+2029 are escaped the same way. Floats that need
+    an exponent are spelled differently (``1e16`` against ``1e+16``), the
+    API's payloads carry none. Indented output, non-default JSON settings,
+    a missing orjson and anything orjson cannot encode fall back to
+    JSONRenderer.
+    """
+
+    media_type = "application/json; encoder=orjson"
+    format = "orjson"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if (orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data, default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Same escaping as JSONRenderer, these are line breaks to JavaScript
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack responses for ``Accept: application/msgpack``, values are encoded as in JSON."""
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+    encoder_class = JSONRenderer.encoder_class
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=self.encoder_class().default, use_bin_type=True)
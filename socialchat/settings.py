@@ -1,6 +1,8 @@
 
 from pathlib import Path
 import os
+import tempfile
+from importlib.util import find_spec
 from decouple import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,7 +25,16 @@ AUTH_USER_MODEL = "user_control.CustomUser"
 REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'socialchat.custom_auth.exception_handler_custom',
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
-    "PAGE_SIZE": 20
+    "PAGE_SIZE": 20,
+    # JSONRenderer answers plain JSON requests, orjson is used for
+    # "Accept: application/json; encoder=orjson" and MessagePack for
+    # "Accept: application/msgpack" when the optional msgpack is installed
+    "DEFAULT_RENDERER_CLASSES": [
+        "socialchat.renderers.ORJSONRenderer",
+        "rest_framework.renderers.JSONRenderer",
+        *(["socialchat.renderers.MessagePackRenderer"] if find_spec("msgpack") else []),
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
 
 
@@ -169,5 +180,125 @@ AWS_S3_OBJECT_PARAMETER = {
 
 DEFAULT_FILE_STORAGE = 'socialchat.storage_backends.MediaStorage'
 
-# Socket
-SOCKET_SERVER = config("SOCKET_SERVER")
+# Socket, the external server is optional when clients use the built-in websocket
+SOCKET_SERVER = config("SOCKET_SERVER", default="")
+WEBSOCKET_PATH = config("WEBSOCKET_PATH", default="/ws")
+WEBSOCKET_QUEUE_SIZE = config("WEBSOCKET_QUEUE_SIZE", default=256, cast=int)
+
+# Pub/sub fan-out to the sockets of every worker process, use
+# socialchat.pubsub.SQLiteBroker when running more than one worker
+PUBSUB_BACKEND = config(
+    "PUBSUB_BACKEND", default="socialchat.pubsub.InMemoryBroker")
+PUBSUB_SQLITE_PATH = config(
+    "PUBSUB_SQLITE_PATH", default=str(BASE_DIR / "pubsub.sqlite3"))
+PUBSUB_POLL_INTERVAL = config(
+    "PUBSUB_POLL_INTERVAL", default=0.05, cast=float)
+PUBSUB_BATCH_SIZE = config("PUBSUB_BATCH_SIZE", default=200, cast=int)
+PUBSUB_MAX_PENDING = config("PUBSUB_MAX_PENDING", default=5000, cast=int)
+PUBSUB_RETENTION = config("PUBSUB_RETENTION", default=60, cast=int)
+
+# Notification dispatch
+NOTIFICATION_WORKERS = config("NOTIFICATION_WORKERS", default=2, cast=int)
+NOTIFICATION_QUEUE_SIZE = config(
+    "NOTIFICATION_QUEUE_SIZE", default=10000, cast=int)
+NOTIFICATION_BATCH_SIZE = config(
+    "NOTIFICATION_BATCH_SIZE", default=50, cast=int)
+NOTIFICATION_BATCH_WAIT = config(
+    "NOTIFICATION_BATCH_WAIT", default=0.05, cast=float)
+NOTIFICATION_TIMEOUT = config("NOTIFICATION_TIMEOUT", default=2, cast=float)
+NOTIFICATION_MAX_RETRIES = config(
+    "NOTIFICATION_MAX_RETRIES", default=3, cast=int)
+NOTIFICATION_RETRY_BACKOFF = config(
+    "NOTIFICATION_RETRY_BACKOFF", default=0.2, cast=float)
+# POST pending notifications as one JSON array, the socket server must accept it
+NOTIFICATION_BATCHED = config("NOTIFICATION_BATCHED", default=False, cast=bool)
+
+# Authentication cache
+AUTH_TOKEN_CACHE_SIZE = config(
+    "AUTH_TOKEN_CACHE_SIZE", default=10000, cast=int)
+AUTH_USER_CACHE_SIZE = config("AUTH_USER_CACHE_SIZE", default=5000, cast=int)
+AUTH_USER_CACHE_TTL = config("AUTH_USER_CACHE_TTL", default=60, cast=int)
+
+# Background tasks
+BACKGROUND_TASKS = config("BACKGROUND_TASKS", default=True, cast=bool)
+# Fail requests whose serialization loads relations lazily, on in tests
+QUERY_OPTIMIZER_STRICT = config(
+    "QUERY_OPTIMIZER_STRICT", default=False, cast=bool)
+TEST_RUNNER = "socialchat.test_runner.TestRunner"
+
+# Presence
+PRESENCE_WRITE_INTERVAL = config(
+    "PRESENCE_WRITE_INTERVAL", default=60, cast=int)
+PRESENCE_FLUSH_INTERVAL = config(
+    "PRESENCE_FLUSH_INTERVAL", default=10, cast=int)
+PRESENCE_ONLINE_WINDOW = config(
+    "PRESENCE_ONLINE_WINDOW", default=300, cast=int)
+
+# Typeahead suggestions
+SUGGEST_REFRESH_INTERVAL = config(
+    "SUGGEST_REFRESH_INTERVAL", default=300, cast=int)
+SUGGEST_MAX_LIMIT = config("SUGGEST_MAX_LIMIT", default=20, cast=int)
+
+# Login sessions
+ACCESS_TOKEN_LIFETIME = config(
+    "ACCESS_TOKEN_LIFETIME", default=5 * 60, cast=int)
+REFRESH_TOKEN_LIFETIME = config(
+    "REFRESH_TOKEN_LIFETIME", default=365 * 24 * 60 * 60, cast=int)
+JWT_MAX_SESSIONS = config("JWT_MAX_SESSIONS", default=20, cast=int)
+JWT_SESSION_PURGE_INTERVAL = config(
+    "JWT_SESSION_PURGE_INTERVAL", default=60 * 60, cast=int)
+JWT_SESSION_PURGE_BATCH = config(
+    "JWT_SESSION_PURGE_BATCH", default=1000, cast=int)
+
+# Access token revocation
+REVOCATION_SYNC_INTERVAL = config(
+    "REVOCATION_SYNC_INTERVAL", default=5, cast=int)
+REVOCATION_PRUNE_INTERVAL = config(
+    "REVOCATION_PRUNE_INTERVAL", default=10 * 60, cast=int)
+REVOCATION_PURGE_BATCH = config(
+    "REVOCATION_PURGE_BATCH", default=1000, cast=int)
+REVOCATION_BLOOM_CAPACITY = config(
+    "REVOCATION_BLOOM_CAPACITY", default=100000, cast=int)
+REVOCATION_BLOOM_ERROR_RATE = config(
+    "REVOCATION_BLOOM_ERROR_RATE", default=0.001, cast=float)
+
+# Favorites
+FAVORITES_CACHE_SIZE = config("FAVORITES_CACHE_SIZE", default=5000, cast=int)
+FAVORITES_CACHE_TTL = config("FAVORITES_CACHE_TTL", default=300, cast=int)
+
+# Uploads
+UPLOAD_STREAMING = config("UPLOAD_STREAMING", default=True, cast=bool)
+UPLOAD_PART_SIZE = config(
+    "UPLOAD_PART_SIZE", default=8 * 1024 * 1024, cast=int)
+UPLOAD_MAX_CHUNK_SIZE = config(
+    "UPLOAD_MAX_CHUNK_SIZE", default=64 * 1024 * 1024, cast=int)
+UPLOAD_SPOOL_SIZE = config("UPLOAD_SPOOL_SIZE", default=1024 * 1024, cast=int)
+UPLOAD_STAGING_DIR = config(
+    "UPLOAD_STAGING_DIR", default=os.path.join(tempfile.gettempdir(), "socialchat-uploads"))
+UPLOAD_SESSION_TTL = config(
+    "UPLOAD_SESSION_TTL", default=24 * 60 * 60, cast=int)
+UPLOAD_SESSION_PURGE_INTERVAL = config(
+    "UPLOAD_SESSION_PURGE_INTERVAL", default=60 * 60, cast=int)
+PRESIGNED_UPLOAD_EXPIRY = config(
+    "PRESIGNED_UPLOAD_EXPIRY", default=15 * 60, cast=int)
+PRESIGNED_UPLOAD_MAX_SIZE = config(
+    "PRESIGNED_UPLOAD_MAX_SIZE", default=100 * 1024 * 1024, cast=int)
+
+# Image variants
+IMAGE_VARIANT_SIZES = config(
+    "IMAGE_VARIANT_SIZES", default="thumb:160,medium:720",
+    cast=lambda value: {key: int(edge) for key, edge in (
+        item.split(":") for item in value.split(",") if item)})
+IMAGE_VARIANT_QUALITY = config("IMAGE_VARIANT_QUALITY", default=82, cast=int)
+IMAGE_VARIANT_WORKERS = config("IMAGE_VARIANT_WORKERS", default=2, cast=int)
+IMAGE_VARIANT_PROCESSES = config(
+    "IMAGE_VARIANT_PROCESSES", default=2, cast=int)
+IMAGE_VARIANT_QUEUE_SIZE = config(
+    "IMAGE_VARIANT_QUEUE_SIZE", default=1000, cast=int)
+
+# Profile snapshots, any cache alias from CACHES (a shared one across workers)
+PROFILE_SNAPSHOT_CACHE = config("PROFILE_SNAPSHOT_CACHE", default="default")
+PROFILE_SNAPSHOT_TTL = config("PROFILE_SNAPSHOT_TTL", default=10 * 60, cast=int)
+
+# Opt-in row-at-a-time list rendering from .values(), for views with FastPathMixin
+FAST_PATH_READS = config("FAST_PATH_READS", default=False, cast=bool)
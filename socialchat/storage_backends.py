@@ -1,6 +1,32 @@
 from storages.backends.s3boto3 import S3Boto3Storage
+from django.core import signing
+from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
+
+LOCAL_UPLOAD_SALT = "socialchat.storage_backends.local-upload"
 
 
 class MediaStorage(S3Boto3Storage):
     location = 'media'
     file_overwrite = False
+
+    def presigned_upload(self, name, content_type, max_size, expires):
+        """A browser form POST that puts ``name`` straight into the bucket."""
+        key = self._normalize_name(self._clean_name(name))
+        post = self.bucket.meta.client.generate_presigned_post(
+            self.bucket_name, key,
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type},
+                        ["content-length-range", 1, max_size]],
+            ExpiresIn=expires)
+        return {"method": "POST", "url": post["url"], "fields": post["fields"]}
+
+
+class LocalMediaStorage(FileSystemStorage):
+    """Filesystem stand-in for MediaStorage, used by tests and benchmarks."""
+
+    def presigned_upload(self, name, content_type, max_size, expires):
+        """A signed PUT URL served by the local upload view, the expiry is checked there."""
+        token = signing.dumps(
+            {"name": name, "max_size": max_size}, salt=LOCAL_UPLOAD_SALT)
+        return {"method": "PUT", "url": reverse("local-upload", args=[token]), "fields": {}}
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """Disables periodic background threads, tests flush them explicitly.
+
+    Views also run with QUERY_OPTIMIZER_STRICT, so a response that loads
+    relations lazily fails its test.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._background_tasks = settings.BACKGROUND_TASKS
+        self._strict_queries = settings.QUERY_OPTIMIZER_STRICT
+        settings.BACKGROUND_TASKS = False
+        settings.QUERY_OPTIMIZER_STRICT = True
+
+    def teardown_test_environment(self, **kwargs):
+        settings.BACKGROUND_TASKS = self._background_tasks
+        settings.QUERY_OPTIMIZER_STRICT = self._strict_queries
+        super().teardown_test_environment(**kwargs)
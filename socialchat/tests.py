@@ -0,0 +1,330 @@
+import json
+import os
+import tempfile
+from unittest import skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from rest_framework.test import APITestCase
+
+from .optimizer import LazyLoadError, QueryOptimizerMixin, forbid_lazy_loads, get_query_plan
+from .management.commands.benchmark_api import ASYNC_ENDPOINTS, SCENARIOS, Benchmark, compare_reports
+from .pubsub import SQLiteBroker
+from .renderers import ORJSONRenderer, MessagePackRenderer, msgpack
+from .testing import UsersTestCase
+from .websocket import CLOSE_UNAUTHORIZED, socket_registry
+
+# Create your tests here.
+
+
+class TestBenchmark(APITestCase):
+
+    def test_small_run_reports_every_scenario(self):
+        report = Benchmark(users=5, messages=50, iterations=2).run()
+
+        self.assertEqual(report["config"]["messages"], 50)
+        self.assertEqual(set(report["scenarios"]), set(SCENARIOS))
+        for name, metrics in report["scenarios"].items():
+            self.assertEqual(metrics["iterations"], 2)
+            self.assertLessEqual(metrics["p50_ms"], metrics["p99_ms"])
+            # Suggestions are served from memory once the index is warm
+            if name != "profile_suggest":
+                self.assertGreaterEqual(metrics["queries_max"], 1)
+
+    def test_concurrency_compares_sync_and_async_views(self):
+        report = Benchmark(users=5, messages=20, iterations=2, concurrency=3,
+                           scenarios=("login",)).run()
+
+        self.assertEqual(set(report["throughput"]), set(ASYNC_ENDPOINTS))
+        for result in report["throughput"].values():
+            self.assertEqual(result["concurrency"], 3)
+            self.assertGreater(result["sync_rps"], 0)
+            self.assertGreater(result["async_rps"], 0)
+
+    def test_fast_path_comparison(self):
+        report = Benchmark(users=5, messages=60, iterations=3, hot_ratio=0.5,
+                           scenarios=(), fast_path=True).run()
+
+        result = report["fast_path"]
+        self.assertEqual(result["pages"], 3)
+        self.assertGreater(result["serializer_rps"], 0)
+        self.assertGreater(result["fast_path_rps"], 0)
+
+    def test_compare_reports(self):
+        baseline = {"scenarios": {"login": {
+            "p50_ms": 10, "p99_ms": 20, "queries_p50": 4, "queries_max": 4}}}
+        current = {"scenarios": {"login": {
+            "p50_ms": 5, "p99_ms": 20, "queries_p50": 2, "queries_max": 4}}}
+
+        rows = compare_reports(baseline, current)
+
+        self.assertIn(("login", "p50_ms", 10, 5, -50.0), rows)
+        self.assertIn(("login", "queries_p50", 4, 2, -50.0), rows)
+
+
+class TestWebSocket(UsersTestCase):
+    message_url = "/message/message"
+
+    def setUp(self):
+        from message_control import views
+        from message_control.dispatch import NotificationDispatcher
+
+        # Only the built-in socket is under test here
+        original, views.dispatcher = views.dispatcher, NotificationDispatcher(url="")
+        self.addCleanup(setattr, views, "dispatcher", original)
+        super().setUp()
+
+    def connect(self, token):
+        from .asgi import application
+
+        return ApplicationCommunicator(application, {
+            "type": "websocket",
+            "path": "/ws",
+            "query_string": f"token={token}".encode(),
+            "headers": [],
+        })
+
+    def post_message(self, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.message_url, data={
+                "sender_id": self.sender.id, "receiver_id": self.receiver.id, "message": text},
+                **self.bearer)
+        self.assertEqual(response.status_code, 201)
+
+    def test_rejects_invalid_token(self):
+        async def scenario():
+            socket = self.connect("not-a-token")
+            await socket.send_input({"type": "websocket.connect"})
+            return await socket.receive_output(5)
+
+        self.assertEqual(async_to_sync(scenario)(), {
+            "type": "websocket.close", "code": CLOSE_UNAUTHORIZED})
+
+    def test_message_is_pushed_to_both_participants(self):
+        async def scenario():
+            sockets = [self.connect(self.tokens["UserB"]),
+                       self.connect(self.tokens["UserA"])]
+            for socket in sockets:
+                await socket.send_input({"type": "websocket.connect"})
+                self.assertEqual((await socket.receive_output(5))["type"], "websocket.accept")
+            self.assertEqual(socket_registry.connected(self.receiver.id), 1)
+
+            await sync_to_async(self.post_message)("pushed")
+            events = [json.loads((await socket.receive_output(5))["text"])
+                      for socket in sockets]
+
+            await sockets[0].send_input({"type": "websocket.receive", "text": "ping"})
+            pong = json.loads((await sockets[0].receive_output(5))["text"])
+
+            for socket in sockets:
+                await socket.send_input({"type": "websocket.disconnect", "code": 1000})
+                await socket.wait(5)
+            return events, pong
+
+        events, pong = async_to_sync(scenario)()
+
+        for event in events:
+            self.assertEqual(event["type"], "message")
+            self.assertEqual(event["data"]["message"], "pushed")
+            self.assertEqual(event["data"]["receiver"]["user"]["id"], self.receiver.id)
+        self.assertEqual(pong, {"type": "pong"})
+        self.assertEqual(socket_registry.connected(self.receiver.id), 0)
+
+
+class RecordingRegistry:
+    def __init__(self):
+        self.received = []
+
+    def send_text(self, user_ids, text):
+        self.received.append((list(user_ids), json.loads(text)))
+        return len(user_ids)
+
+
+class TestSQLiteBroker(APITestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "pubsub.sqlite3")
+
+    def create_broker(self, **kwargs):
+        broker = SQLiteBroker(registry=RecordingRegistry(), path=self.path,
+                              poll_interval=0, **kwargs)
+        self.addCleanup(lambda: broker._connection and broker._connection.close())
+        return broker
+
+    def test_fans_out_between_processes(self):
+        first, second = self.create_broker(), self.create_broker()
+        second.poll()
+
+        first.publish([2, 1, 2], {"type": "message", "message": "hello"})
+        self.assertEqual(first.registry.received, [
+            ([1, 2], {"type": "message", "message": "hello"})])
+        self.assertEqual(second.poll(), 0)
+
+        self.assertEqual(first.flush(), 1)
+        self.assertEqual(second.poll(), 1)
+        self.assertEqual(second.registry.received, first.registry.received)
+
+        # Own events are not delivered twice
+        self.assertEqual(first.poll(), 0)
+        self.assertEqual(len(first.registry.received), 1)
+
+    def test_batches_and_throttles_publishers(self):
+        first = self.create_broker(batch_size=2, max_pending=3)
+        second = self.create_broker(batch_size=2)
+        second.poll()
+
+        for index in range(3):
+            first.publish([1], {"index": index})
+        stats = first.stats()
+        self.assertEqual((stats["written"], stats["batches"]), (3, 2))
+        self.assertEqual((stats["throttled"], stats["pending"]), (1, 0))
+
+        self.assertEqual(second.poll(), 3)
+        self.assertEqual([event["index"] for _, event in second.registry.received],
+                         [0, 1, 2])
+
+    def test_prunes_old_events(self):
+        broker = self.create_broker(retention=0)
+        broker.publish([1], {"index": 0})
+        broker.flush()
+        self.assertEqual(broker.prune(), 1)
+
+
+class TestQueryOptimizer(APITestCase):
+
+    def setUp(self):
+        from message_control.models import Message
+        from user_control.models import CustomUser, UserProfile
+
+        users = [CustomUser.objects.create_user(username=name, password="password", email=f"{name}@gmail.com")
+                 for name in ("UserA", "UserB")]
+        for user in users:
+            UserProfile.objects.create(user=user, first_name=user.username, last_name="",
+                                       caption="", about="")
+        self.message = Message.objects.create(sender=users[0], receiver=users[1], message="hi")
+
+    def test_plan_follows_nested_and_method_fields(self):
+        from message_control.models import Message
+        from message_control.serializers import MessageSerializer
+
+        plan = get_query_plan(MessageSerializer, Message)
+        self.assertEqual(plan.select, {
+            "sender", "sender__user_profile", "sender__user_profile__profile_picture",
+            "receiver", "receiver__user_profile", "receiver__user_profile__profile_picture"})
+        self.assertEqual(sorted(plan.prefetch), [
+            "message_attachments", "receiver__groups", "receiver__user_permissions",
+            "sender__groups", "sender__user_permissions"])
+        # The attachment is joined inside the attachment prefetch
+        self.assertEqual(plan.prefetch["message_attachments"][1].select, {"attachment"})
+
+    def test_strict_mode_rejects_lazy_loads(self):
+        from rest_framework import serializers
+        from rest_framework.test import APIRequestFactory
+        from rest_framework.viewsets import ReadOnlyModelViewSet
+        from message_control.models import Message
+
+        class SenderNameSerializer(serializers.ModelSerializer):
+            sender_name = serializers.SerializerMethodField()
+
+            class Meta:
+                model = Message
+                fields = ("id", "sender_name")
+
+            def get_sender_name(self, obj):
+                return obj.sender.username
+
+        class SenderNameView(QueryOptimizerMixin, ReadOnlyModelViewSet):
+            queryset = Message.objects.all()
+            serializer_class = SenderNameSerializer
+            authentication_classes = ()
+            permission_classes = ()
+
+        view = SenderNameView.as_view({"get": "list"})
+        with self.assertRaisesMessage(LazyLoadError, "sender"):
+            view(APIRequestFactory().get("/"))
+
+        # Declaring the source lets the optimizer join it
+        SenderNameSerializer.Meta.method_field_sources = {"sender_name": ("sender", serializers.Serializer)}
+        get_query_plan.cache_clear()
+        response = view(APIRequestFactory().get("/"))
+        self.assertEqual(response.data["results"][0]["sender_name"], "UserA")
+
+    def test_forbid_lazy_loads_allows_explicit_queries(self):
+        from message_control.models import Message
+
+        message = Message.objects.get(id=self.message.id)
+        with forbid_lazy_loads():
+            self.assertEqual(Message.objects.count(), 1)
+            with self.assertRaises(LazyLoadError):
+                message.sender
+
+
+class TestRenderers(APITestCase):
+    payload = {
+        "text": "caf\u00e9 \u2028\u2029 \x01 \"quoted\" </script>",
+        "items": [1, -2.5, True, None, (3, 4)],
+        "nested": {"when": None, 7: "int key"},
+    }
+
+    def setUp(self):
+        import datetime
+        import decimal
+        import uuid
+        from collections import OrderedDict
+        from django.utils.translation import gettext_lazy
+
+        self.data = OrderedDict(self.payload, **{
+            "created_at": datetime.datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc),
+            "day": datetime.date(2026, 1, 2),
+            "id": uuid.UUID(int=7),
+            "price": decimal.Decimal("1.50"),
+            "label": gettext_lazy("Lazy"),
+        })
+
+    def test_orjson_output_matches_json_renderer(self):
+        from rest_framework.renderers import JSONRenderer
+
+        expected = JSONRenderer().render(self.data)
+        self.assertEqual(ORJSONRenderer().render(self.data), expected)
+        self.assertIn(b"\\u2028\\u2029", expected)
+        self.assertEqual(ORJSONRenderer().render(None), b"")
+
+        # Indented output and values orjson rejects go through JSONRenderer
+        context = {"indent": 2}
+        self.assertEqual(ORJSONRenderer().render(self.data, renderer_context=context),
+                         JSONRenderer().render(self.data, renderer_context=context))
+        huge = {"value": 2 ** 70}
+        self.assertEqual(ORJSONRenderer().render(huge), JSONRenderer().render(huge))
+
+    def test_accept_header_selects_renderer(self):
+        from user_control.models import CustomUser
+
+        payload = {"username": "UserA", "password": "UserApassword", "email": "UserA@gmail.com"}
+        CustomUser.objects.create_user(**payload)
+        access = self.client.post("/user/login", data=payload).json()["access"]
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {access}"}
+
+        from rest_framework.renderers import JSONRenderer
+
+        # JSONRenderer stays the default, orjson is asked for explicitly
+        for accept in ("application/json", "*/*"):
+            response = self.client.get("/message/message", HTTP_ACCEPT=accept, **headers)
+            self.assertEqual(response["Content-Type"], "application/json")
+            self.assertIs(type(response.accepted_renderer), JSONRenderer)
+        expected = response.content
+        response = self.client.get(
+            "/message/message", HTTP_ACCEPT="application/json; encoder=orjson", **headers)
+        self.assertIsInstance(response.accepted_renderer, ORJSONRenderer)
+        self.assertEqual(response.content, expected)
+        response = self.client.get("/message/message", HTTP_ACCEPT="text/html", **headers)
+        self.assertEqual(response["Content-Type"], "text/html; charset=utf-8")
+
+    @skipUnless(msgpack, "msgpack is not installed")
+    def test_msgpack(self):
+        from rest_framework.renderers import JSONRenderer
+
+        packed = MessagePackRenderer().render(self.data)
+        self.assertEqual(msgpack.unpackb(packed, strict_map_key=False),
+                         json.loads(JSONRenderer().render(self.data)) | {"nested": {"when": None, 7: "int key"}})
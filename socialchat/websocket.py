@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .custom_auth import authenticate_token
+
+logger = logging.getLogger(__name__)
+
+# Application close codes, 4000-4999 are free for private use
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NOT_FOUND = 4404
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class Connection:
+    """One accepted socket, fed through a bounded queue on its own event loop."""
+
+    def __init__(self, user_id, max_queue):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_queue)
+
+    def push(self, text):
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            # A client that cannot keep up is disconnected instead of
+            # buffering without bound, it reloads history on reconnect
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class ConnectionRegistry:
+    """Maps user ids to their open sockets in this process.
+
+    ``publish()`` is safe to call from any thread, events are handed to each
+    socket's event loop and never block the caller.
+    """
+
+    def __init__(self):
+        self._connections = defaultdict(set)
+        self._lock = threading.Lock()
+        self._stats = {"published": 0, "delivered": 0}
+
+    def add(self, connection):
+        with self._lock:
+            self._connections[connection.user_id].add(connection)
+
+    def remove(self, connection):
+        with self._lock:
+            connections = self._connections.get(connection.user_id)
+            if connections is None:
+                return
+            connections.discard(connection)
+            if not connections:
+                del self._connections[connection.user_id]
+
+    def connected(self, user_id):
+        with self._lock:
+            return len(self._connections.get(user_id, ()))
+
+    def publish(self, user_ids, event):
+        """Send ``event`` to every socket of ``user_ids``, return the number of sockets reached."""
+        return self.send_text(user_ids, json.dumps(event, cls=DjangoJSONEncoder))
+
+    def send_text(self, user_ids, text):
+        with self._lock:
+            targets = [connection for user_id in set(user_ids)
+                       for connection in self._connections.get(user_id, ())]
+            self._stats["published"] += 1
+        if not targets:
+            return 0
+
+        delivered = 0
+        for connection in targets:
+            try:
+                connection.loop.call_soon_threadsafe(connection.push, text)
+                delivered += 1
+            except RuntimeError:
+                # The loop is gone, the socket can no longer be reached
+                self.remove(connection)
+        with self._lock:
+            self._stats["delivered"] += delivered
+        return delivered
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "users": len(self._connections),
+                "connections": sum(map(len, self._connections.values())),
+            }
+
+
+socket_registry = ConnectionRegistry()
+
+
+def get_token(scope):
+    """Access token from ``?token=`` or a ``Bearer`` Authorization header."""
+    query = parse_qs(scope.get("query_string", b"").decode())
+    if query.get("token"):
+        return query["token"][0]
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            return value[7:].decode()
+    return None
+
+
+async def forward(connection, send):
+    while True:
+        text = await connection.queue.get()
+        if text is None:
+            await send({"type": "websocket.close", "code": CLOSE_TRY_AGAIN_LATER})
+            return
+        await send({"type": "websocket.send", "text": text})
+
+
+async def websocket_application(scope, receive, send):
+    """Authenticated event stream at ``settings.WEBSOCKET_PATH``.
+
+    The client connects with its access token and receives JSON events
+    published for its user, a ``ping`` text frame is answered with a pong.
+    """
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+
+    if scope.get("path") != settings.WEBSOCKET_PATH:
+        await send({"type": "websocket.close", "code": CLOSE_NOT_FOUND})
+        return
+
+    token = get_token(scope)
+    user = await authenticate_token(token) if token else None
+    if user is None:
+        await send({"type": "websocket.close", "code": CLOSE_UNAUTHORIZED})
+        return
+
+    from .pubsub import broker
+
+    await send({"type": "websocket.accept"})
+    connection = Connection(user.id, settings.WEBSOCKET_QUEUE_SIZE)
+    socket_registry.add(connection)
+    broker.start()
+    writer = asyncio.ensure_future(forward(connection, send))
+    try:
+        while True:
+            event = await receive()
+            if event["type"] == "websocket.disconnect":
+                break
+            if event["type"] == "websocket.receive" and event.get("text") == "ping":
+                connection.push(json.dumps({"type": "pong"}))
+    finally:
+        socket_registry.remove(connection)
+        writer.cancel()
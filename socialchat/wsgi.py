@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'socialchat.settings')
 
 application = get_wsgi_application()
+
+# Load the typeahead index and revoked tokens before the first request needs them
+from user_control.revocation import revocation_list  # noqa: E402
+from user_control.suggest import suggest_index  # noqa: E402
+
+suggest_index.warm()
+revocation_list.warm()
@@ -0,0 +1,33 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.response import Response
+
+from socialchat.async_views import async_api_view, get_view, render
+from .suggest import suggest_index
+from .views import UserProfileView
+
+
+@async_api_view(("GET",))
+async def profiles(request):
+    view = get_view(UserProfileView, "list", request)
+    # Search and favorites may query while the queryset is built
+    queryset = await sync_to_async(lambda: view.filter_queryset(view.get_queryset()))()
+    page = await sync_to_async(view.paginate_queryset)(queryset)
+    unseen_counts = await sync_to_async(view.get_unseen_counts)(page)
+    serializer = view.serializer_class(
+        page, many=True, context={**view.get_serializer_context(), "unseen_counts": unseen_counts})
+    data = await sync_to_async(lambda: serializer.data)()
+    return render(view.get_paginated_response(data))
+
+
+@async_api_view(("GET",))
+async def suggest(request):
+    # Answered from memory on the event loop once the index is loaded
+    if not suggest_index.loaded:
+        await sync_to_async(suggest_index.warm)()
+    try:
+        limit = int(request.GET.get("limit", 10))
+    except ValueError:
+        limit = 10
+    limit = min(max(limit, 1), settings.SUGGEST_MAX_LIMIT)
+    return render(Response({"results": suggest_index.suggest(request.GET.get("q", ""), limit)}))
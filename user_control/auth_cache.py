@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import CustomUser
+
+
+class LRUCache:
+    """Thread-safe LRU mapping whose entries carry their own expiry time."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class AuthCache:
+    """Caches verified access tokens and the users they resolve to.
+
+    Tokens are keyed by their signature segment and never outlive their
+    ``exp`` claim. Users are stored as raw field values and rebuilt on every
+    hit, so per-request state such as cached relations never leaks between
+    requests. User entries are evicted whenever the user is saved or deleted.
+    """
+
+    def __init__(self, max_tokens=None, max_users=None, user_ttl=None):
+        self.tokens = LRUCache(max_tokens or settings.AUTH_TOKEN_CACHE_SIZE)
+        self.users = LRUCache(max_users or settings.AUTH_USER_CACHE_SIZE)
+        self.user_ttl = settings.AUTH_USER_CACHE_TTL if user_ttl is None else user_ttl
+
+    def get_payload(self, token):
+        signature = token.rsplit(".", 1)[-1]
+        entry = self.tokens.get(signature)
+        if entry is None or entry[0] != token:
+            return None
+        return entry[1]
+
+    def set_payload(self, token, payload):
+        exp = payload.get("exp")
+        if not exp:
+            return
+        signature = token.rsplit(".", 1)[-1]
+        self.tokens.set(signature, (token, payload), exp)
+
+    def get_user(self, user_id):
+        values = self.users.get(user_id)
+        if values is not None:
+            return CustomUser.from_db(CustomUser.objects.db, self._field_names(), values)
+
+        try:
+            user = CustomUser.objects.get(id=user_id)
+        except CustomUser.DoesNotExist:
+            return None
+        values = tuple(getattr(user, name) for name in self._field_names())
+        self.users.set(user_id, values, time.time() + self.user_ttl)
+        return user
+
+    def invalidate_user(self, user_id):
+        self.users.delete(user_id)
+
+    def clear(self):
+        self.tokens.clear()
+        self.users.clear()
+
+    def stats(self):
+        return {"tokens": self.tokens.stats(), "users": self.users.stats()}
+
+    @staticmethod
+    def _field_names():
+        return [field.attname for field in CustomUser._meta.concrete_fields]
+
+
+auth_cache = AuthCache()
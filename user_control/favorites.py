@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+
+from .auth_cache import LRUCache
+from .models import Favorite
+
+
+class FavoritesCache:
+    """Per-user sets of favoured user ids, kept in memory.
+
+    Sets are loaded with one query on a miss and evicted whenever the user's
+    favourites change in this process. The TTL bounds how long changes made
+    by other workers stay invisible.
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self.sets = LRUCache(max_size or settings.FAVORITES_CACHE_SIZE)
+        self.ttl = settings.FAVORITES_CACHE_TTL if ttl is None else ttl
+
+    def get(self, user_id):
+        favorites = self.sets.get(user_id)
+        if favorites is None:
+            favorites = frozenset(Favorite.favorite.through.objects.filter(
+                favorite__user_id=user_id).values_list("customuser_id", flat=True))
+            self.sets.set(user_id, favorites, time.time() + self.ttl)
+        return favorites
+
+    def invalidate(self, user_id):
+        self.sets.delete(user_id)
+
+    def clear(self):
+        self.sets.clear()
+
+    def stats(self):
+        return self.sets.stats()
+
+    def boost(self, queryset, user_id, *ordering):
+        """Order ``queryset`` with the user's favourites first, then by ``ordering``."""
+        favorites = self.get(user_id)
+        if not favorites:
+            return queryset.order_by(*ordering) if ordering else queryset
+
+        ordering = ordering or queryset.query.order_by or queryset.model._meta.ordering
+        return queryset.annotate(is_favorite=Case(
+            When(user_id__in=favorites, then=Value(1)),
+            default=Value(0), output_field=IntegerField(),
+        )).order_by("-is_favorite", *ordering)
+
+
+favorites_cache = FavoritesCache()
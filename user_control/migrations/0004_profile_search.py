@@ -0,0 +1,42 @@
+# Generated by Django 4.0.5 on 2026-10-18 11:38
+
+from django.db import DatabaseError, migrations
+
+
+def create_search_table(apps, schema_editor):
+    # FTS5 with the trigram tokenizer needs SQLite 3.34+, other databases
+    # and older builds keep using the LIKE based search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE user_control_profilesearch USING fts5("
+            "username, first_name, last_name, email, tokenize = 'trigram')")
+    except DatabaseError:
+        return
+    schema_editor.execute(
+        "INSERT INTO user_control_profilesearch (rowid, username, first_name, last_name, email) "
+        "SELECT p.id, u.username, p.first_name, p.last_name, u.email "
+        "FROM user_control_userprofile p "
+        "INNER JOIN user_control_customuser u ON u.id = p.user_id")
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            "DROP TABLE IF EXISTS user_control_profilesearch")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_control', '0003_rename_emails_customuser_email'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='userprofile',
+            options={'ordering': ('created_at',)},
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
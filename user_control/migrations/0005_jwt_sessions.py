@@ -0,0 +1,36 @@
+# Generated by Django 4.0.5 on 2026-10-18 12:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+    # Stored rows hold raw tokens without a session id, they cannot be
+    # carried over and users sign in again
+
+    dependencies = [
+        ('user_control', '0004_profile_search'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='Jwt',
+        ),
+        migrations.CreateModel(
+            name='Jwt',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('device', models.CharField(blank=True, default='', max_length=255)),
+                ('refresh_digest', models.CharField(max_length=64, unique=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'updated_at'], name='jwt_user_sessions_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.5 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_control', '0005_jwt_sessions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('revoked_at', models.FloatField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -1,3 +1,7 @@
+import hashlib
+import uuid
+from datetime import timedelta
+
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.utils import timezone
@@ -81,10 +85,77 @@ class Favorite(models.Model):
         ordering = ("created_at",)
 
 
+class ExpiringManager(models.Manager):
+    """Manager of models with an indexed ``expires_at``."""
+
+    def purge_expired(self, batch_size=1000):
+        """Delete rows past ``expires_at`` in batches of ``batch_size``, keeping each transaction short."""
+        purged = 0
+        while True:
+            batch = list(self.filter(expires_at__lte=timezone.now()).values_list(
+                "pk", flat=True)[:batch_size])
+            if batch:
+                purged += self.filter(pk__in=batch).delete()[0]
+            if len(batch) < batch_size:
+                return purged
+
+
+class JwtManager(ExpiringManager):
+
+    @staticmethod
+    def digest(refresh):
+        """Fixed length lookup key for a refresh token, the token itself is never stored."""
+        if isinstance(refresh, str):
+            refresh = refresh.encode()
+        return hashlib.sha256(refresh).hexdigest()
+
+    def rotate(self, session_id, user_id, refresh, new_refresh, lifetime):
+        """Swap ``refresh`` for ``new_refresh`` in one UPDATE, False when the session is gone or the token is stale."""
+        now = timezone.now()
+        return bool(self.filter(
+            id=session_id, user_id=user_id,
+            refresh_digest=self.digest(refresh), expires_at__gt=now,
+        ).update(refresh_digest=self.digest(new_refresh),
+                 expires_at=now + timedelta(seconds=lifetime), updated_at=now))
+
+    def trim(self, user_id, keep):
+        """Delete all but the ``keep`` most recently used sessions of a user."""
+        stale = list(self.filter(user_id=user_id).order_by(
+            "-updated_at", "-id").values_list("id", flat=True)[keep:])
+        if stale:
+            self.filter(id__in=stale).delete()
+        return len(stale)
+
+
 class Jwt(models.Model):
-    user = models.OneToOneField(
-        CustomUser, related_name="login_user", on_delete=models.CASCADE)
-    access = models.TextField()
-    refresh = models.TextField()
+    """One login session per device, identified by the digest of its current refresh token."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        CustomUser, related_name="sessions", on_delete=models.CASCADE)
+    device = models.CharField(max_length=255, blank=True, default="")
+    refresh_digest = models.CharField(max_length=64, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = JwtManager()
+
+    def __str__(self):
+        return f"Session {self.id} of {self.user_id}"
+
+    class Meta:
+        indexes = (
+            models.Index(fields=("user", "updated_at"), name="jwt_user_sessions_idx"),
+        )
+
+
+class RevokedToken(models.Model):
+    """A revoked access token id, or ``user:<id>`` for all tokens of a user issued before ``revoked_at``."""
+    key = models.CharField(max_length=64, unique=True)
+    revoked_at = models.FloatField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = ExpiringManager()
+
+    def __str__(self):
+        return self.key
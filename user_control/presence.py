@@ -0,0 +1,94 @@
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from socialchat.background import PeriodicTask
+from .models import CustomUser
+
+
+class PresenceTracker:
+    """Tracks when users were last seen without writing on every request.
+
+    ``touch()`` only records the time in memory. A user is marked dirty at
+    most once per ``write_interval`` and dirty users are written in bulk by
+    a background flusher, so ``CustomUser.is_online`` lags memory by at most
+    ``write_interval + flush_interval`` seconds.
+    """
+
+    def __init__(self, write_interval=None, flush_interval=None, online_window=None):
+        self.write_interval = settings.PRESENCE_WRITE_INTERVAL if write_interval is None else write_interval
+        self.online_window = settings.PRESENCE_ONLINE_WINDOW if online_window is None else online_window
+        self.flusher = PeriodicTask(
+            "presence-flusher",
+            settings.PRESENCE_FLUSH_INTERVAL if flush_interval is None else flush_interval,
+            self.flush)
+
+        self._last_seen = {}
+        self._written = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def touch(self, user_id, now=None):
+        now = now or timezone.now()
+        with self._lock:
+            self._last_seen[user_id] = now
+            written = self._written.get(user_id)
+            if written is None or (now - written).total_seconds() >= self.write_interval:
+                self._dirty.add(user_id)
+        self.flusher.start()
+
+    def flush(self):
+        with self._lock:
+            pending = {user_id: self._last_seen[user_id]
+                       for user_id in self._dirty}
+            self._dirty.clear()
+        if not pending:
+            return 0
+
+        try:
+            CustomUser.objects.bulk_update(
+                [CustomUser(id=user_id, is_online=last_seen)
+                 for user_id, last_seen in pending.items()],
+                ["is_online"], batch_size=500)
+        except Exception:
+            with self._lock:
+                self._dirty.update(pending)
+            raise
+
+        cutoff = timezone.now() - timedelta(seconds=self.online_window)
+        with self._lock:
+            self._written.update(pending)
+            for user_id, last_seen in list(self._last_seen.items()):
+                if last_seen < cutoff and user_id not in self._dirty:
+                    self._last_seen.pop(user_id)
+                    self._written.pop(user_id, None)
+        return len(pending)
+
+    def clear(self):
+        with self._lock:
+            self._last_seen.clear()
+            self._written.clear()
+            self._dirty.clear()
+
+    def last_seen(self, user_id):
+        return self._last_seen.get(user_id)
+
+    def online_user_ids(self, user_ids=None):
+        """Return the ids seen within the online window, optionally restricted to ``user_ids``."""
+        cutoff = timezone.now() - timedelta(seconds=self.online_window)
+        with self._lock:
+            online = {user_id for user_id, last_seen in self._last_seen.items()
+                      if last_seen >= cutoff}
+
+        queryset = CustomUser.objects.filter(is_online__gte=cutoff)
+        if user_ids is not None:
+            user_ids = set(user_ids)
+            online &= user_ids
+            queryset = queryset.filter(id__in=user_ids)
+        online.update(queryset.values_list("id", flat=True))
+        return online
+
+
+presence = PresenceTracker()
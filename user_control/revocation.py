@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+
+from socialchat.background import PeriodicTask
+from .models import RevokedToken
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed size set membership test with false positives but no false negatives."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing, k positions from the two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + index * second) % self.size for index in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationList:
+    """Revoked access tokens, checked in memory on every authenticated request.
+
+    Entries are either a token id (``jti``), revoking that token, or
+    ``user:<id>``, revoking every token of the user issued before the entry.
+    A Bloom filter answers the common "not revoked" case, hits are confirmed
+    against an exact dict. Revocations are written to ``RevokedToken`` and
+    picked up by other workers every ``sync_interval`` seconds, expired
+    entries are pruned from memory and the table.
+    """
+
+    def __init__(self, capacity=None, error_rate=None, sync_interval=None):
+        self.capacity = capacity or settings.REVOCATION_BLOOM_CAPACITY
+        self.error_rate = error_rate or settings.REVOCATION_BLOOM_ERROR_RATE
+        self.syncer = PeriodicTask(
+            "token-revocation-sync",
+            settings.REVOCATION_SYNC_INTERVAL if sync_interval is None else sync_interval,
+            self.tick)
+
+        self._lock = threading.RLock()
+        self._reset()
+        self._stats = {"checks": 0, "filter_hits": 0, "revoked_hits": 0}
+
+    def _reset(self):
+        self._entries = {}
+        self._filter = BloomFilter(self.capacity, self.error_rate)
+        self._cursor = 0
+        self._pruned_at = time.time()
+        self._loaded = False
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def warm(self):
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                self.sync()
+            except DatabaseError:
+                logger.warning("Token revocation list could not be loaded", exc_info=True)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def revoke(self, key, expires_at, revoked_at=None):
+        """Revoke ``key`` until ``expires_at`` (a unix timestamp) in every worker."""
+        revoked_at = time.time() if revoked_at is None else revoked_at
+        try:
+            # A repeated revocation is written as a new row, so that workers
+            # syncing past the old row's id still see it
+            with transaction.atomic():
+                RevokedToken.objects.filter(key=key).delete()
+                RevokedToken.objects.create(
+                    key=key, revoked_at=revoked_at,
+                    expires_at=datetime.fromtimestamp(expires_at, timezone.utc))
+        except IntegrityError:
+            pass
+        self._add(key, revoked_at, expires_at)
+
+    def revoke_token(self, payload):
+        return self.revoke(payload["jti"], payload["exp"])
+
+    def revoke_user(self, user_id):
+        """Revoke every access token of ``user_id`` issued until now."""
+        return self.revoke(f"user:{user_id}", time.time() + settings.ACCESS_TOKEN_LIFETIME)
+
+    def is_revoked(self, payload):
+        if not self._loaded:
+            self.warm()
+        self._stats["checks"] += 1
+        for key in (payload.get("jti"), f"user:{payload.get('user_id')}"):
+            if key is None or key not in self._filter:
+                continue
+            self._stats["filter_hits"] += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            revoked_at = entry[0]
+            if key.startswith("user:") and payload.get("iat", 0) >= revoked_at:
+                continue
+            self._stats["revoked_hits"] += 1
+            return True
+        return False
+
+    def sync(self):
+        """Load revocations written since the last sync, by any worker."""
+        rows = list(RevokedToken.objects.filter(id__gt=self._cursor).order_by("id").values_list(
+            "id", "key", "revoked_at", "expires_at"))
+        with self._lock:
+            for row_id, key, revoked_at, expires_at in rows:
+                self._add(key, revoked_at, expires_at.timestamp())
+                self._cursor = max(self._cursor, row_id)
+            self._loaded = True
+        self.syncer.start()
+        return len(rows)
+
+    def prune(self):
+        """Drop expired entries, rebuilding the filter since bits cannot be cleared."""
+        now = time.time()
+        with self._lock:
+            entries = {key: entry for key, entry in self._entries.items() if entry[1] > now}
+            pruned = len(self._entries) - len(entries)
+            capacity = self.capacity
+            while capacity < len(entries):
+                capacity *= 2
+            bloom = BloomFilter(capacity, self.error_rate)
+            for key in entries:
+                bloom.add(key)
+            self._entries, self._filter, self._pruned_at = entries, bloom, now
+        RevokedToken.objects.purge_expired(settings.REVOCATION_PURGE_BATCH)
+        return pruned
+
+    def tick(self):
+        self.sync()
+        if time.time() - self._pruned_at >= settings.REVOCATION_PRUNE_INTERVAL:
+            self.prune()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries),
+                    "filter_bytes": len(self._filter.bits), "cursor": self._cursor}
+
+    def _add(self, key, revoked_at, expires_at):
+        with self._lock:
+            current = self._entries.get(key)
+            if current is None:
+                self._filter.add(key)
+            elif current[0] > revoked_at:
+                return
+            self._entries[key] = (revoked_at, expires_at)
+
+
+revocation_list = RevocationList()
@@ -0,0 +1,72 @@
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+TABLE = "user_control_profilesearch"
+
+# One row per profile, rowid = UserProfile.id
+ROW_QUERY = (
+    "SELECT p.id, u.username, p.first_name, p.last_name, u.email "
+    "FROM user_control_userprofile p "
+    "INNER JOIN user_control_customuser u ON u.id = p.user_id"
+)
+
+
+class ProfileSearchIndex:
+    """Trigram FTS5 index over username, names and email of every profile.
+
+    The trigram tokenizer matches arbitrary substrings, so it answers the same
+    case-insensitive "contains" question as the old ``__icontains`` chain,
+    but through the index and with bm25 ranking. Terms shorter than three
+    characters cannot be matched by trigrams, ``search`` returns None for
+    those and on databases without FTS5 so callers fall back to a LIKE scan.
+    """
+    min_term_length = 3
+
+    def __init__(self):
+        self._available = None
+
+    def available(self):
+        if self._available is None:
+            self._available = connection.vendor == "sqlite" and TABLE in connection.introspection.table_names()
+        return self._available
+
+    def search(self, queryset, terms):
+        if not terms or not self.available() or min(map(len, terms)) < self.min_term_length:
+            return None
+
+        expression = " AND ".join(
+            '"%s"' % term.replace('"', '""') for term in terms)
+        meta = queryset.model._meta
+        profile_id = f"{connection.ops.quote_name(meta.db_table)}.{connection.ops.quote_name(meta.pk.column)}"
+        matches = RawSQL(f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s", [expression])
+        # Only evaluated for matching rows, each lookup seeks the index by rowid
+        rank = RawSQL(
+            f"SELECT rank FROM {TABLE} WHERE {TABLE} MATCH %s AND rowid = {profile_id}", [expression])
+        return queryset.filter(id__in=matches).annotate(search_rank=rank).order_by("search_rank", "id")
+
+    def update_profile(self, profile_id):
+        self._execute(
+            f"INSERT OR REPLACE INTO {TABLE} (rowid, username, first_name, last_name, email) "
+            f"{ROW_QUERY} WHERE p.id = %s", [profile_id])
+
+    def update_user(self, user_id):
+        self._execute(
+            f"INSERT OR REPLACE INTO {TABLE} (rowid, username, first_name, last_name, email) "
+            f"{ROW_QUERY} WHERE p.user_id = %s", [user_id])
+
+    def remove_profile(self, profile_id):
+        self._execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [profile_id])
+
+    def rebuild(self):
+        self._execute(f"DELETE FROM {TABLE}")
+        self._execute(
+            f"INSERT INTO {TABLE} (rowid, username, first_name, last_name, email) {ROW_QUERY}")
+
+    def _execute(self, sql, params=None):
+        if not self.available():
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+search_index = ProfileSearchIndex()
@@ -1,11 +1,14 @@
 from rest_framework import serializers
 from .models import UserProfile, CustomUser
 from message_control.serializers import GenericFileUploadSerializer
+from .presence import presence
+from .snapshots import get_unseen_count
 
 
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField()
     password = serializers.CharField()
+    device = serializers.CharField(required=False, allow_blank=True, max_length=255)
 
 
 class RegisterSerializer(serializers.Serializer):
@@ -23,6 +26,16 @@ class CustomUserSerializer(serializers.ModelSerializer):
         model = CustomUser
         exclude = ("password",)
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+
+        # is_online is written behind, prefer the fresher in-memory value
+        last_seen = presence.last_seen(instance.id)
+        if last_seen and last_seen > instance.is_online:
+            data["is_online"] = self.fields["is_online"].to_representation(
+                last_seen)
+        return data
+
 
 class UserProfileSerializer(serializers.ModelSerializer):
     user = CustomUserSerializer(read_only=True)
@@ -37,16 +50,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
     def get_unseen_count(self, obj):
-        try:
-            user_id = self.context["request"].user.id
-        except Exception as e:
-            user_id = None
-
-        from message_control.models import Message
-        messages = Message.objects.filter(
-            sender_id=obj.user.id, receiver_id=user_id, is_read=False).distinct()
-
-        return messages.count()
+        return get_unseen_count(obj, self.context)
 
 
 class FavoriteSerializer(serializers.Serializer):
@@ -0,0 +1,74 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .auth_cache import auth_cache
+from .favorites import favorites_cache
+from .models import CustomUser, Favorite, UserProfile
+from .search import search_index
+from .snapshots import profile_snapshots
+from .suggest import suggest_index
+
+
+@receiver((post_save, post_delete), sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    auth_cache.invalidate_user(instance.id)
+
+
+@receiver((post_save, post_delete), sender=CustomUser)
+@receiver((post_save, post_delete), sender=UserProfile)
+def invalidate_profile_snapshot(sender, instance, **kwargs):
+    profile_snapshots.invalidate(instance.id if sender is CustomUser else instance.user_id)
+
+
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+@receiver(m2m_changed, sender=CustomUser.user_permissions.through)
+def invalidate_snapshots_on_access_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            profile_snapshots.invalidate(instance.pk)
+        return
+    # Changed from the group or permission side, pk_set holds user ids
+    if action in ("post_add", "post_remove"):
+        user_ids = pk_set
+    elif action == "pre_clear":
+        user_ids = instance.user_set.values_list("id", flat=True)
+    else:
+        return
+    for user_id in user_ids:
+        profile_snapshots.invalidate(user_id)
+
+
+@receiver(post_save, sender=CustomUser)
+def index_user(sender, instance, created, **kwargs):
+    if not created:
+        search_index.update_user(instance.id)
+        suggest_index.rename(instance.id, instance.username)
+
+
+@receiver(post_save, sender=UserProfile)
+def index_profile(sender, instance, **kwargs):
+    search_index.update_profile(instance.id)
+    suggest_index.update(instance.user.id, instance.user.username,
+                         instance.first_name, instance.last_name)
+
+
+@receiver(post_delete, sender=UserProfile)
+def unindex_profile(sender, instance, **kwargs):
+    search_index.remove_profile(instance.id)
+    suggest_index.remove(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Favorite.favorite.through)
+def invalidate_favorites(sender, instance, action, reverse, **kwargs):
+    if not action.startswith("post_"):
+        return
+    # Changes made from the favoured user's side may touch any owner
+    if reverse:
+        favorites_cache.clear()
+    else:
+        favorites_cache.invalidate(instance.user_id)
+
+
+@receiver(post_delete, sender=Favorite)
+def invalidate_deleted_favorites(sender, instance, **kwargs):
+    favorites_cache.invalidate(instance.user_id)
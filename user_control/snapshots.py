@@ -0,0 +1,162 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import prefetch_related_objects
+from rest_framework import serializers
+
+from .presence import presence
+
+# Renders is_online exactly like the serializer field
+is_online_field = serializers.DateTimeField()
+
+
+def get_unseen_count(profile, context):
+    """Messages from ``profile``'s user the requesting user has not read yet."""
+    # List views precompute the counts for the whole page
+    unseen_counts = context.get("unseen_counts")
+    if unseen_counts is not None:
+        return unseen_counts.get(profile.user_id, 0)
+
+    try:
+        user_id = context["request"].user.id
+    except Exception:
+        user_id = None
+
+    if user_id is None:
+        return 0
+
+    from message_control.models import UnreadCounter
+    return UnreadCounter.objects.counts_for(user_id, [profile.user_id]).get(profile.user_id, 0)
+
+
+class ProfileSnapshotCache:
+    """Serialized ``UserProfile`` dicts, shared within a request and across requests.
+
+    A snapshot is keyed by the user, a version built from the profile's and
+    user's ``updated_at``, the picture with its variants and a per-user
+    counter that ``invalidate()`` bumps, and the request's base URL (file
+    URLs are absolute), so any change yields a new key and stale entries
+    simply age out. Signals call ``invalidate()`` for changes that leave
+    ``updated_at`` alone, such as groups and permissions. Viewer specific
+    and fast moving values, ``unseen`` and ``is_online``, are never cached
+    and are set on every read. Snapshots
+    live in the cache named by ``settings.PROFILE_SNAPSHOT_CACHE`` and are
+    memoized in the serializer context for the rest of the request.
+    """
+
+    memo_key = "profile_snapshots"
+    versions_key = "profile_snapshot_versions"
+
+    def __init__(self, alias=None, ttl=None):
+        self.alias = alias or settings.PROFILE_SNAPSHOT_CACHE
+        self.ttl = settings.PROFILE_SNAPSHOT_TTL if ttl is None else ttl
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def version_key(user_id):
+        return f"profile-snapshot-version:{user_id}"
+
+    def invalidate(self, user_id):
+        """Retire every snapshot of ``user_id``."""
+        key = self.version_key(user_id)
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # Evicted in between, any new value retires the old snapshots
+            self.cache.set(key, 1, None)
+
+    def counter(self, user_id, context):
+        """The invalidation counter of ``user_id``, read once per request."""
+        versions = context.setdefault(self.versions_key, {})
+        if user_id not in versions:
+            versions[user_id] = self.cache.get(self.version_key(user_id), 0)
+        return versions[user_id]
+
+    def key(self, profile, context):
+        request = context.get("request")
+        picture = profile.profile_picture_id
+        if picture is not None:
+            # Variants are added to the picture after the profile was saved
+            picture = (picture, sorted(profile.profile_picture.variants))
+        version = "{}:{}:{}:{}:{}".format(
+            profile.updated_at.timestamp(), profile.user.updated_at.timestamp(),
+            picture, self.counter(profile.user_id, context),
+            request.build_absolute_uri("/") if request else "")
+        digest = hashlib.blake2b(version.encode(), digest_size=12).hexdigest()
+        return f"profile-snapshot:{profile.user_id}:{digest}"
+
+    def get(self, profile, context, render):
+        """Snapshot of ``profile``, calling ``render()`` to serialize it on a miss."""
+        key = self.key(profile, context)
+        memo = context.setdefault(self.memo_key, {})
+        snapshot = memo.get(key)
+        if snapshot is None:
+            snapshot = self.cache.get(key)
+            if snapshot is None:
+                snapshot = render()
+                # Keep the key in place, field order is part of the payload
+                snapshot["unseen"] = None
+                self.cache.set(key, snapshot, self.ttl)
+            memo[key] = snapshot
+        return snapshot
+
+    def render(self, profile, context, unseen=None):
+        """Cached profile dict with the live ``unseen`` and ``is_online`` values filled in."""
+        snapshot = self.get(profile, context, lambda: self.serialize(profile, context))
+        data = dict(snapshot)
+        is_online = profile.user.is_online
+        last_seen = presence.last_seen(profile.user_id)
+        if last_seen and last_seen > is_online:
+            is_online = last_seen
+        data["user"] = {**snapshot["user"], "is_online": is_online_field.to_representation(is_online)}
+        data["unseen"] = get_unseen_count(profile, context) if unseen is None else unseen
+        return data
+
+    def render_many(self, user_ids, context):
+        """Rendered profiles of ``user_ids`` keyed by user id, fetched in one query."""
+        from socialchat.optimizer import get_query_plan
+        from .models import UserProfile
+        from .serializers import UserProfileSerializer
+
+        if context.get("unseen_counts") is None:
+            try:
+                user_id = context["request"].user.id
+            except Exception:
+                user_id = None
+            if user_id is not None:
+                from message_control.models import UnreadCounter
+                context["unseen_counts"] = UnreadCounter.objects.counts_for(user_id, user_ids)
+
+        plan = get_query_plan(UserProfileSerializer, UserProfile)
+        profiles = list(UserProfile.objects.filter(user_id__in=user_ids).select_related(*plan.select))
+        memo = context.setdefault(self.memo_key, {})
+        versions = context.setdefault(self.versions_key, {})
+        missing_versions = [profile.user_id for profile in profiles if profile.user_id not in versions]
+        stored = self.cache.get_many([self.version_key(user_id) for user_id in missing_versions])
+        for user_id in missing_versions:
+            versions[user_id] = stored.get(self.version_key(user_id), 0)
+        keys = {profile.user_id: self.key(profile, context) for profile in profiles}
+        memo.update(self.cache.get_many([key for key in keys.values() if key not in memo]))
+        # Only the profiles serialized from scratch need the prefetched relations
+        missing = [profile for profile in profiles if keys[profile.user_id] not in memo]
+        if missing:
+            prefetch_related_objects(missing, *plan.prefetch)
+        return {profile.user_id: self.render(profile, context) for profile in profiles}
+
+    @staticmethod
+    def serialize(profile, context):
+        from .serializers import UserProfileSerializer
+
+        return dict(UserProfileSerializer(profile, context=context).data)
+
+    def clear(self):
+        """Drop every entry of the snapshot cache, meant for a dedicated cache alias."""
+        self.cache.clear()
+
+
+profile_snapshots = ProfileSnapshotCache()
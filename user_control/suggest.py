@@ -0,0 +1,130 @@
+import logging
+import threading
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from socialchat.background import PeriodicTask
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+class SuggestIndex:
+    """In-memory prefix index over usernames and profile names for typeahead.
+
+    Every profile contributes up to four lowercase keys (username, first name,
+    last name and "first last") to one sorted list, so a prefix lookup is a
+    ``bisect`` followed by a short forward scan. The index is loaded on first
+    use, kept current by model signals in this process and fully reloaded
+    every ``refresh_interval`` seconds to pick up writes from other workers.
+    """
+
+    def __init__(self, refresh_interval=None):
+        self.refresher = PeriodicTask(
+            "suggest-refresher",
+            settings.SUGGEST_REFRESH_INTERVAL if refresh_interval is None else refresh_interval,
+            self.reload)
+
+        self._keys = []
+        self._users = {}
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def warm(self):
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                self.reload()
+            except DatabaseError:
+                logger.warning("Suggest index could not be loaded", exc_info=True)
+
+    def reload(self):
+        rows = UserProfile.objects.values_list(
+            "user_id", "user__username", "first_name", "last_name")
+        keys, users = [], {}
+        for user_id, username, first_name, last_name in rows.iterator():
+            users[user_id] = self._entry(username, first_name, last_name)
+            keys.extend((key, user_id) for key in users[user_id][3])
+        keys.sort()
+        with self._lock:
+            self._keys, self._users, self._loaded = keys, users, True
+        self.refresher.start()
+        return len(users)
+
+    def clear(self):
+        with self._lock:
+            self._keys, self._users, self._loaded = [], {}, False
+
+    def update(self, user_id, username, first_name, last_name):
+        with self._lock:
+            if not self._loaded:
+                return
+            self._discard(user_id)
+            self._users[user_id] = entry = self._entry(
+                username, first_name, last_name)
+            for key in entry[3]:
+                insort(self._keys, (key, user_id))
+
+    def rename(self, user_id, username):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] != username:
+                self.update(user_id, username, entry[1], entry[2])
+
+    def remove(self, user_id):
+        with self._lock:
+            if self._loaded:
+                self._discard(user_id)
+
+    def suggest(self, prefix, limit=10):
+        """Return up to ``limit`` ``[user_id, username, full_name]`` rows whose keys start with ``prefix``."""
+        prefix = " ".join(prefix.lower().split())
+        if not prefix or limit <= 0:
+            return []
+
+        self.warm()
+        results, seen = [], set()
+        with self._lock:
+            keys = self._keys
+            index = bisect_left(keys, (prefix,))
+            while index < len(keys) and keys[index][0].startswith(prefix):
+                user_id = keys[index][1]
+                if user_id not in seen:
+                    seen.add(user_id)
+                    username, first_name, last_name, _ = self._users[user_id]
+                    results.append([user_id, username, self._full_name(first_name, last_name)])
+                    if len(results) == limit:
+                        break
+                index += 1
+        return results
+
+    def _discard(self, user_id):
+        entry = self._users.pop(user_id, None)
+        if entry is None:
+            return
+        for key in entry[3]:
+            index = bisect_left(self._keys, (key, user_id))
+            if index < len(self._keys) and self._keys[index] == (key, user_id):
+                del self._keys[index]
+
+    @staticmethod
+    def _full_name(first_name, last_name):
+        return " ".join(part for part in (first_name, last_name) if part)
+
+    @classmethod
+    def _entry(cls, username, first_name, last_name):
+        values = (username, first_name, last_name,
+                  cls._full_name(first_name, last_name))
+        keys = {" ".join(value.lower().split()) for value in values}
+        keys.discard("")
+        return username, first_name, last_name, tuple(keys)
+
+
+suggest_index = SuggestIndex()
@@ -1,8 +1,18 @@
+import time
+
 from rest_framework.test import APITestCase
 
 from message_control.tests import create_image, SimpleUploadedFile
-from .views import get_random, get_access_token, get_refresh_token
-from .models import CustomUser, UserProfile
+from .views import get_random, get_access_token, get_refresh_token, decode_jwt
+from .auth_cache import auth_cache
+from .presence import PresenceTracker, presence
+from .search import search_index
+from .suggest import suggest_index
+from .favorites import favorites_cache
+from .revocation import BloomFilter, RevocationList, revocation_list
+from datetime import timedelta
+from django.utils import timezone
+from .models import CustomUser, UserProfile, Favorite, Jwt
 
 # Create your tests here.
 
@@ -104,6 +114,133 @@ class TestAuthentication(APITestCase):
         self.assertTrue(result["refresh"])
 
 
+class TestSessions(APITestCase):
+    login_url = "/user/login"
+    refresh_url = "/user/refresh"
+    logout_url = "/user/logout"
+    self_url = "/user/self"
+
+    def setUp(self):
+        self.payload = {"username": "UserA", "password": "UserApassword"}
+        self.user = CustomUser.objects.create_user(email="UserAemail@gmail.com", **self.payload)
+
+    def login(self, device):
+        return self.client.post(self.login_url, data={**self.payload, "device": device}).json()
+
+    def test_devices_keep_separate_sessions(self):
+        phone, laptop = self.login("phone"), self.login("laptop")
+        self.assertEqual(sorted(Jwt.objects.values_list("device", flat=True)), ["laptop", "phone"])
+        # Only digests are stored
+        self.assertFalse(Jwt.objects.filter(refresh_digest=phone["refresh"]).exists())
+
+        response = self.client.get(self.logout_url, HTTP_AUTHORIZATION=f"Bearer {phone['access']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Jwt.objects.values_list("device", flat=True)), ["laptop"])
+        self.assertEqual(self.client.post(self.refresh_url, {"refresh": phone["refresh"]}).status_code, 400)
+        self.assertEqual(self.client.post(self.refresh_url, {"refresh": laptop["refresh"]}).status_code, 200)
+
+    def test_refresh_rotates_with_one_update(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        refresh = self.login("phone")["refresh"]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.refresh_url, {"refresh": refresh})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([query["sql"].split()[0] for query in context], ["UPDATE"])
+
+        # The rotated token is spent, its successor works
+        self.assertEqual(self.client.post(self.refresh_url, {"refresh": refresh}).status_code, 400)
+        response = self.client.post(self.refresh_url, {"refresh": response.json()["refresh"]})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.self_url, HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+        self.assertEqual(response.status_code, 200)
+
+    def test_logout_everywhere_and_session_cap(self):
+        from django.test import override_settings
+
+        with override_settings(JWT_MAX_SESSIONS=2):
+            tokens = [self.login(f"device {index}") for index in range(3)]
+        self.assertEqual(sorted(Jwt.objects.values_list("device", flat=True)), ["device 1", "device 2"])
+
+        self.client.get(f"{self.logout_url}?all=true", HTTP_AUTHORIZATION=f"Bearer {tokens[2]['access']}")
+        self.assertFalse(Jwt.objects.exists())
+
+    def test_purge_expired_sessions_in_batches(self):
+        for index in range(5):
+            self.login(f"device {index}")
+        Jwt.objects.exclude(device="device 4").update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(Jwt.objects.purge_expired(batch_size=2), 4)
+        self.assertEqual(list(Jwt.objects.values_list("device", flat=True)), ["device 4"])
+
+
+class TestRevocation(APITestCase):
+    login_url = "/user/login"
+    logout_url = "/user/logout"
+    self_url = "/user/self"
+
+    def setUp(self):
+        revocation_list.clear()
+        self.addCleanup(revocation_list.clear)
+        self.payload = {"username": "UserA", "password": "UserApassword"}
+        CustomUser.objects.create_user(email="UserAemail@gmail.com", **self.payload)
+
+    def login(self):
+        access = self.client.post(self.login_url, data=self.payload).json()["access"]
+        return {"HTTP_AUTHORIZATION": f"Bearer {access}"}
+
+    def test_logout_revokes_access_token(self):
+        phone, laptop = self.login(), self.login()
+        self.assertEqual(self.client.get(self.self_url, **phone).status_code, 200)
+
+        self.client.get(self.logout_url, **phone)
+        self.assertEqual(self.client.get(self.self_url, **phone).status_code, 403)
+        self.assertEqual(self.client.get(self.self_url, **laptop).status_code, 200)
+
+    def test_logout_everywhere_revokes_earlier_tokens(self):
+        phone, laptop = self.login(), self.login()
+        self.client.get(f"{self.logout_url}?all=true", **phone)
+        self.assertEqual(self.client.get(self.self_url, **phone).status_code, 403)
+        self.assertEqual(self.client.get(self.self_url, **laptop).status_code, 403)
+        self.assertEqual(self.client.get(self.self_url, **self.login()).status_code, 200)
+
+    def test_check_is_in_memory(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        revocation_list.warm()
+        revocation_list.revoke("revoked", time.time() + 60)
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(revocation_list.is_revoked({"jti": "revoked", "user_id": 1}))
+            self.assertFalse(revocation_list.is_revoked({"jti": "valid", "user_id": 1}))
+        self.assertEqual(len(context), 0)
+
+    def test_other_workers_sync_and_prune(self):
+        from .models import RevokedToken
+
+        other = RevocationList(sync_interval=0)
+        other.warm()
+        revocation_list.revoke("expiring", time.time() + 0.5)
+        revocation_list.revoke("lasting", time.time() + 60)
+        self.assertFalse(other.is_revoked({"jti": "lasting"}))
+        self.assertEqual(other.sync(), 2)
+        self.assertTrue(other.is_revoked({"jti": "lasting"}))
+
+        time.sleep(0.6)
+        self.assertEqual(other.prune(), 1)
+        self.assertFalse(other.is_revoked({"jti": "expiring"}))
+        self.assertEqual(list(RevokedToken.objects.values_list("key", flat=True)), ["lasting"])
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        for index in range(1000):
+            bloom.add(f"token-{index}")
+        self.assertTrue(all(f"token-{index}" in bloom for index in range(1000)))
+        false_positives = sum(f"other-{index}" in bloom for index in range(10000))
+        self.assertLess(false_positives, 300)
+
+
 class TestUserInfo(APITestCase):
     profile_url = "/user/profile"
     login_url = "/user/login"
@@ -242,3 +379,456 @@ class TestUserInfo(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]["user"]["username"], "user3")
+
+
+class TestAuthCache(APITestCase):
+    login_url = "/user/login"
+
+    def setUp(self):
+        payload = {
+            "username": "nguyenfamj1",
+            "password": "newPassword123",
+            "email": "nguyenfamj1409@gmail.com"
+        }
+        self.user = CustomUser.objects.create_user(**payload)
+        auth_cache.clear()
+
+        response = self.client.post(self.login_url, data=payload)
+        self.bearer = "Bearer {}".format(response.json()["access"])
+
+    def test_hot_token_skips_decode_and_database(self):
+        with self.assertNumQueries(1):
+            user = decode_jwt(self.bearer)
+        self.assertEqual(user.id, self.user.id)
+
+        with self.assertNumQueries(0):
+            user = decode_jwt(self.bearer)
+        self.assertEqual(user.username, "nguyenfamj1")
+
+        stats = auth_cache.stats()
+        self.assertEqual(stats["tokens"]["hits"], 1)
+        self.assertEqual(stats["users"]["hits"], 1)
+
+    def test_user_change_invalidates_cache(self):
+        decode_jwt(self.bearer)
+
+        self.user.username = "renamed"
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            user = decode_jwt(self.bearer)
+        self.assertEqual(user.username, "renamed")
+
+    def test_cached_user_is_a_fresh_instance(self):
+        first = decode_jwt(self.bearer)
+        first.username = "mutated"
+
+        second = decode_jwt(self.bearer)
+        self.assertIsNot(first, second)
+        self.assertEqual(second.username, "nguyenfamj1")
+
+
+class TestPresence(APITestCase):
+    login_url = "/user/login"
+    profile_url = "/user/profile"
+
+    def setUp(self):
+        payload = {
+            "username": "nguyenfamj1",
+            "password": "newPassword123",
+            "email": "nguyenfamj1409@gmail.com"
+        }
+        self.user = CustomUser.objects.create_user(**payload)
+        presence.clear()
+        response = self.client.post(self.login_url, data=payload)
+        self.bearer = {
+            "HTTP_AUTHORIZATION": "Bearer {}".format(response.json()["access"])
+        }
+
+    def test_touch_is_written_behind_and_throttled(self):
+        tracker = PresenceTracker(
+            write_interval=60, flush_interval=0, online_window=300)
+        seen_at = timezone.now()
+        before = CustomUser.objects.get(id=self.user.id).is_online
+
+        tracker.touch(self.user.id, now=seen_at)
+        self.assertEqual(CustomUser.objects.get(
+            id=self.user.id).is_online, before)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(tracker.flush(), 1)
+        self.assertEqual(CustomUser.objects.get(
+            id=self.user.id).is_online, seen_at)
+
+        # Within the write interval only memory is updated
+        tracker.touch(self.user.id, now=seen_at + timedelta(seconds=30))
+        self.assertEqual(tracker.flush(), 0)
+        self.assertEqual(tracker.last_seen(self.user.id),
+                         seen_at + timedelta(seconds=30))
+
+        tracker.touch(self.user.id, now=seen_at + timedelta(seconds=61))
+        self.assertEqual(tracker.flush(), 1)
+
+    def test_online_user_ids(self):
+        tracker = PresenceTracker(
+            write_interval=60, flush_interval=0, online_window=300)
+        user2 = CustomUser.objects.create_user(
+            username="user2", password="user2password", email="user2@gmail.com")
+        CustomUser.objects.filter(id=user2.id).update(
+            is_online=timezone.now() - timedelta(hours=1))
+        user3 = CustomUser.objects.create_user(
+            username="user3", password="user3password", email="user3@gmail.com")
+
+        tracker.touch(user2.id)
+
+        online = tracker.online_user_ids([user2.id, user3.id])
+        self.assertIn(user2.id, online)
+        self.assertIn(user3.id, online)
+
+        CustomUser.objects.filter(id=user3.id).update(
+            is_online=timezone.now() - timedelta(hours=1))
+        self.assertEqual(tracker.online_user_ids(
+            [user2.id, user3.id]), {user2.id})
+
+    def test_authenticated_request_does_not_write_presence(self):
+        UserProfile.objects.create(
+            user=self.user, first_name="Nguyen", last_name="Pham", caption="", about="")
+        user2 = CustomUser.objects.create_user(
+            username="user2", password="user2password", email="user2@gmail.com")
+        UserProfile.objects.create(
+            user=user2, first_name="User2", last_name="Hopkins", caption="", about="")
+        CustomUser.objects.filter(id=user2.id).update(
+            is_online=timezone.now() - timedelta(hours=1))
+        old = timezone.now() - timedelta(hours=2)
+        CustomUser.objects.filter(id=self.user.id).update(is_online=old)
+
+        response = self.client.get(
+            self.profile_url + "?online=true", **self.bearer)
+        result = response.json()["results"]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["user"]["id"]
+                         for item in result], [self.user.id])
+        self.assertEqual(CustomUser.objects.get(
+            id=self.user.id).is_online, old)
+        self.assertNotEqual(result[0]["user"]["is_online"],
+                            old.isoformat().replace("+00:00", "Z"))
+
+        presence.flush()
+        self.assertGreater(CustomUser.objects.get(
+            id=self.user.id).is_online, old)
+
+
+class TestProfileQueryCount(APITestCase):
+    login_url = "/user/login"
+    profile_url = "/user/profile"
+
+    def setUp(self):
+        payload = {
+            "username": "nguyenfamj1",
+            "password": "newPassword123",
+            "email": "nguyenfamj1409@gmail.com"
+        }
+        self.user = CustomUser.objects.create_user(**payload)
+        response = self.client.post(self.login_url, data=payload)
+        self.bearer = {
+            "HTTP_AUTHORIZATION": "Bearer {}".format(response.json()["access"])
+        }
+
+    def create_profiles(self, start, count):
+        from message_control.models import Message, UnreadCounter
+
+        for index in range(start, start + count):
+            user = CustomUser.objects.create_user(
+                username=f"user{index}", password="password", email=f"user{index}@gmail.com")
+            UserProfile.objects.create(
+                user=user, first_name="User", last_name=str(index), caption="", about="")
+            Message.objects.create(
+                sender=user, receiver=self.user, message="hello")
+            UnreadCounter.objects.adjust(user.id, self.user.id, 1)
+
+    def count_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.profile_url, **self.bearer)
+        return len(context), response.json()["results"]
+
+    def test_unseen_counts_use_constant_queries(self):
+        self.create_profiles(0, 2)
+        self.count_queries()
+        few, results = self.count_queries()
+        self.assertEqual([item["unseen"] for item in results], [1, 1])
+
+        self.create_profiles(2, 8)
+        many, results = self.count_queries()
+        self.assertEqual(len(results), 10)
+        self.assertEqual(few, many)
+        self.assertTrue(all(item["unseen"] == 1 for item in results))
+
+
+class TestProfileSearchIndex(APITestCase):
+    login_url = "/user/login"
+    profile_url = "/user/profile"
+
+    def setUp(self):
+        if not search_index.available():
+            self.skipTest("SQLite FTS5 trigram index is not available")
+
+        payload = {
+            "username": "nguyenfamj1",
+            "password": "newPassword123",
+            "email": "nguyenfamj1409@gmail.com"
+        }
+        self.user = CustomUser.objects.create_user(**payload)
+        UserProfile.objects.create(
+            user=self.user, first_name="Nguyen", last_name="Pham", caption="", about="")
+        response = self.client.post(self.login_url, data=payload)
+        self.bearer = {
+            "HTTP_AUTHORIZATION": "Bearer {}".format(response.json()["access"])
+        }
+
+    def create_profile(self, username, first_name, last_name, email=None):
+        user = CustomUser.objects.create_user(
+            username=username, password="password", email=email or f"{username}@mail.com")
+        return UserProfile.objects.create(
+            user=user, first_name=first_name, last_name=last_name, caption="", about="")
+
+    def search(self, keyword):
+        response = self.client.get(
+            self.profile_url, {"keyword": keyword}, **self.bearer)
+        self.assertEqual(response.status_code, 200)
+        return [item["user"]["username"] for item in response.json()["results"]]
+
+    def test_search_ranks_matches(self):
+        self.create_profile("rolling", "Keith", "Stonewall")
+        self.create_profile("stone", "Emma", "Stone")
+
+        # Matching username, last name and email outranks a single field
+        self.assertEqual(self.search("stone"), ["stone", "rolling"])
+        self.assertEqual(self.search("nguyen pham"), ["nguyenfamj1"])
+        self.assertEqual(self.search("EMMA"), ["stone"])
+
+        ranked = search_index.search(UserProfile.objects.all(), ["stone"])
+        self.assertEqual(ranked.query.extra, {})
+        self.assertEqual([profile.user.username for profile in ranked.select_related("user")],
+                         ["stone", "rolling"])
+
+    def test_index_follows_user_and_profile_changes(self):
+        profile = self.create_profile(
+            "hopkins", "User2", "Hopkins", email="user2@mail.com")
+
+        profile.user.username = "renamed"
+        profile.user.save()
+        self.assertEqual(self.search("renamed"), ["renamed"])
+        self.assertEqual(self.search("hopkins"), ["renamed"])
+
+        profile.last_name = "Smith"
+        profile.save()
+        self.assertEqual(self.search("hopkins"), [])
+
+        profile.delete()
+        self.assertEqual(self.search("renamed"), [])
+
+    def test_short_terms_fall_back_to_like(self):
+        self.create_profile("al", "Al", "Bo")
+
+        queryset = UserProfile.objects.all()
+        self.assertIsNone(search_index.search(queryset, ["al"]))
+        self.assertEqual(self.search("al"), ["al"])
+
+    def test_search_uses_fts_index(self):
+        plan = search_index.search(
+            UserProfile.objects.all(), ["nguyen"]).explain()
+
+        self.assertIn("VIRTUAL TABLE INDEX", plan)
+        self.assertNotIn("SCAN user_control_userprofile", plan)
+
+
+class TestSuggest(APITestCase):
+    login_url = "/user/login"
+    suggest_url = "/user/profile/suggest"
+
+    def setUp(self):
+        payload = {
+            "username": "nguyenfamj1",
+            "password": "newPassword123",
+            "email": "nguyenfamj1409@gmail.com"
+        }
+        self.user = CustomUser.objects.create_user(**payload)
+        UserProfile.objects.create(
+            user=self.user, first_name="Nguyen", last_name="Pham", caption="", about="")
+        suggest_index.clear()
+        response = self.client.post(self.login_url, data=payload)
+        self.bearer = {
+            "HTTP_AUTHORIZATION": "Bearer {}".format(response.json()["access"])
+        }
+
+    def create_profile(self, username, first_name, last_name):
+        user = CustomUser.objects.create_user(
+            username=username, password="password", email=f"{username}@mail.com")
+        return UserProfile.objects.create(
+            user=user, first_name=first_name, last_name=last_name, caption="", about="")
+
+    def suggest(self, query, **params):
+        response = self.client.get(
+            self.suggest_url, {"q": query, **params}, **self.bearer)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_prefix_matches_usernames_and_names(self):
+        profile = self.create_profile("emmas", "Emma", "Stone")
+        self.create_profile("rolling", "Keith", "Stonewall")
+
+        self.assertEqual(self.suggest("EMM"), [
+            [profile.user_id, "emmas", "Emma Stone"]])
+        self.assertEqual([row[1] for row in self.suggest("ston")],
+                         ["emmas", "rolling"])
+        self.assertEqual([row[1] for row in self.suggest("emma  st")],
+                         ["emmas"])
+        self.assertEqual(self.suggest("ston", limit=1), [
+            [profile.user_id, "emmas", "Emma Stone"]])
+        self.assertEqual(self.suggest(""), [])
+
+    def test_index_follows_signals_without_queries(self):
+        self.suggest("ng")
+        profile = self.create_profile("hopkins", "User2", "Hopkins")
+
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest_index.suggest("hop"), [
+                [profile.user_id, "hopkins", "User2 Hopkins"]])
+
+        profile.user.username = "renamed"
+        profile.user.save()
+        self.assertEqual([row[1] for row in self.suggest("ren")], ["renamed"])
+        self.assertEqual([row[1] for row in self.suggest("hop")], ["renamed"])
+
+        profile.last_name = "Smith"
+        profile.save()
+        self.assertEqual(self.suggest("hop"), [])
+
+        profile.delete()
+        self.assertEqual(self.suggest("ren"), [])
+
+
+class TestFavorites(APITestCase):
+    login_url = "/user/login"
+    profile_url = "/user/profile"
+    favorite_url = "/user/favorite"
+
+    def setUp(self):
+        payload = {
+            "username": "nguyenfamj1",
+            "password": "newPassword123",
+            "email": "nguyenfamj1409@gmail.com"
+        }
+        self.user = CustomUser.objects.create_user(**payload)
+        favorites_cache.clear()
+        response = self.client.post(self.login_url, data=payload)
+        self.bearer = {
+            "HTTP_AUTHORIZATION": "Bearer {}".format(response.json()["access"])
+        }
+
+    def tearDown(self):
+        # Rolled back rows do not send signals
+        favorites_cache.clear()
+
+    def create_profile(self, username, first_name, last_name):
+        user = CustomUser.objects.create_user(
+            username=username, password="password", email=f"{username}@mail.com")
+        return UserProfile.objects.create(
+            user=user, first_name=first_name, last_name=last_name, caption="", about="")
+
+    def toggle(self, user_id):
+        response = self.client.post(
+            self.favorite_url, {"favorite_id": user_id}, **self.bearer)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["is_favorite"]
+
+    def usernames(self, **params):
+        response = self.client.get(self.profile_url, params, **self.bearer)
+        self.assertEqual(response.status_code, 200)
+        return [item["user"]["username"] for item in response.json()["results"]]
+
+    def test_toggle_and_list_favorites(self):
+        profile = self.create_profile("user2", "User2", "Hopkins")
+
+        self.assertTrue(self.toggle(profile.user_id))
+        response = self.client.get(self.favorite_url, **self.bearer)
+        self.assertEqual([item["user"]["username"]
+                         for item in response.json()], ["user2"])
+
+        self.assertFalse(self.toggle(profile.user_id))
+        response = self.client.get(self.favorite_url, **self.bearer)
+        self.assertEqual(response.json(), [])
+
+        response = self.client.post(
+            self.favorite_url, {"favorite_id": self.user.id}, **self.bearer)
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_ranks_favorites_first(self):
+        self.create_profile("user2", "User2", "Stone")
+        favored = self.create_profile("user3", "User3", "Stone")
+        self.assertEqual(self.usernames(keyword="stone"), ["user2", "user3"])
+        self.assertEqual(self.usernames(keyword="st"), ["user2", "user3"])
+
+        self.toggle(favored.user_id)
+        self.assertEqual(self.usernames(keyword="stone"), ["user3", "user2"])
+        self.assertEqual(self.usernames(keyword="st"), ["user3", "user2"])
+        self.assertEqual(self.usernames(), ["user3", "user2"])
+
+    def test_favorites_are_served_from_memory(self):
+        favored = self.create_profile("user2", "User2", "Stone")
+        Favorite.objects.create(user=self.user).favorite.add(favored.user_id)
+
+        self.assertEqual(favorites_cache.get(self.user.id), {favored.user_id})
+        with self.assertNumQueries(0):
+            favorites_cache.get(self.user.id)
+
+        Favorite.objects.get(user=self.user).favorite.clear()
+        self.assertEqual(favorites_cache.get(self.user.id), set())
+
+
+class TestAsyncProfileViews(APITestCase):
+    login_url = "/user/login"
+
+    def setUp(self):
+        payload = {
+            "username": "nguyenfamj1",
+            "password": "newPassword123",
+            "email": "nguyenfamj1409@gmail.com"
+        }
+        self.user = CustomUser.objects.create_user(**payload)
+        UserProfile.objects.create(
+            user=self.user, first_name="Nguyen", last_name="Pham", caption="", about="")
+        suggest_index.clear()
+        access = self.client.post(self.login_url, data=payload).json()["access"]
+        self.bearer = {"HTTP_AUTHORIZATION": f"Bearer {access}"}
+        self.headers = {"authorization": f"Bearer {access}"}
+
+    async def test_profiles_match_sync_view(self):
+        from unittest import mock
+        from asgiref.sync import sync_to_async
+        from user_control.presence import presence
+
+        params = {"keyword": "nguyen"}
+        with mock.patch.object(presence, "last_seen", return_value=None):
+            response = await self.async_client.get("/user/async/profile", params, **self.headers)
+            expected = await sync_to_async(self.client.get)("/user/profile", params, **self.bearer)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(response.json()["count"], 1)
+
+        response = await self.async_client.get("/user/async/profile", {"page": 5}, **self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_suggest_is_answered_from_memory(self):
+        response = await self.async_client.get(
+            "/user/async/profile/suggest", {"q": "ngu"}, **self.headers)
+        self.assertEqual(response.json(), {
+            "results": [[self.user.id, "nguyenfamj1", "Nguyen Pham"]]})
+
+        response = await self.async_client.get("/user/async/profile/suggest", {"q": "ngu"})
+        self.assertEqual(response.status_code, 403)
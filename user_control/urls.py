@@ -1,7 +1,8 @@
 from django.urls import path, include
 from .views import (LoginView, RegisterView, RefreshView,
-                    SelfView, UserProfileView)
+                    SelfView, UserProfileView, FavoriteView, LogoutView)
 from rest_framework.routers import DefaultRouter
+from . import async_views
 
 router = DefaultRouter(trailing_slash=False)
 router.register("profile", UserProfileView)
@@ -11,5 +12,9 @@ urlpatterns = [
     path('login', LoginView.as_view()),
     path('register', RegisterView.as_view()),
     path('refresh', RefreshView.as_view()),
+    path('logout', LogoutView.as_view()),
     path('self', SelfView.as_view()),
+    path('favorite', FavoriteView.as_view()),
+    path('async/profile', async_views.profiles),
+    path('async/profile/suggest', async_views.suggest),
 ]
@@ -1,20 +1,34 @@
+import time
+import uuid
+
 import jwt
-from .models import Jwt, CustomUser, UserProfile
+from .models import Jwt, CustomUser, UserProfile, Favorite
+from message_control.models import Message
 from datetime import datetime, timedelta
 from django.conf import settings
+from django.utils import timezone
 import random
 import string
 import re
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from .serializers import LoginSerializer, RegisterSerializer, RefreshSerializer, UserProfileSerializer
+from .serializers import LoginSerializer, RegisterSerializer, RefreshSerializer, UserProfileSerializer, FavoriteSerializer
 from django.contrib.auth import authenticate
 from .authentication import Authentication
+from .auth_cache import auth_cache
+from .favorites import favorites_cache
+from .presence import presence
+from .revocation import revocation_list
+from .search import search_index
+from .suggest import suggest_index
+from rest_framework.decorators import action
 from rest_framework.viewsets import ModelViewSet
 from django.db.models import Q, Count, OuterRef
 
+from socialchat.background import PeriodicTask
 from socialchat.custom_auth import IsAuthenticatedCustom
+from socialchat.optimizer import QueryOptimizerMixin, optimize_queryset
 
 
 # Create your views here.
@@ -23,11 +37,13 @@ def get_random(length):
 
 
 def get_access_token(payload):
-    return jwt.encode({"exp": datetime.now() + timedelta(minutes=5), **payload}, settings.SECRET_KEY, 'HS256')
+    # jti names the token for revocation, iat orders it against user wide revocations
+    return jwt.encode({"exp": datetime.now() + timedelta(seconds=settings.ACCESS_TOKEN_LIFETIME), "iat": time.time(),
+                       "jti": uuid.uuid4().hex, **payload}, settings.SECRET_KEY, 'HS256')
 
 
-def get_refresh_token():
-    return jwt.encode({"exp": datetime.now() + timedelta(days=365), "data": get_random(10)}, settings.SECRET_KEY, 'HS256')
+def get_refresh_token(payload=None):
+    return jwt.encode({"exp": datetime.now() + timedelta(seconds=settings.REFRESH_TOKEN_LIFETIME), "data": get_random(10), **(payload or {})}, settings.SECRET_KEY, 'HS256')
 
 
 def decode_jwt(bearer):
@@ -35,12 +51,21 @@ def decode_jwt(bearer):
         return None
 
     token = bearer[7:]
-    decoded = jwt.decode(token, settings.SECRET_KEY)
-    if decoded:
-        try:
-            return CustomUser.objects.get(id=decoded["user_id"])
-        except Exception:
+    decoded = auth_cache.get_payload(token)
+    if decoded is None:
+        decoded = jwt.decode(token, settings.SECRET_KEY)
+        if not decoded:
             return None
+        auth_cache.set_payload(token, decoded)
+
+    if "user_id" not in decoded or revocation_list.is_revoked(decoded):
+        return None
+    return auth_cache.get_user(decoded["user_id"])
+
+
+session_purger = PeriodicTask(
+    "jwt-session-purge", settings.JWT_SESSION_PURGE_INTERVAL,
+    lambda: Jwt.objects.purge_expired(settings.JWT_SESSION_PURGE_BATCH))
 
 
 class LoginView(APIView):
@@ -56,13 +81,18 @@ class LoginView(APIView):
         if not user:
             return Response({"success": False, "message": "Invalid username or password"}, status="400")
 
-        Jwt.objects.filter(user_id=user.id).delete()
-
-        access = get_access_token({"user_id": user.id})
-        refresh = get_refresh_token()
+        # Every login is a new device session, other devices stay signed in
+        session_id = uuid.uuid4()
+        payload = {"user_id": user.id, "sid": session_id.hex}
+        access = get_access_token(payload)
+        refresh = get_refresh_token(payload)
 
+        device = serializer.validated_data.get("device") or request.headers.get("User-Agent", "")
         Jwt.objects.create(
-            user_id=user.id, access=access.decode(), refresh=refresh.decode())
+            id=session_id, user_id=user.id, device=device[:255], refresh_digest=Jwt.objects.digest(refresh),
+            expires_at=timezone.now() + timedelta(seconds=settings.REFRESH_TOKEN_LIFETIME))
+        Jwt.objects.trim(user.id, settings.JWT_MAX_SESSIONS)
+        session_purger.start()
 
         return Response({"success": True, "access": access, "refresh": refresh}, status="200")
 
@@ -89,30 +119,41 @@ class RefreshView(APIView):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        try:
-            user_tokens = Jwt.objects.get(
-                refresh=serializer.validated_data["refresh"])
-        except Jwt.DoesNotExist:
-            return Response({"success": False, "message": "Refresh token not found"}, status=400)
-
-        if not Authentication.verify_token(serializer.validated_data["refresh"]):
+        decoded = Authentication.verify_token(serializer.validated_data["refresh"])
+        if not decoded:
             return Response({"success": False, "message": "Token is invalid or has expired"}, status=401)
+        if "sid" not in decoded or "user_id" not in decoded:
+            return Response({"success": False, "message": "Refresh token not found"}, status=400)
 
-        access = get_access_token({"user_id": user_tokens.user.id})
-        refresh = get_refresh_token()
+        payload = {"user_id": decoded["user_id"], "sid": decoded["sid"]}
+        access = get_access_token(payload)
+        refresh = get_refresh_token(payload)
 
-        user_tokens.access = access.decode()
-        user_tokens.refresh = refresh.decode()
-        user_tokens.save()
+        # The session row is found and rotated by digest in a single indexed
+        # UPDATE, a token that was already rotated no longer matches
+        if not Jwt.objects.rotate(decoded["sid"], decoded["user_id"], serializer.validated_data["refresh"],
+                                  refresh, settings.REFRESH_TOKEN_LIFETIME):
+            return Response({"success": False, "message": "Refresh token not found"}, status=400)
 
         return Response({"success": True, "access": access, "refresh": refresh})
 
 
-class UserProfileView(ModelViewSet):
+class UserProfileView(QueryOptimizerMixin, ModelViewSet):
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileSerializer
     permission_classes = (IsAuthenticatedCustom,)
 
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get("many") and args:
+            kwargs["context"] = {
+                **self.get_serializer_context(),
+                "unseen_counts": self.get_unseen_counts(args[0]),
+            }
+        return super().get_serializer(*args, **kwargs)
+
+    def get_unseen_counts(self, profiles):
+        return Message.unseen_counts(self.request.user.id, [profile.user_id for profile in profiles])
+
     def get_queryset(self):
         # if self.request.method.lower() != "get":
         #     return self.queryset
@@ -120,29 +161,40 @@ class UserProfileView(ModelViewSet):
         data = self.request.query_params.dict()
         # data.pop("page", None)
         keyword = data.pop("keyword", None)
+        queryset = self.queryset
+
+        if data.pop("online", "").lower() in ("1", "true"):
+            queryset = queryset.filter(
+                user_id__in=presence.online_user_ids())
 
         if keyword:
+            ranked = search_index.search(
+                queryset, self.normalize_query(keyword))
+            if ranked is not None:
+                return favorites_cache.boost(
+                    ranked, self.request.user.id, "search_rank", "id")
+
             search_fields = (
                 "user__username", "first_name", "last_name", "user__email"
             )
             query = self.get_query(keyword, search_fields)
 
-            # try:
-            #     return self.queryset.filter(query).filter(**data).exclude(Q(user_id=self.request.user.id) | Q(user__is_superuser=True)).annotate(fav_count=Count(self.user_favorites_query(self.request.user))).order_by("-fav_count")
-            # except Exception as e:
-            #     raise Exception(e)
-            return self.queryset.filter(query).distinct()
-        return self.queryset
+            queryset = queryset.filter(query).distinct()
 
-        # return self.queryset.filter(**data).exclude(Q(user_id=self.request.user.id) |
-        #                                             Q(user__is_superuser=True)).annotate(fav_count=Count(self.user_favorites_query(self.request.user))).order_by("-fav_count")
+        if self.action != "list":
+            return queryset
+        return favorites_cache.boost(queryset, self.request.user.id)
 
-    # @staticmethod
-    # def user_favorites_query(user):
-    #     try:
-    #         return user.user_favorites.favorite.filter(id=OuterRef("user_id")).values("pk")
-    #     except Exception:
-    #         return []
+    @action(detail=False, methods=["get"])
+    def suggest(self, request):
+        try:
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            limit = 10
+        limit = min(max(limit, 1), settings.SUGGEST_MAX_LIMIT)
+        results = suggest_index.suggest(
+            request.query_params.get("q", ""), limit)
+        return Response({"results": results})
 
     @staticmethod
     def get_query(query_string, search_fields):
@@ -167,6 +219,38 @@ class UserProfileView(ModelViewSet):
         return [normspace(' ', (t[0] or t[1]).strip()) for t in findterms(query_string)]
 
 
+class FavoriteView(APIView):
+    permission_classes = (IsAuthenticatedCustom,)
+    serializer_class = FavoriteSerializer
+
+    def get(self, request):
+        favorites = favorites_cache.get(request.user.id)
+        profiles = optimize_queryset(
+            UserProfile.objects.filter(user_id__in=favorites), UserProfileSerializer)
+        return Response(UserProfileSerializer(profiles, many=True, context={
+            "request": request,
+            "unseen_counts": Message.unseen_counts(request.user.id, favorites),
+        }).data)
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        favorite_id = serializer.validated_data["favorite_id"]
+
+        if favorite_id == request.user.id or not CustomUser.objects.filter(id=favorite_id).exists():
+            return Response({"success": False, "message": "Favorite user not found"}, status=400)
+
+        favorite, _ = Favorite.objects.get_or_create(user_id=request.user.id)
+        if favorite.favorite.filter(id=favorite_id).exists():
+            favorite.favorite.remove(favorite_id)
+            is_favorite = False
+        else:
+            favorite.favorite.add(favorite_id)
+            is_favorite = True
+
+        return Response({"success": True, "favorite_id": favorite_id, "is_favorite": is_favorite})
+
+
 class SelfView(APIView):
     permission_classes = (IsAuthenticatedCustom,)
     serializer_class = UserProfileSerializer
@@ -190,6 +274,16 @@ class LogoutView(APIView):
     def get(self, request):
         user_id = request.user.id
 
-        Jwt.objects.filter(user_id=user_id).delete()
+        # Ends the session of this device, ?all=true signs out every device.
+        # Access tokens already handed out are revoked along with the sessions
+        sessions = Jwt.objects.filter(user_id=user_id)
+        if request.query_params.get("all", "").lower() in ("1", "true"):
+            revocation_list.revoke_user(user_id)
+        else:
+            decoded = Authentication.verify_token(request.headers["Authorization"][7:]) or {}
+            sessions = sessions.filter(id=decoded.get("sid"))
+            if "jti" in decoded:
+                revocation_list.revoke_token(decoded)
+        sessions.delete()
 
         return Response("logged out successfully", status=200)